@@ -1,4 +1,7 @@
 from table import DBTable
+from rmi import MultiLevelRMI
+from pgm import PGMIndex
+from radix_spline import RadixSpline
 import pandas as pd
 from simulation import *
 import math
@@ -44,7 +47,7 @@ def test_insertion_sizes(sizes, dir, filename: str, min_insertion_size = 1000):
         
             #evaluating start up time
             start = time.time()
-            db_table = DBTable(file_name=None, from_data=initial_df, sort_key='sid', index_levels=[1, 4, 8], hash_size=hash_size, depth_limit=limit)
+            db_table = DBTable(file_name=None, from_data=initial_df, sort_key='sid', index_levels="auto", hash_size=hash_size, depth_limit=limit)
             end = time.time()
             #evaluation insertion time
             start = time.time()
@@ -94,7 +97,7 @@ def test_sizes(sizes, dir, filename: str, min_insertion_size = 1000, swap=False)
             initial_df = df.iloc[0:initial_n]
         #evaluating start up time
         start = time.time()
-        db_table = DBTable(file_name=None, from_data=initial_df, sort_key='sid', index_levels=[1, 4, 8], hash_size=hash_size)
+        db_table = DBTable(file_name=None, from_data=initial_df, sort_key='sid', index_levels="auto", hash_size=hash_size)
         end = time.time()
         initialization_times.append(end - start)
         #evaluation insertion time
@@ -136,7 +139,7 @@ def test_depths(depths, dir, filename: str, min_insertion_size = 1000):
         initial_df = df.iloc[0:initial_n]
         #evaluating start up time
         start = time.time()
-        db_table = DBTable(file_name=None, from_data=initial_df, sort_key='sid', index_levels=[1, 4, 8], hash_size=hash_size, depth_limit=depth)
+        db_table = DBTable(file_name=None, from_data=initial_df, sort_key='sid', index_levels="auto", hash_size=hash_size, depth_limit=depth)
         end = time.time()
         initialization_times.append(end - start)
         #evaluation insertion time
@@ -234,7 +237,7 @@ def test_skewed_insertion(skews):
         start = time.time()
         df1, insert_df, df_combined_s = make_unique_uniform_and_skewed(
             N1, N2, universe, skew=s, rng=rng)
-        db_table = DBTable(file_name=None, from_data=df1, sort_key='value', index_levels=[1, 4, 8], hash_size=hash_size, depth_limit=50)
+        db_table = DBTable(file_name=None, from_data=df1, sort_key='value', index_levels="auto", hash_size=hash_size, depth_limit=50)
         end = time.time()
         initialization_times.append(end - start)
         #evaluation insertion time
@@ -403,10 +406,10 @@ def test_skewed_insertion(skews=None):
         initial_df = df1.copy()
 
         # Build DBTable from df1 (your implementation) and measure init time
-        # assume DBTable(file_name=None, from_data=df1, sort_key='value', index_levels=[1,4,8], hash_size=hash_size, depth_limit=50)
+        # assume DBTable(file_name=None, from_data=df1, sort_key='value', index_levels="auto", hash_size=hash_size, depth_limit=50)
         try:
             db_table = DBTable(file_name=None, from_data=df1, sort_key='value',
-                               index_levels=[1, 4, 8], hash_size=hash_size, depth_limit=50)
+                               index_levels="auto", hash_size=hash_size, depth_limit=50)
         except Exception as e:
             # If DBTable is not available, print a warning and skip insert timing/accuracy
             print(f"Warning: DBTable construction failed: {e}. Skipping DBTable-related timings for skew={s}.")
@@ -503,6 +506,67 @@ def test_skewed_insertion(skews=None):
 
 # Example usage:
 # results = test_skewed_insertion()
+
+def build_tuned_rmi(keys):
+    index = MultiLevelRMI(levels=MultiLevelRMI.tune(keys).levels)
+    index.fit(keys)
+    return index
+
+def benchmark_index(build, keys, queries, point_queries=1000):
+    #returns build time, batch lookup time per key and point lookup time per key
+    start = time.time()
+    index = build(keys)
+    build_time = time.time() - start
+    start = time.time()
+    _, found = index.lookup_many(queries)
+    batch_time = (time.time() - start) / len(queries)
+    assert found.all()
+    sample = queries[:point_queries]
+    start = time.time()
+    for q in sample:
+        index.lookup(q)
+    point_time = (time.time() - start) / len(sample)
+    return build_time, batch_time, point_time
+
+def test_index_engines(dir, filename, sort_key='sid', skews=None, epsilon=32):
+    #compares RMI against the single pass RadixSpline (and PGM) on the csv keys and on skewed keys
+    engines = {
+        "RMI (tuned)": build_tuned_rmi,
+        "RadixSpline": lambda keys: fit_index(RadixSpline(epsilon=epsilon), keys),
+        "PGM": lambda keys: fit_index(PGMIndex(epsilon=epsilon), keys),
+    }
+    rng = np.random.default_rng(seed=42)
+    datasets = {}
+    try:
+        df = pd.read_csv(dir + filename + '.csv')
+        datasets[filename] = np.sort(df[sort_key].values)
+    except FileNotFoundError:
+        print("Warning: {} not found, only benchmarking skewed keys".format(dir + filename + '.csv'))
+    if skews is None:
+        skews = [0.0, 0.5, 1.0, 1.5, 2.0]
+    universe = np.arange(1, 1_000_000 + 1)
+    for s in skews:
+        _, _, df_combined = make_unique_uniform_and_skewed(100_000, 50_000, universe, skew=s, rng=rng)
+        datasets[s] = np.sort(df_combined["value"].values)
+
+    results = {}
+    for name, keys in datasets.items():
+        queries = rng.permutation(keys)
+        for engine, build in engines.items():
+            results[(name, engine)] = benchmark_index(build, keys, queries)
+            build_time, batch_time, point_time = results[(name, engine)]
+            print("{} on {}: build {:.4f}s, batch lookup {:.1f}ns/key, point lookup {:.1f}us/key".format(
+                engine, name, build_time, batch_time * 1e9, point_time * 1e6))
+    labels = list(engines.keys())
+    plot(skews, [[results[(s, e)][0] for s in skews] for e in labels], labels, x_label="skew", y_label="Build Time (s)",
+         title="Index Build Time on Skewed Keys", saveas='results/index_engines_build.png')
+    plot(skews, [[results[(s, e)][1] * 1e9 for s in skews] for e in labels], labels, x_label="skew", y_label="Batch Lookup (ns/key)",
+         title="Index Batch Lookup Time on Skewed Keys", saveas='results/index_engines_lookup.png')
+    return results
+
+def fit_index(index, keys):
+    index.fit(keys)
+    return index
    
         
     
@@ -528,4 +592,7 @@ if __name__ == '__main__':
     sizes = [.10, .20, .40, .80, 1]
     test_insertion_sizes(sizes=sizes, dir=dir, filename=filename)
     
+    #compare index engines (RMI vs RadixSpline vs PGM) on build and lookup time
+    # test_index_engines(dir=dir, filename=filename)
+    
     
\ No newline at end of file
@@ -0,0 +1,345 @@
+"""
+This file includes a gapped-array data node in the style of ALEX (Ding et al., 2020).
+A node keeps its keys and rows in arrays with free slots (gaps) left between them.
+Keys are placed at the positions a linear model of the node predicts, so a lookup
+searches a few slots around the prediction, and an insert usually lands in a gap
+next to its sorted position, shifting elements only up to the nearest gap.
+Every gap holds a copy of the next key to its right (the last key for trailing
+gaps), which keeps the key array sorted so it can be searched as a whole.
+Nodes count the cost of their lookups and inserts, and adjustment compares it
+with what a fresh build promised to decide whether to expand, retrain or split.
+DBTable(layout="gapped") partitions its rows into these nodes instead of
+keeping a slot (an ExtensibleHash once written) per row.
+"""
+
+import numpy as np
+from rmi import exponential_search
+from key_encoding import as_key_array
+
+#slots searched on either side of the predicted one before galloping
+WINDOW = 8
+#default cost model, microseconds per operation as measured on this implementation (on one
+#machine, pass the node's search_cost, search_step_cost and shift_cost for another): a lookup
+#costs SEARCH_COST plus SEARCH_STEP_COST per galloping step past the window, an insert
+#SHIFT_COST more per element it shifts
+SEARCH_COST = 3.3
+SEARCH_STEP_COST = 0.7
+SHIFT_COST = 0.006
+#observed cost over expected cost past which a full node splits instead of expanding,
+#and a node that is not full is retrained
+SPLIT_DEVIATION = 1.5
+RETRAIN_DEVIATION = 2.0
+#operations a node must see after a build before its statistics are trusted
+MIN_SAMPLES = 64
+
+
+def _model(keys, capacity):
+    # least squares line from numeric keys to their rank, scaled to the node's capacity;
+    # None for keys the model can not regress on (they are spread evenly instead)
+    n = len(keys)
+    if keys.dtype.kind not in "biuf" or n < 2:
+        return None
+    x = keys.astype(np.float64)
+    ranks = np.arange(n, dtype=np.float64) * (capacity / n)
+    x_mean = x.mean()
+    var = ((x - x_mean) ** 2).sum()
+    slope = ((x - x_mean) * (ranks - ranks.mean())).sum() / var if var > 0 else 0.0
+    return slope, ranks.mean() - slope * x_mean
+
+
+def _search_steps(distance):
+    #galloping steps exponential_search takes to reach a slot distance away from the prediction
+    return np.where(distance <= WINDOW, 0, np.ceil(np.log2(np.maximum(distance - WINDOW, 0) + 1)))
+
+
+def _fill(keys, start, stop, key):
+    # keys[start:stop] = key, one slot at a time for object arrays (a tuple key
+    # would otherwise be taken for a sequence of values)
+    if keys.dtype == object:
+        for i in range(start, stop):
+            keys[i] = key
+    else:
+        keys[start:stop] = key
+
+
+class GappedNode:
+    """
+    Gapped array of rows sorted by key, with the same container surface as
+    ExtensibleHash (get, insert_item, delete, get_data, n_items, min / max fences).
+    init_density: fraction of slots used right after a (re)build.
+    max_density: an insert that would pass it first expands the node (a rebuild at
+      init_density that also retrains the model).
+    min_density: a delete that leaves the node below it contracts the node.
+    search_cost, search_step_cost, shift_cost: weights of the cost model (see SEARCH_COST).
+    Since its last build a node counts its lookups (every lower_bound), the galloping
+    steps they took, its inserts and the elements they shifted.
+    """
+    def __init__(self, get_key_val, keys=(), rows=(), init_density=0.6, max_density=0.8, min_density=0.25,
+                 search_cost=SEARCH_COST, search_step_cost=SEARCH_STEP_COST, shift_cost=SHIFT_COST):
+        assert 0 < min_density < init_density < max_density < 1
+        self.get_key_val = get_key_val
+        self.init_density = init_density
+        self.max_density = max_density
+        self.min_density = min_density
+        self.search_cost = search_cost
+        self.search_step_cost = search_step_cost
+        self.shift_cost = shift_cost
+        self._build(as_key_array(keys), list(rows))
+
+    def _build(self, keys, rows, capacity=None):
+        # lay out sorted keys / rows at their model positions (strictly increasing, within capacity)
+        n = len(keys)
+        if capacity is None:
+            capacity = max(16, int(np.ceil(n / self.init_density)))
+        self.model = _model(keys, capacity)
+        if self.model is not None:
+            pred = np.rint(self.model[0] * keys.astype(np.float64) + self.model[1])
+            pred = np.clip(np.nan_to_num(pred), 0, capacity - 1).astype(np.int64)
+        else:
+            pred = (np.arange(n) * capacity) // max(1, n)
+        idx = np.arange(n)
+        positions = np.minimum(np.maximum.accumulate(pred - idx), capacity - n) + idx
+        self.capacity = capacity
+        self.keys = np.empty(capacity, dtype=keys.dtype if n else np.float64)
+        self.occupied = bytearray(capacity)
+        self.rows = [None] * capacity
+        self.n_items = n
+        self.lookups = self.search_steps = self.inserts = self.shifts = 0
+        #what the layout promises: galloping steps per lookup and shifts per insert
+        self.expected_steps = self.expected_shifts = 0.0
+        if n == 0:
+            self.min = self.max = None
+            return
+        if self.model is not None:
+            model_pred = np.clip(np.nan_to_num(self.model[0] * keys.astype(np.float64) + self.model[1]), 0, capacity - 1)
+            self.expected_steps = float(_search_steps(np.abs(positions - model_pred.astype(np.int64))).mean())
+        else:
+            self.expected_steps = float(_search_steps(np.array([capacity]))[0])
+        #an insert into a run of occupied slots shifts about a quarter of it
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], (np.diff(positions) == 1).astype(np.int8), [0]))))
+        runs = edges[1::2] - edges[::2] + 1
+        self.expected_shifts = float((runs ** 2).sum() / (4 * n))
+        # every slot takes the key of the next element, trailing gaps the last one
+        nxt = np.searchsorted(positions, np.arange(capacity), side='left')
+        self.keys[:] = keys[np.minimum(nxt, n - 1)]
+        np.frombuffer(self.occupied, dtype=np.uint8)[positions] = 1
+        for p, row in zip(positions.tolist(), rows):
+            self.rows[p] = row
+        self.min = keys[0]
+        self.max = keys[-1]
+
+    def items(self):
+        #(keys, rows) of the stored elements in key order
+        positions = np.flatnonzero(np.frombuffer(self.occupied, dtype=np.uint8))
+        return self.keys[positions], [self.rows[p] for p in positions.tolist()]
+
+    def _predict(self, key):
+        if self.model is None:
+            return self.capacity // 2
+        pred = self.model[0] * float(key) + self.model[1]
+        return max(0, min(self.capacity - 1, int(pred))) if pred == pred else 0
+
+    def lower_bound(self, key):
+        # first slot whose key is >= key, searched from the model's prediction
+        self.lookups += 1
+        if self.model is None:
+            self.search_steps += self.capacity.bit_length()
+            return exponential_search(self.keys, key, 0, self.capacity - 1)
+        pred = self._predict(key)
+        #most keys sit within a few slots of their prediction; farther ones are galloped to
+        p = exponential_search(self.keys, key, max(0, pred - WINDOW), min(self.capacity - 1, pred + WINDOW))
+        if abs(p - pred) > WINDOW:
+            self.search_steps += (abs(p - pred) - WINDOW).bit_length()
+        return p
+
+    def might_contain(self, key_val):
+        try:
+            return self.min is not None and self.min <= key_val <= self.max
+        except TypeError:
+            return False
+
+    def get(self, key_val):
+        if not self.might_contain(key_val):
+            return None
+        p = self.lower_bound(key_val)
+        if p == self.capacity or self.keys[p] != key_val:
+            return None
+        #a gap holding the key is followed by the element itself
+        return self.rows[self.occupied.find(1, p)]
+
+    def get_many(self, keys, hashes=None):
+        '''
+        get for a 1D array of keys, returning a list aligned with it (None where absent).
+        The keys are searched together over the whole node, so they are not counted in
+        the lookup statistics. hashes is unused (it mirrors ExtensibleHash.get_many).
+        '''
+        rows = [None] * len(keys)
+        if self.n_items == 0:
+            return rows
+        p = np.searchsorted(self.keys, keys, side='left')
+        hit = p < self.capacity
+        hit[hit] = self.keys[p[hit]] == keys[hit]
+        #a gap holding the key is followed by the element itself
+        elements = np.flatnonzero(np.frombuffer(self.occupied, dtype=np.uint8))
+        found = np.flatnonzero(hit)
+        for i, e in zip(found.tolist(), elements[np.searchsorted(elements, p[found])].tolist()):
+            rows[i] = self.rows[e]
+        return rows
+
+    def insert_item(self, item):
+        key = self.get_key_val(item)
+        if self.n_items == 0:
+            self._build(as_key_array([key]), [item])
+            return
+        self._fit_dtype(key)
+        if self.n_items + 1 > self.max_density * self.capacity:
+            self.expand()
+        p = self.lower_bound(key)
+        #the new element goes strictly between the element before p and the one at / after p
+        before = self.occupied.rfind(1, 0, p)
+        after = self.occupied.find(1, p)
+        if after == -1:
+            after = self.capacity
+        if after - before > 1:
+            pos = max(before + 1, min(after - 1, self._predict(key)))
+            _fill(self.keys, before + 1, pos, key)
+            if after == self.capacity:
+                _fill(self.keys, pos + 1, self.capacity, key)
+        else:
+            #no gap in between: shift the elements up to the nearest gap
+            right = self.occupied.find(0, after)
+            left = self.occupied.rfind(0, 0, before + 1)
+            if right != -1 and (left == -1 or right - after <= before - left):
+                self.keys[after + 1:right + 1] = self.keys[after:right]
+                self.rows[after + 1:right + 1] = self.rows[after:right]
+                self.occupied[right] = 1
+                self.shifts += right - after
+                pos = after
+            else:
+                self.keys[left:before] = self.keys[left + 1:before + 1]
+                self.rows[left:before] = self.rows[left + 1:before + 1]
+                self.occupied[left] = 1
+                self.shifts += before - left
+                pos = before
+        self.keys[pos] = key
+        self.rows[pos] = item
+        self.occupied[pos] = 1
+        self.n_items += 1
+        self.inserts += 1
+        if self.min is None or key < self.min:
+            self.min = key
+        if self.max is None or key > self.max:
+            self.max = key
+
+    def _fit_dtype(self, key):
+        # widen the key array for a key its dtype can not hold (a float among ints, text among numbers)
+        kind = self.keys.dtype.kind
+        if kind == "O" or (isinstance(key, (bool, int, np.integer)) and kind in "biuf"):
+            return
+        if isinstance(key, (float, np.floating)):
+            if kind != "f":
+                self.keys = self.keys.astype(np.float64)
+            return
+        self.keys = self.keys.astype(object)
+        self.model = None
+
+    def expand(self):
+        #rebuild at init_density with a retrained model
+        keys, rows = self.items()
+        self._build(keys, rows)
+
+    def merge(self, keys, rows):
+        #insert the sorted keys / rows in one rebuild rather than one at a time
+        own_keys, own_rows = self.items()
+        merged = as_key_array(own_keys.tolist() + list(keys))
+        order = np.argsort(merged, kind='stable')
+        rows = own_rows + list(rows)
+        self._build(merged[order], [rows[i] for i in order.tolist()])
+
+    def retrain(self):
+        #refit the model and spread the elements again, keeping the capacity
+        keys, rows = self.items()
+        self._build(keys, rows, capacity=self.capacity)
+
+    def cost(self):
+        #observed microseconds per operation since the last build
+        lookups = max(1, self.lookups)
+        return self.search_cost + (self.search_step_cost * self.search_steps + self.shift_cost * self.shifts) / lookups
+
+    def expected_cost(self):
+        #microseconds per operation the last build promised, for the observed share of inserts
+        insert_share = self.inserts / max(1, self.lookups)
+        return self.search_cost + self.search_step_cost * self.expected_steps + self.shift_cost * self.expected_shifts * insert_share
+
+    def adjustment(self, max_items=None):
+        '''
+        What the node's owner should do before the next insert into it:
+        "split" into two siblings (see split) when the node holds max_items, or when it is full
+          and its operations cost SPLIT_DEVIATION times what its last build promised;
+        "expand" when it is full otherwise;
+        "retrain" when it is not full but costs RETRAIN_DEVIATION times what was promised;
+        None to insert as is. Without max_items the node has no owner to split it.
+        '''
+        full = self.n_items + 1 > self.max_density * self.capacity
+        if max_items is not None and self.n_items >= max_items:
+            return "split"
+        if self.lookups < MIN_SAMPLES:
+            return "expand" if full else None
+        deviation = self.cost() / self.expected_cost()
+        if full:
+            return "split" if max_items is not None and deviation > SPLIT_DEVIATION else "expand"
+        return "retrain" if deviation > RETRAIN_DEVIATION else None
+
+    def delete(self, key_val):
+        '''
+        Deletes every element stored under key_val and returns how many there were.
+        '''
+        if not self.might_contain(key_val):
+            return 0
+        p = self.lower_bound(key_val)
+        removed = 0
+        q = self.occupied.find(1, p) if p < self.capacity else -1
+        while q != -1 and self.keys[q] == key_val:
+            self.occupied[q] = 0
+            self.rows[q] = None
+            removed += 1
+            q = self.occupied.find(1, q + 1)
+        if not removed:
+            return 0
+        self.n_items -= removed
+        if self.n_items == 0 or (self.capacity > 16 and self.n_items < self.min_density * self.capacity):
+            keys, rows = self.items()
+            self._build(keys, rows)
+            return removed
+        #the freed slots (and the gaps before them) copy the next key, or the last one at the end
+        before = self.occupied.rfind(1, 0, p)
+        if q == -1:
+            _fill(self.keys, before + 1, self.capacity, self.keys[before])
+            self.max = self.keys[before]
+        else:
+            _fill(self.keys, before + 1, q, self.keys[q])
+        if before == -1:
+            self.min = self.keys[q]
+        return removed
+
+    def split(self):
+        '''
+        Two nodes holding the lower and upper half of the elements, cut where the key
+        changes so a key never spans both; None when every element has the same key.
+        '''
+        keys, rows = self.items()
+        n = len(keys)
+        cuts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        if len(cuts) == 0:
+            return None
+        cut = int(cuts[np.argmin(np.abs(cuts - n // 2))])
+        params = dict(init_density=self.init_density, max_density=self.max_density, min_density=self.min_density,
+                      search_cost=self.search_cost, search_step_cost=self.search_step_cost, shift_cost=self.shift_cost)
+        return (GappedNode(self.get_key_val, keys[:cut], rows[:cut], **params),
+                GappedNode(self.get_key_val, keys[cut:], rows[cut:], **params))
+
+    def get_data(self):
+        return np.asarray(self.items()[1])
+
+    def __str__(self, ):
+        return "capacity: {}, items: {}, keys: {}".format(self.capacity, self.n_items, self.items()[0].tolist())
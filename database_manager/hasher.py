@@ -1,146 +1,536 @@
-import hashlib
+from array import array
 import numpy as np
+from hashing import HASH_FUNCTIONS
+from key_encoding import as_key_array
+
+_MASK = (1 << 64) - 1
+
+def fingerprint(hash_val):
+    #one byte of the hash that the directory never looks at (it uses the low bits)
+    return (hash_val >> 56) & 0xFF
+
+
+_ZEROS = {}
+
+#get_many routes a batch with NumPy from this many keys on; below it the fixed cost of the
+#array operations is more than the per-key routing they save
+_MANY_MIN_KEYS = 32
+
+
+def _zeros(typecode, size):
+    #copies of a cached zeroed array are much cheaper than array(typecode, bytes(...))
+    zeros = _ZEROS.get((typecode, size))
+    if zeros is None:
+        zeros = _ZEROS[(typecode, size)] = array(typecode, bytes(8 * size))
+    return zeros[:]
+
+
+def _key_array(key, size):
+    #contiguous storage for a bucket's keys: int64 or float64 when the first key is one, else a list
+    kind = type(key)
+    if kind is int or (isinstance(key, (int, np.integer)) and kind is not bool):
+        return _zeros('q', size)
+    if kind is float or isinstance(key, np.floating):
+        return _zeros('d', size)
+    return [None] * size
+
 
 class Bucket:
+    """
+    Columnar bucket: keys in a typed array, a parallel bytearray of one-byte hash
+    fingerprints and the rows themselves. A probe scans the fingerprints (in C,
+    with bytearray.find) and compares keys only where they match, so a lookup
+    touches at most one row in the common case.
+    Keys that no split can separate (duplicates, colliding hashes) go to overflow
+    pages chained from the bucket through next_page; chain_hash is the (masked)
+    hash they all share.
+    """
+    __slots__ = ("local_depth", "init_size", "size", "next_index", "keys", "fingerprints", "rows", "next_page", "chain_hash")
+
     def __init__(self, init_size, local_depth):
         self.local_depth = local_depth
         self.init_size = init_size
-        self.memory = [None] * init_size
         self.size = init_size
         self.next_index = 0
+        #created on the first insert, when the key type is known
+        self.keys = None
+        self.fingerprints = bytearray(init_size)
+        self.rows = [None] * init_size
+        self.next_page = None
+        self.chain_hash = None
+
+    @property
+    def memory(self):
+        #rows of this page by position, None past next_index
+        return self.rows
     
     def is_full(self):
-        return self.next_index >= self.size
+        #every page of the chain is full
+        page = self
+        while page.next_page is not None:
+            page = page.next_page
+        return page.next_index >= page.size
     
-    def insert(self, item):
-        if self.is_full():
-            return False
-        self.memory[self.next_index] = item
-        self.next_index += 1
+    def _store_key(self, i, key):
+        if self.keys is None:
+            self.keys = _key_array(key, self.size)
+        keys = self.keys
+        if type(keys) is array:
+            #an int stored in a float array would be rounded; anything else that does not fit moves the keys to a list
+            fits = keys.typecode == 'q' or isinstance(key, (float, np.floating))
+            if fits:
+                try:
+                    keys[i] = key
+                    return
+                except (TypeError, OverflowError):
+                    pass
+            keys = self.keys = list(keys)
+        keys[i] = key
+    
+    def insert(self, item, key, fp):
+        #into the first page with room, False when the chain is full
+        page = self
+        while page.next_index >= page.size:
+            page = page.next_page
+            if page is None:
+                return False
+        i = page.next_index
+        page._store_key(i, key)
+        page.fingerprints[i] = fp
+        page.rows[i] = item
+        page.next_index = i + 1
+        return True
+    
+    def append(self, item, key, fp):
+        #insert, chaining a new page when the chain is full
+        if not self.insert(item, key, fp):
+            page = self
+            while page.next_page is not None:
+                page = page.next_page
+            page.next_page = Bucket(self.init_size, self.local_depth)
+            page.next_page.insert(item, key, fp)
     
-    def retrieve_item(self, query_item, val_extractor):
-        for item in self.memory:
-            if item is not None and val_extractor(item) == query_item:
-                return item
+    def retrieve_item(self, query_item, fp):
+        page = self
+        while page is not None:
+            fingerprints = page.fingerprints
+            end = page.next_index
+            i = fingerprints.find(fp, 0, end)
+            while i != -1:
+                if page.keys[i] == query_item:
+                    return page.rows[i]
+                i = fingerprints.find(fp, i + 1, end)
+            page = page.next_page
         return None
     
-    def overflow(self, hasher, val_extractor):
+    def entries(self):
+        #(row, key, fingerprint) of every item in the chain
+        entries = []
+        page = self
+        while page is not None:
+            n = page.next_index
+            entries += zip(page.rows[:n], page.keys[:n] if n else (), page.fingerprints[:n])
+            page = page.next_page
+        return entries
+    
+    def count(self):
+        n = 0
+        page = self
+        while page is not None:
+            n += page.next_index
+            page = page.next_page
+        return n
+    
+    def _clear(self):
+        self.keys = None
+        self.rows = [None] * self.size
+        self.next_index = 0
+        self.next_page = None
+        self.chain_hash = None
+    
+    def remove(self, key, fp):
+        #drops every entry under key (the rest keep their order), returns how many there were
+        entries = self.entries()
+        kept = [entry for entry in entries if entry[2] != fp or entry[1] != key]
+        if len(kept) == len(entries):
+            return 0
+        chain_hash = self.chain_hash
+        self._clear()
+        for row, kept_key, kept_fp in kept:
+            self.append(row, kept_key, kept_fp)
+        if self.next_page is not None:
+            self.chain_hash = chain_hash
+        return len(entries) - len(kept)
+    
+    def all_rows(self):
+        rows = []
+        page = self
+        while page is not None:
+            rows += page.rows[:page.next_index]
+            page = page.next_page
+        return rows
+    
+    def overflow(self, hasher):
+        #the stored keys are rehashed, the rows are never read
         self.local_depth += 1
+        bit = 1 << (self.local_depth - 1)
         other_bucket = Bucket(self.init_size, self.local_depth)
-        updated_memory = [None] * self.init_size
-        i = 0
-        for item in self.memory:
-            if item is None:
-                break
-            hash_val = hasher(val_extractor(item))
-            if hash_val & (1 << (self.local_depth - 1)):
-                other_bucket.insert(item)
-            else:
-                updated_memory[i] = item
-                i += 1
-        self.memory = updated_memory
-        self.next_index = i
+        entries = self.entries()
+        chain_hash = self.chain_hash
+        self._clear()
+        for row, key, fp in entries:
+            target = other_bucket if hasher(key) & bit else self
+            target.append(row, key, fp)
+        #a chain only holds keys sharing their hash, so it moves whole to one side
+        for bucket in (self, other_bucket):
+            if bucket.next_page is not None:
+                bucket.chain_hash = chain_hash
         return other_bucket
     
     def __str__(self, ):
         
-        return "local depth:{}, {}".format(str(self.local_depth), self.memory)
+        return "local depth:{}, {}".format(str(self.local_depth), self.all_rows())
         
 
 class ExtensibleHash:
-    def __init__(self, get_key_val,init_size = 10, init_depth = 0):
-        #TODO: do something with init depth
-        #Memory is a list of lists
-        self.memory = [Bucket(init_size, init_depth)]
+    def __init__(self, get_key_val,init_size = 10, init_depth = 0, hash_fn="splitmix64", max_depth=24):
+        '''
+        :param hash_fn: name in hashing.HASH_FUNCTIONS ("splitmix64" default, "sha256")
+            or any callable mapping a key to a non-negative int
+        :param max_depth: deepest local (and so global) depth a split may reach; keys that
+            only differ past it, or not at all, are chained in overflow pages instead
+        '''
+        assert init_depth <= max_depth < 64
+        #Memory is the list of buckets, each one stored once
+        self.memory = [Bucket(init_size, 0)]
         self.get_key_val = get_key_val
-        #represent the bucket index it a memory point should refer to
-        self.references = [0]
+        #directory: bucket id (index into memory) of every one of the 2 ** global_depth slots
+        self.directory = np.zeros(1 << init_depth, dtype=np.int64)
         self.global_depth = init_depth
+        self.max_depth = max_depth
+        self.init_size = init_size
+        self.init_depth = init_depth
+        #items stored, over every bucket and overflow page
+        self.n_items = 0
+        #fences: smallest and largest key inserted (kept through deletes, None when empty)
         self.min = None
         self.max = None
-            
-    def normalize_for_hash(self, value):
-        if isinstance(value, (np.generic,)):  
-            value = value.item()
-
-        # Convert Python native types to string
-        if isinstance(value, (int, float, str)):
-            return str(value)
+        if isinstance(hash_fn, str):
+            self.hash, self._hash_many = HASH_FUNCTIONS[hash_fn]
+        else:
+            self.hash, self._hash_many = hash_fn, None
+    
+    def hash_many(self, values):
+        #hashes of a whole array of keys, vectorized when the hash function has a NumPy variant
+        if self._hash_many is not None:
+            return self._hash_many(values)
+        return [self.hash(value) for value in values]
 
-        if isinstance(value, bytes):
-            try:
-                return value.decode('utf-8')
-            except UnicodeDecodeError:
-                return value.hex()
+    @classmethod
+    def from_items(cls, items, get_key_val, init_size=10, init_depth=0, hash_fn="splitmix64", max_depth=24):
+        '''
+        Builds the table that inserting the items one by one with insert_item would
+        end with (same buckets, local depths and directory; rows keep their order
+        within a bucket), without any intermediate doubling or splitting.
+        The batch is hashed once; going down one hash bit per round, the groups of
+        up to init_size items become buckets at that local depth and larger groups
+        are split in two (possibly leaving an empty bucket, as a split does).
+        Larger groups that no split within max_depth bits can separate become a
+        bucket with overflow pages. With such groups the chains can differ from
+        the ones an insert order would give, which only depend on that order.
+        '''
+        hash_ds = cls(get_key_val, init_size=init_size, init_depth=init_depth, hash_fn=hash_fn, max_depth=max_depth)
+        if not isinstance(items, list):
+            items = list(items)
+        keys = [get_key_val(item) for item in items]
+        n = len(items)
+        if n <= init_size:
+            #everything fits in the first bucket
+            for item, key in zip(items, keys):
+                hash_ds.memory[0].insert(item, key, fingerprint(hash_ds.hash(key)))
+            hash_ds.n_items = n
+            if n:
+                hash_ds.min, hash_ds.max = min(keys), max(keys)
+            return hash_ds
+        #only the low 64 bits are used (directory and fingerprint), whatever the hash width
+        hashes = np.fromiter((int(h) & _MASK for h in hash_ds.hash_many(as_key_array(keys))), dtype=np.uint64, count=n)
+        separating = hashes & np.uint64((1 << max_depth) - 1)
+        bucket_of = np.empty(n, dtype=np.int64)
+        buckets, patterns = [], []
+        pending = np.arange(n)
+        #patterns of the groups at this depth, sorted
+        nodes = np.zeros(1, dtype=np.uint64)
+        depth = 0
+        while len(nodes):
+            node_of = np.searchsorted(nodes, hashes[pending] & np.uint64((1 << depth) - 1))
+            split = np.bincount(node_of, minlength=len(nodes)) > init_size
+            if split.any():
+                #groups whose keys share all max_depth bits stay together
+                low = np.full(len(nodes), np.iinfo(np.uint64).max, dtype=np.uint64)
+                high = np.zeros(len(nodes), dtype=np.uint64)
+                np.minimum.at(low, node_of, separating[pending])
+                np.maximum.at(high, node_of, separating[pending])
+                chained = low == high if depth < max_depth else np.ones(len(nodes), dtype=bool)
+                split &= ~chained
+            ids = np.full(len(nodes), -1, dtype=np.int64)
+            ids[~split] = np.arange(len(buckets), len(buckets) + int((~split).sum()))
+            for pattern in nodes[~split]:
+                buckets.append(Bucket(init_size, depth))
+                patterns.append(int(pattern))
+            placed = ~split[node_of]
+            bucket_of[pending[placed]] = ids[node_of[placed]]
+            pending = pending[~placed]
+            parents = nodes[split]
+            nodes = np.sort(np.concatenate([parents, parents | np.uint64(1 << depth)]))
+            depth += 1
+        fingerprints = (hashes >> np.uint64(56)).astype(np.uint8)
+        for i in range(n):
+            buckets[bucket_of[i]].append(items[i], keys[i], fingerprints[i])
+        filled, first = np.unique(bucket_of, return_index=True)
+        for bucket_id, i in zip(filled, first):
+            if buckets[bucket_id].next_page is not None:
+                buckets[bucket_id].chain_hash = int(separating[i])
+        hash_ds.global_depth = max(init_depth, max(b.local_depth for b in buckets))
+        hash_ds.directory = np.empty(1 << hash_ds.global_depth, dtype=np.int64)
+        for bucket_id, (bucket, pattern) in enumerate(zip(buckets, patterns)):
+            hash_ds.directory[pattern::1 << bucket.local_depth] = bucket_id
+        hash_ds.memory = buckets
+        hash_ds.n_items = n
+        hash_ds.min, hash_ds.max = min(keys), max(keys)
+        return hash_ds
 
-        if value is None:
-            return "None"
-        return str(value)
+    @classmethod
+    def singletons(cls, items, keys, get_key_val, init_size=10, init_depth=0, hash_fn="splitmix64", max_depth=24):
+        '''
+        One single-item table per item (what from_items([item]) builds for each),
+        for a whole batch: the keys (keys[i] is get_key_val(items[i])) are hashed in
+        one vectorized call and the tables are set up without going through insert_item.
+        '''
+        template = cls(get_key_val, init_size=init_size, init_depth=init_depth, hash_fn=hash_fn, max_depth=max_depth)
+        n = len(items)
+        if isinstance(keys, np.ndarray) and keys.dtype == object:
+            #numeric keys out of an object array (rows of mixed columns) are hashed as a typed array
+            key_array = as_key_array(keys.tolist())
+        else:
+            key_array = as_key_array(keys)
+        hashes = np.fromiter((int(h) & _MASK for h in template.hash_many(key_array)), dtype=np.uint64, count=n)
+        fingerprints = (hashes >> np.uint64(56)).astype(np.uint8).tolist()
+        state = template.__dict__
+        slots = 1 << init_depth
+        tables = [None] * n
+        for i in range(n):
+            key = keys[i]
+            bucket = Bucket(init_size, 0)
+            bucket.insert(items[i], key, fingerprints[i])
+            hash_ds = cls.__new__(cls)
+            hash_ds.__dict__.update(state)
+            hash_ds.memory = [bucket]
+            hash_ds.directory = np.zeros(slots, dtype=np.int64)
+            hash_ds.n_items = 1
+            hash_ds.min = hash_ds.max = key
+            tables[i] = hash_ds
+        return tables
 
-    
-    def hash(self, value):
-        value = self.normalize_for_hash(value)
-        return int(hashlib.sha256(value.encode('utf-8')).hexdigest(), 16)
-    
     def get_index(self, val):
-        return self.hash(val) % (2 ** self.global_depth)
+        return self.hash(val) & ((1 << self.global_depth) - 1)
     
     def double_buckets(self):
+        #the new upper half of the slots has the same low bits as the lower half
         self.global_depth += 1
-        self.memory += ([None] * len(self.memory))
-        self.references += [i for i in range(len(self.references))]
+        self.directory = np.tile(self.directory, 2)
     
     def get_bucket(self, index):
-        while self.references[index] != index:
-            index = self.references[index]
-        return index, self.memory[index]
-    
-    def overflow_bucket(self, bucket_index, bucket: Bucket):
-        overflow_bucket_id = bucket_index + (2 ** bucket.local_depth)
-        self.references[overflow_bucket_id] = overflow_bucket_id
-        overflow_bucket = bucket.overflow(hasher = self.hash, val_extractor=self.get_key_val)
-        self.memory[overflow_bucket_id] = overflow_bucket     
+        bucket_id = int(self.directory[index])
+        return bucket_id, self.memory[bucket_id]
+    
+    def overflow_bucket(self, index, bucket: Bucket):
+        #slots of the bucket share its low local_depth bits; those with the next bit set move to the new bucket
+        depth = bucket.local_depth
+        pattern = index & ((1 << depth) - 1)
+        overflow_bucket = bucket.overflow(hasher = self.hash)
+        self.directory[pattern | (1 << depth)::1 << (depth + 1)] = len(self.memory)
+        self.memory.append(overflow_bucket)
             
     
     def insert_item(self, item):
         '''
-        Docstring for insert_item
+        Inserts item under its key, splitting full buckets (doubling the directory
+        when needed) until one has room. Splits only happen while they can still
+        separate the keys within max_depth bits; otherwise the item goes to an
+        overflow page of its bucket.
         
         :param self: Description
         :param item: Description
         '''
         val = self.get_key_val(item)
-        bucket_index = self.get_index(val)
-        search_index, bucket = self.get_bucket(bucket_index)
-        if bucket.is_full():
+        hash_val = self.hash(val)
+        fp = fingerprint(hash_val)
+        while True:
+            bucket_index = hash_val & ((1 << self.global_depth) - 1)
+            search_index, bucket = self.get_bucket(bucket_index)
+            if bucket.insert(item, val, fp):
+                break
+            if not self._separable(bucket, hash_val):
+                bucket.chain_hash = hash_val & ((1 << self.max_depth) - 1)
+                bucket.append(item, val, fp)
+                break
             if bucket.local_depth == self.global_depth:
                 self.double_buckets()
             else:
-                self.overflow_bucket(search_index, bucket) #this shouldn't be here quite yet?
-            self.insert_item(item) #keeps doubling as long as space is required
-        else:
-            #update self.values
-            bucket.insert(item)    
+                self.overflow_bucket(bucket_index, bucket)
+        self.n_items += 1
+        if self.min is None:
+            self.min = self.max = val
+        elif val < self.min:
+            self.min = val
+        elif val > self.max:
+            self.max = val
+    
+    def might_contain(self, key_val):
+        '''
+        False when key_val is outside the [min, max] key fences, so surely not stored.
+        There is no Bloom filter on top: once hashed, a key's bucket fingerprints
+        rule it out about as cheaply as filter bits would.
+        '''
+        try:
+            return self.min is not None and self.min <= key_val <= self.max
+        except TypeError:
+            #not comparable with the stored keys, so not one of them
+            return False
+    
+    def _separable(self, bucket, hash_val):
+        #whether splitting bucket, at most max_depth bits deep, can part hash_val from its keys
+        if bucket.local_depth >= self.max_depth:
+            return False
+        mask = ((1 << self.max_depth) - 1) ^ ((1 << bucket.local_depth) - 1)
+        if bucket.chain_hash is not None:
+            return (bucket.chain_hash ^ hash_val) & mask != 0
+        keys = bucket.keys
+        for i in range(bucket.next_index):
+            if (self.hash(keys[i]) ^ hash_val) & mask:
+                return True
+        return False
+    
+    def delete(self, key_val):
+        '''
+        Deletes every item stored under key_val and returns how many there were.
+        A bucket whose items, together with its buddy's (the bucket that the split of
+        their common parent created), fit in half a bucket merges with it, as far up
+        as that holds, and the directory halves while no bucket needs its top bit.
+        '''
+        hash_val = self.hash(key_val)
+        index = hash_val & ((1 << self.global_depth) - 1)
+        bucket_id, bucket = self.get_bucket(index)
+        removed = bucket.remove(key_val, fingerprint(hash_val))
+        if removed:
+            self.n_items -= removed
+            if self.n_items == 0:
+                self.min = self.max = None
+            self._merge_buddies(index, bucket_id)
+            while self.global_depth > self.init_depth:
+                half = 1 << (self.global_depth - 1)
+                if not np.array_equal(self.directory[:half], self.directory[half:]):
+                    break
+                self.directory = self.directory[:half].copy()
+                self.global_depth -= 1
+        return removed
+    
+    def _merge_buddies(self, index, bucket_id):
+        while True:
+            bucket = self.memory[bucket_id]
+            depth = bucket.local_depth
+            if depth == 0:
+                return
+            bit = 1 << (depth - 1)
+            low = index & (bit - 1)
+            buddy_id = int(self.directory[(index ^ bit) & ((1 << depth) - 1)])
+            buddy = self.memory[buddy_id]
+            if buddy.local_depth != depth or bucket.count() + buddy.count() > self.init_size // 2:
+                return
+            #the bucket without the bit keeps the items, the other one is dropped
+            keep_id, drop_id = (buddy_id, bucket_id) if index & bit else (bucket_id, buddy_id)
+            keep, drop = self.memory[keep_id], self.memory[drop_id]
+            for row, key, fp in drop.entries():
+                keep.append(row, key, fp)
+            keep.local_depth -= 1
+            self.directory[low | bit::bit << 1] = keep_id
+            #the last bucket takes the dropped bucket's id so memory stays dense
+            last_id = len(self.memory) - 1
+            if drop_id != last_id:
+                self.memory[drop_id] = self.memory[last_id]
+                self.directory[self.directory == last_id] = drop_id
+                if keep_id == last_id:
+                    keep_id = drop_id
+            self.memory.pop()
+            index, bucket_id = low, keep_id
     
     def get_depth(self):
         return self.global_depth
     
     def get(self, key_val):
-        bucket_index = self.get_index(key_val)
-        search_index, bucket = self.get_bucket(bucket_index)
-        return bucket.retrieve_item(key_val, self.get_key_val)
-    
+        #keys outside the fences are turned away before hashing
+        try:
+            if self.min is None or key_val < self.min or key_val > self.max:
+                return None
+        except TypeError:
+            return None
+        hash_val = self.hash(key_val)
+        search_index, bucket = self.get_bucket(hash_val & ((1 << self.global_depth) - 1))
+        return bucket.retrieve_item(key_val, fingerprint(hash_val))
+
+    def get_many(self, keys, hashes=None):
+        '''
+        get for a 1D array of keys, returning a list aligned with it (None where absent).
+        For a batch of numeric keys the fences, directory slots and fingerprints are worked
+        out for all keys at once, leaving only the bucket probe (a bytearray.find) per key.
+        Buckets hold a handful of keys, so comparing them as arrays would cost more than it saves.
+        :param hashes: hash_many(keys) when the caller already has it, otherwise the
+            keys are hashed here in one call
+        '''
+        if hashes is None:
+            hashes = self.hash_many(keys)
+        rows = [None] * len(keys)
+        if self.min is None:
+            return rows
+        if len(keys) >= _MANY_MIN_KEYS and keys.dtype.kind in "biuf":
+            try:
+                inside = np.flatnonzero((keys >= self.min) & (keys <= self.max))
+            except TypeError:
+                return rows
+            if not isinstance(hashes, np.ndarray) or hashes.dtype != np.uint64:
+                hashes = np.fromiter((int(h) & _MASK for h in hashes), dtype=np.uint64, count=len(keys))
+            hashes = hashes[inside]
+            bucket_ids = self.directory[(hashes & np.uint64((1 << self.global_depth) - 1)).astype(np.int64)]
+            fingerprints = (hashes >> np.uint64(56)).astype(np.uint8)
+            memory = self.memory
+            for i, key_val, bucket_id, fp in zip(inside.tolist(), keys[inside].tolist(), bucket_ids.tolist(), fingerprints.tolist()):
+                rows[i] = memory[bucket_id].retrieve_item(key_val, fp)
+            return rows
+        if isinstance(hashes, np.ndarray):
+            hashes = hashes.tolist()
+        mask = (1 << self.global_depth) - 1
+        for i, (key_val, hash_val) in enumerate(zip(keys.tolist(), hashes)):
+            try:
+                outside = key_val < self.min or key_val > self.max
+            except TypeError:
+                outside = True
+            if outside:
+                continue
+            search_index, bucket = self.get_bucket(hash_val & mask)
+            rows[i] = bucket.retrieve_item(key_val, fingerprint(hash_val))
+        return rows
+
     def __str__(self, ):
         bucket_info = ""
         for i, bucket in enumerate(self.memory):
             bucket_info += "\n {}: {}".format(i, bucket)
-        return "Global Depth: {}\n References: {}".format(self.global_depth, self.references) +  "Buckets: {}".format(bucket_info)
+        return "Global Depth: {}\n Directory: {}".format(self.global_depth, self.directory.tolist()) +  "Buckets: {}".format(bucket_info)
     
     def get_data(self):
         data = []
         for bucket in self.memory:
             if bucket is not None:
-                data += bucket.memory[0: bucket.next_index]
+                data += bucket.all_rows()
         return np.asarray(data)
                 
 
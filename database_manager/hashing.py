@@ -0,0 +1,182 @@
+"""
+This file includes the hash functions used by ExtensibleHash.
+The default is a 64-bit splitmix64 finalizer applied directly to ints and to the
+bits of floats (strings and other keys are mixed from Python's own hash), with
+a NumPy variant that hashes whole key arrays at once (same values as the scalar
+function).
+sha256_key keeps the original string + SHA-256 hash for comparison.
+BloomFilter is a small filter over these hashes, used to skip probes of slots
+that can not hold a key.
+"""
+
+import hashlib
+import struct
+import numpy as np
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_MIX_1 = 0xBF58476D1CE4E5B9
+_MIX_2 = 0x94D049BB133111EB
+_NONE_HASH = 0x5BD1E9955BD1E995
+
+
+def splitmix64(x):
+    """
+    splitmix64 finalizer of an int in [0, 2**64): every input bit affects every output bit,
+    so the low bits ExtensibleHash uses for its directory are well mixed.
+    """
+    z = (x + _GOLDEN) & _MASK
+    z = ((z ^ (z >> 30)) * _MIX_1) & _MASK
+    z = ((z ^ (z >> 27)) * _MIX_2) & _MASK
+    return z ^ (z >> 31)
+
+
+def hash_key(value):
+    """
+    64-bit hash of a key. Ints, integral floats and bools (which compare equal in
+    Python) share the int hash; other floats are hashed by their bits. Strings,
+    bytes and tuples go through Python's own hash (SipHash for str/bytes, salted
+    per process, which is fine for in-memory tables) before the final mix.
+    """
+    kind = type(value)
+    if kind is int and -(1 << 63) <= value < (1 << 64):
+        return splitmix64(value & _MASK)
+    if isinstance(value, (bool, int, np.integer)):
+        value = int(value)
+        if -(1 << 63) <= value < (1 << 64):
+            return splitmix64(value & _MASK)
+        return splitmix64(hash(value) & _MASK)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if value.is_integer() and -(1 << 63) <= value < (1 << 63):
+            return splitmix64(int(value) & _MASK)
+        return splitmix64(struct.unpack("<Q", struct.pack("<d", value))[0])
+    if value is None:
+        return _NONE_HASH
+    try:
+        return splitmix64(hash(value) & _MASK)
+    except TypeError:
+        # unhashable keys (e.g. lists) hash by their string form
+        return splitmix64(hash(str(value)) & _MASK)
+
+
+def _splitmix64_array(z):
+    # splitmix64 on a uint64 array; uint64 products wrap modulo 2**64 like the & _MASK above
+    with np.errstate(over="ignore"):
+        z = z + np.uint64(_GOLDEN)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(_MIX_1)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(_MIX_2)
+    return z ^ (z >> np.uint64(31))
+
+
+def hash_many(keys):
+    """
+    Vectorized hash_key for a whole array of keys. Returns a uint64 array.
+    Integer and float arrays are hashed with NumPy arithmetic; other dtypes
+    (strings, objects) fall back to hash_key per key.
+    """
+    keys = np.asarray(keys)
+    if keys.dtype.kind in "biu":
+        return _splitmix64_array(keys.astype(np.int64 if keys.dtype.kind != "u" else np.uint64).astype(np.uint64))
+    if keys.dtype.kind == "f":
+        x = keys.astype(np.float64)
+        integral = np.isfinite(x) & (x == np.floor(x)) & (x >= -2.0 ** 63) & (x < 2.0 ** 63)
+        bits = x.view(np.uint64).copy()
+        bits[integral] = x[integral].astype(np.int64).astype(np.uint64)
+        return _splitmix64_array(bits)
+    return np.fromiter((hash_key(k) for k in keys.reshape(-1)), dtype=np.uint64, count=keys.size)
+
+
+def _normalize_for_sha256(value):
+    if isinstance(value, (np.generic,)):
+        value = value.item()
+
+    # Convert Python native types to string
+    if isinstance(value, (int, float, str)):
+        return str(value)
+
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value.hex()
+
+    if value is None:
+        return "None"
+    return str(value)
+
+
+def sha256_key(value):
+    """
+    The original ExtensibleHash hash: the key's string form through SHA-256.
+    """
+    value = _normalize_for_sha256(value)
+    return int(hashlib.sha256(value.encode('utf-8')).hexdigest(), 16)
+
+
+# name -> (scalar hash, vectorized hash or None), for ExtensibleHash(hash_fn="name")
+HASH_FUNCTIONS = {
+    "splitmix64": (hash_key, hash_many),
+    "sha256": (sha256_key, None),
+}
+
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit key hashes (any hash_key-like value, only its low 64
+    bits are used). Every hash sets `probes` bits chosen by double hashing
+    (Kirsch & Mitzenmacher) in a power-of-two bit array of about bits_per_key bits
+    per key of capacity, so with 3 probes and 10 bits per key at most about 2%
+    of absent keys pass. Past capacity the false positive rate climbs; owners rebuild it
+    larger (see full).
+    """
+    __slots__ = ("bits", "mask", "probes", "count", "capacity")
+
+    def __init__(self, capacity, bits_per_key=10, probes=3):
+        n_bits = 64
+        while n_bits < capacity * bits_per_key:
+            n_bits *= 2
+        self.bits = bytearray(n_bits // 8)
+        self.mask = n_bits - 1
+        self.probes = probes
+        self.count = 0
+        self.capacity = capacity
+
+    @classmethod
+    def from_hashes(cls, hashes, headroom=2, bits_per_key=10, probes=3):
+        """
+        Filter holding every hash of the uint64 array, sized for headroom times as many.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        bloom = cls(max(1, len(hashes)) * headroom, bits_per_key=bits_per_key, probes=probes)
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        view = np.frombuffer(bloom.bits, dtype=np.uint8)
+        with np.errstate(over="ignore"):
+            for i in range(probes):
+                p = (h1 + np.uint64(i) * h2) & np.uint64(bloom.mask)
+                np.bitwise_or.at(view, (p >> np.uint64(3)).astype(np.int64), (np.uint8(1) << (p & np.uint64(7)).astype(np.uint8)))
+        bloom.count = len(hashes)
+        return bloom
+
+    def add(self, hash_val):
+        h1 = hash_val & 0xFFFFFFFF
+        h2 = ((hash_val >> 32) & 0xFFFFFFFF) | 1
+        bits, mask = self.bits, self.mask
+        for i in range(self.probes):
+            p = (h1 + i * h2) & mask
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def might_contain(self, hash_val):
+        h1 = hash_val & 0xFFFFFFFF
+        h2 = ((hash_val >> 32) & 0xFFFFFFFF) | 1
+        bits, mask = self.bits, self.mask
+        for i in range(self.probes):
+            p = (h1 + i * h2) & mask
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def full(self):
+        return self.count > self.capacity
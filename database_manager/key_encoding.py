@@ -0,0 +1,155 @@
+"""
+This file includes the key encoding used to learn indexes over non-numeric keys.
+The learned models regress on float64 keys; KeyEncoder maps strings, bytes and
+tuples of sortable values to floats without breaking their order, so any
+sortable column can be indexed. Different keys may share a float (e.g. strings
+with a long common prefix); searches still compare the original keys, so a tie
+only widens the error window of the leaf it falls in.
+"""
+
+import struct
+import numpy as np
+
+_INT, _FLOAT, _BYTES = 0, 1, 2
+_NUMBERS = (bool, int, float, np.integer, np.floating)
+
+
+def needs_encoding(keys):
+    """
+    True when keys cannot be regressed on directly (anything but bools, ints and floats).
+    """
+    if isinstance(keys, np.ndarray) and keys.dtype.kind != "O":
+        return keys.dtype.kind not in "biuf"
+    return len(keys) > 0 and not isinstance(keys[0], _NUMBERS)
+
+
+def as_key_array(keys):
+    """
+    1D array of keys. Numeric keys keep their dtype; anything else goes in an
+    object array so keys compare as Python values and strings are never cut to
+    a fixed width (as np.insert does on a "<U" array).
+    """
+    if isinstance(keys, np.ndarray) and keys.ndim == 1 and keys.dtype.kind in "biufO":
+        return keys
+    keys = list(keys)
+    if all(isinstance(k, _NUMBERS) for k in keys):
+        return np.asarray(keys)
+    array = np.empty(len(keys), dtype=object)
+    for i, k in enumerate(keys):
+        array[i] = k
+    return array
+
+
+def _kind(value):
+    if isinstance(value, (bool, int, np.integer)):
+        return _INT
+    if isinstance(value, (float, np.floating)):
+        return _FLOAT
+    if isinstance(value, (str, bytes, np.str_, np.bytes_)):
+        return _BYTES
+    raise TypeError("Can not encode key component of type {}".format(type(value).__name__))
+
+
+def _float_code(value):
+    # IEEE 754 bits reordered so that integer order matches float order
+    bits = struct.unpack(">Q", struct.pack(">d", float(value)))[0]
+    if bits >> 63:
+        return bits ^ 0xFFFFFFFFFFFFFFFF
+    return bits | (1 << 63)
+
+
+def _as_bytes(value):
+    # utf-8 byte order is code point order, which is how Python orders str
+    return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+
+class _Component:
+    """
+    Order-preserving integer code of one tuple position, shifted by the smallest
+    code seen in fit and clipped to the bits that fit needed.
+    """
+    def __init__(self, values, prefix_bytes):
+        kinds = {_kind(v) for v in values}
+        if _BYTES in kinds and len(kinds) > 1:
+            raise TypeError("Key component mixes text and numbers")
+        if _BYTES in kinds:
+            self.kind = _BYTES
+        elif _FLOAT in kinds:
+            self.kind = _FLOAT
+        else:
+            self.kind = _INT
+        self.prefix_bytes = prefix_bytes
+        self.prefix = b""
+        if self.kind == _BYTES:
+            # bytes shared by every key carry no information: code the bytes after them
+            raw = [_as_bytes(v) for v in values]
+            first, last = min(raw), max(raw)
+            n = 0
+            while n < min(len(first), len(last)) and first[n] == last[n]:
+                n += 1
+            self.prefix = first[:n]
+        codes = [self.code(v) for v in values]
+        self.low = min(codes) if codes else 0
+        self.bits = (max(codes) - self.low).bit_length() if codes else 0
+
+    def code(self, value):
+        if self.kind == _INT:
+            return int(value) if _kind(value) == _INT else int(np.floor(value))
+        if self.kind == _FLOAT:
+            return _float_code(value)
+        raw = _as_bytes(value)
+        head = raw[:len(self.prefix)]
+        if head < self.prefix:
+            return -1
+        if head > self.prefix:
+            return 1 << (8 * self.prefix_bytes)
+        tail = raw[len(self.prefix):len(self.prefix) + self.prefix_bytes]
+        return int.from_bytes(tail.ljust(self.prefix_bytes, b"\0"), "big")
+
+    def field(self, value):
+        return min(max(self.code(value) - self.low, 0), (1 << self.bits) - 1)
+
+
+class KeyEncoder:
+    """
+    Order-preserving map from keys to float64 for the learned models.
+    Scalar keys are one component, tuples one component per position; tuples
+    must all have the same length. Each component becomes an integer code
+    (ints as is, floats by their reordered IEEE bits, str/bytes by the first
+    prefix_bytes bytes after the prefix common to every fitted key), offset by
+    its minimum and given just the bits its fitted range needs. The fields are
+    concatenated most significant first (lexicographic order) and the top 64
+    bits become the float. Keys outside the fitted range clip to the nearest edge.
+    """
+    def __init__(self, prefix_bytes=8):
+        assert prefix_bytes >= 1
+        self.prefix_bytes = prefix_bytes
+        self.components = None
+
+    def fit(self, keys):
+        """
+        Learn the per-component prefixes and ranges from the (sorted) keys.
+        """
+        keys = list(keys)
+        self.is_tuple = len(keys) > 0 and isinstance(keys[0], tuple)
+        rows = [k if self.is_tuple else (k,) for k in keys]
+        width = len(rows[0]) if rows else 1
+        if any(len(r) != width for r in rows):
+            raise ValueError("Tuple keys must all have the same length")
+        self.components = [_Component([r[c] for r in rows], self.prefix_bytes) for c in range(width)]
+        self.total_bits = sum(c.bits for c in self.components)
+        return self
+
+    def encode(self, key):
+        if self.components is None:
+            raise RuntimeError("KeyEncoder not fitted. Call fit(keys) first.")
+        parts = key if self.is_tuple else (key,)
+        value = 0
+        for component, part in zip(self.components, parts):
+            value = (value << component.bits) | component.field(part)
+        if self.total_bits > 64:
+            value >>= self.total_bits - 64
+        return float(value)
+
+    def encode_many(self, keys):
+        return np.fromiter((self.encode(k) for k in keys), dtype=np.float64, count=len(keys))
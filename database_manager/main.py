@@ -15,7 +15,7 @@ class Commands(Enum):
 class Examples(Enum):
     create_table = "create table cats columns: [key, color]"
     insert = 'insert cats (cat1, black)'
-    delete = 'delete ?'
+    delete = "delete from cats where key = 'cat1'"
     select = "select from cats where sid = 'cat1'"
     connect = 'connect table cats'
     load_table = "load table sailors key = 'sid' depth_limit=5"
@@ -37,7 +37,6 @@ if __name__ == "__main__":
         elif query.startswith(Commands.select.value):
             # try:
                 table_name, key_value = parse.select_entity(query)
-                key_value = int(key_value)
                 db.select(table_name=table_name, key_value=key_value)
             # except:
             #     print("Error parsing. I.e: ", Examples.select.value)
@@ -53,6 +52,12 @@ if __name__ == "__main__":
                 db.insert(table_name, entity)
             # except:
             #     print("Error parsing. I.e: ", Examples.insert.value)
+        elif query.startswith(Commands.delete.value):
+            try:
+                table_name, key_value = parse.delete_entity(query)
+                db.delete(table_name=table_name, key_value=key_value)
+            except:
+                print("Error parsing. I.e: ", Examples.delete.value)
         elif query.startswith(Commands.load_table.value):
             # try:
                 table_name, key_name, limit = parse.load_table(query)
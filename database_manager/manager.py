@@ -21,7 +21,7 @@ class DataManager:
         for col_name, entity_val in zip(db_table.schema, entity):
             row[col_name] = [entity_val]
         df = pd.DataFrame(row)
-        df[db_table.sort_key] = df[db_table.sort_key].apply(lambda x: int(x))
+        df[db_table.sort_key] = df[db_table.sort_key].apply(db_table.coerce_key)
         row = df.iloc[0]
         db_table.insert(row)
         print("Inserted row: ", row, "to: ", table_name)
@@ -31,20 +31,25 @@ class DataManager:
     def select(self, table_name, key_value):
         #returns the dictionary representation of the tuple
         db_table = self.tables[table_name]
-        result = db_table.select(key_value)
+        result = db_table.select(db_table.coerce_key(key_value))
         print('Result: ', result)
 
+    #from table_name delete where key = key_value
+    def delete(self, table_name, key_value):
+        db_table = self.tables[table_name]
+        removed = db_table.delete(db_table.coerce_key(key_value))
+        print("Deleted", removed, "rows from:", table_name)
+
     def load_table(self, table_name:str, key_name, limit):
         #read file name and save as hash indexes
-        db_table = DBTable(file_name="data/original_csv/" +table_name + ".csv", sort_key=key_name, index_levels=[1, 4, 6], hash_size=10, init_depth=0, depth_limit=limit)
+        db_table = DBTable(file_name="data/original_csv/" +table_name + ".csv", sort_key=key_name, index_levels="auto", hash_size=10, init_depth=0, depth_limit=limit)
         self.tables[table_name] = db_table
-        print("Created table,", table_name ,"with schema: ", db_table.schema, "with depth limit: ", limit)
+        print("Created table,", table_name ,"with schema: ", db_table.schema, "with depth limit: ", limit, "and index levels: ", db_table.li.levels)
     
     def connect(self, table_name:str):
         pass
     
 
-#Considerations for future, delete using key value and using tuple that matches it? 
 
     
         
\ No newline at end of file
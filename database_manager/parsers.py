@@ -55,6 +55,17 @@ def select_entity(query):
         raise ValueError("String not in expected format")
     return table_name, key_value
 
+def delete_entity(query):
+    pattern = r"delete from\s+([A-Za-z_][A-Za-z0-9_]*)\s+where\s+key\s*=\s*'([A-Za-z0-9_]+)'"
+    match = re.search(pattern, query)
+
+    if match:
+        table_name = match.group(1)
+        key_value = match.group(2)
+    else:
+        raise ValueError("String not in expected format")
+    return table_name, key_value
+
 #TODO: should it load in in-memory value of Learned Index or relearn?
 def connect(query):
     pattern = r"connect table\s+(\w+)"
@@ -0,0 +1,242 @@
+"""
+This file includes a PGM-style (piecewise geometric model) learned index.
+Segments are built with the streaming shrinking-cone algorithm: every segment
+is anchored at its first key and keeps the range of slopes that still predict
+every key of the segment within epsilon positions. When the range becomes
+empty a new segment is started, so the build is a single O(N) pass.
+The first keys of the segments are indexed the same way (with
+epsilon_recursive) until a single root segment is left.
+"""
+
+import numpy as np
+from rmi import bounded_search, exponential_search, windowed_lower_bound
+
+
+def build_segments(x, positions, epsilon):
+    """
+    One streaming pass over sorted x (float keys) and their positions.
+    Returns (first_keys, slopes, intercepts) where segment j predicts
+      intercepts[j] + slopes[j] * (key - first_keys[j])
+    within epsilon of the position of every key it covers.
+    """
+    first_keys = []
+    slopes = []
+    intercepts = []
+    n = len(x)
+    i = 0
+    while i < n:
+        k0 = x[i]
+        p0 = positions[i]
+        slope_lo = 0.0
+        slope_hi = np.inf
+        j = i + 1
+        # the cone is narrowed over blocks of keys at once (running max/min of the
+        # per-key slope limits); blocks double so the pass stays linear overall
+        block = 16
+        while j < n:
+            end = min(n, j + block)
+            dx = x[j:end] - k0
+            lo = np.maximum.accumulate(np.maximum((positions[j:end] - epsilon - p0) / dx, slope_lo))
+            hi = np.minimum.accumulate(np.minimum((positions[j:end] + epsilon - p0) / dx, slope_hi))
+            broken = np.flatnonzero(lo > hi)
+            if len(broken):
+                # the first key that does not fit the cone starts the next segment
+                b = broken[0]
+                if b > 0:
+                    slope_lo = lo[b - 1]
+                    slope_hi = hi[b - 1]
+                j += b
+                break
+            slope_lo = lo[-1]
+            slope_hi = hi[-1]
+            j = end
+            block *= 2
+        if slope_hi == np.inf:
+            # single key segment
+            slope = 0.0
+        else:
+            slope = (slope_lo + slope_hi) / 2
+        first_keys.append(k0)
+        slopes.append(slope)
+        intercepts.append(p0)
+        i = j
+    return (np.asarray(first_keys, dtype=np.float64), np.asarray(slopes, dtype=np.float64),
+            np.asarray(intercepts, dtype=np.float64))
+
+
+class EpsilonBoundedIndex:
+    """
+    Shared lookup surface for indexes whose predictions are within a fixed
+    epsilon of the true position (PGMIndex, RadixSpline).
+    Subclasses set N, keys, epsilon and trained in fit and implement
+    _predict_pos_and_error (scalar) and _predict_many (float array -> float predictions).
+    """
+    def _predict_window(self, key):
+        """
+        Returns (pos, lo, hi): the key's position, if present, is guaranteed to lie in [lo, hi].
+        """
+        pos, err, _ = self._predict_pos_and_error(key)
+        last = max(0, self.N - 1)
+        pos = max(0, min(last, pos))
+        return pos, max(0, pos - err), min(last, pos + err)
+
+    def lower_bound(self, key):
+        """
+        Position of the first key >= key (N when every key is smaller).
+        """
+        if self.N == 0:
+            return 0
+        _, lo, hi = self._predict_window(key)
+        return exponential_search(self.keys, key, lo, hi)
+
+    def lookup(self, key):
+        """
+        Returns index of key if found, else -1.
+        """
+        found_index = self.lower_bound(key)
+        if found_index < self.N and self.keys[found_index] == key:
+            return found_index
+        return -1
+
+    def predict_many(self, keys):
+        """
+        Batch version of _predict_pos_and_error.
+        Returns predicted positions and error bounds as int arrays.
+        """
+        x = np.asarray(keys, dtype=np.float64).reshape(-1)
+        positions = np.rint(self._predict_many(x)).astype(np.int64)
+        # +1 absorbs rounding of the prediction and of the float model parameters
+        return positions, np.full(len(positions), self.epsilon + 1, dtype=np.int64)
+
+    def _predict_windows(self, keys):
+        # batch version of _predict_window
+        positions, err = self.predict_many(keys)
+        last = max(0, self.N - 1)
+        pos = np.clip(positions, 0, last)
+        return pos, np.clip(pos - err, 0, last), np.clip(pos + err, 0, last)
+
+    def lower_bound_many(self, keys):
+        """
+        Batch version of lower_bound.
+        """
+        keys = np.asarray(keys).reshape(-1)
+        if self.N == 0:
+            return np.zeros(len(keys), dtype=np.int64)
+        _, lo, hi = self._predict_windows(keys)
+        return windowed_lower_bound(self.keys, keys, lo, hi)
+
+    def lookup_many(self, keys):
+        """
+        Batch version of lookup.
+        Returns (positions, found) where positions[i] is the index of keys[i]
+        (-1 when missing) and found is the boolean mask of hits.
+        """
+        keys = np.asarray(keys).reshape(-1)
+        if self.N == 0:
+            return np.full(len(keys), -1, dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        idx = self.lower_bound_many(keys)
+        in_range = idx < self.N
+        found = np.zeros(len(keys), dtype=bool)
+        found[in_range] = self.keys[idx[in_range]] == keys[in_range]
+        return np.where(found, idx, -1), found
+
+
+class PGMIndex(EpsilonBoundedIndex):
+    """
+    Piecewise linear learned index with a hard error guarantee.
+    epsilon: maximum distance between a key's predicted and true position.
+    epsilon_recursive: error allowed in the upper levels that index segment first keys.
+    Exposes the same surface as MultiLevelRMI (fit, _predict_pos_and_error,
+    _predict_window, lower_bound, lookup, predict_many, lower_bound_many, lookup_many) so DBTable can use either.
+    """
+    def __init__(self, epsilon=64, epsilon_recursive=4):
+        assert epsilon >= 1 and epsilon_recursive >= 1
+        self.epsilon = epsilon
+        self.epsilon_recursive = epsilon_recursive
+        self.trained = False
+
+    def fit(self, keys):
+        """
+        Build the index on sorted keys with implicit positions [0..N-1].
+        Duplicate keys are modelled at their first position, which is what a
+        lower bound search returns.
+        """
+        keys = np.asarray(keys)
+        assert keys.ndim == 1
+        self.N = len(keys)
+        self.keys = keys
+        x, first_pos = np.unique(keys.astype(np.float64), return_index=True)
+        # levels[0] models the data, levels[-1] is the single root segment
+        self.first_keys = []
+        self.slopes = []
+        self.intercepts = []
+        positions = first_pos.astype(np.float64)
+        epsilon = self.epsilon
+        while True:
+            first_keys, slopes, intercepts = build_segments(x, positions, epsilon)
+            self.first_keys.append(first_keys)
+            self.slopes.append(slopes)
+            self.intercepts.append(intercepts)
+            if len(first_keys) <= 1:
+                break
+            x = first_keys
+            positions = np.arange(len(first_keys), dtype=np.float64)
+            epsilon = self.epsilon_recursive
+        self.trained = True
+
+    def _segment_pred(self, l, seg, key):
+        return self.intercepts[l][seg] + self.slopes[l][seg] * (key - self.first_keys[l][seg])
+
+    def _find_segment(self, l, key, pred):
+        # segment of level l covering key: last first key <= key, searched around pred
+        first_keys = self.first_keys[l]
+        last = len(first_keys) - 1
+        pos = int(round(pred))
+        lo = max(0, min(last, pos - self.epsilon_recursive - 1))
+        hi = max(0, min(last, pos + self.epsilon_recursive + 1))
+        idx = exponential_search(first_keys, key, lo, hi)
+        if idx > last or first_keys[idx] != key:
+            idx -= 1
+        return max(0, idx)
+
+    def _predict_pos_and_error(self, key, level_route=None):
+        """
+        Predict position by descending from the root segment.
+        Returns predicted_pos, the guaranteed error bound and the segment chosen per level (root first).
+        """
+        if not self.trained:
+            raise RuntimeError("PGM index not trained. Call fit(keys) first.")
+        if level_route is None:
+            level_route = []
+        key = float(key)
+        top = len(self.first_keys) - 1
+        seg = 0
+        level_route.append(seg)
+        for l in range(top, 0, -1):
+            pred = float(self._segment_pred(l, seg, key))
+            seg = self._find_segment(l - 1, key, pred)
+            level_route.append(seg)
+        pred = float(self._segment_pred(0, seg, key))
+        # +1 absorbs rounding of the prediction and of the cone's float slopes
+        return int(round(pred)), self.epsilon + 1, level_route
+
+    def _predict_many(self, x):
+        if not self.trained:
+            raise RuntimeError("PGM index not trained. Call fit(keys) first.")
+        seg = np.zeros(len(x), dtype=np.int64)
+        for l in range(len(self.first_keys) - 1, 0, -1):
+            pred = self._segment_pred(l, seg, x)
+            first_keys = self.first_keys[l - 1]
+            last = len(first_keys) - 1
+            pos = np.rint(pred)
+            lo = np.clip(pos - self.epsilon_recursive - 1, 0, last).astype(np.int64)
+            hi = np.clip(pos + self.epsilon_recursive + 1, 0, last).astype(np.int64)
+            idx = bounded_search(first_keys, x, lo, hi)
+            # the guarantee only covers first keys, so re-search anything that left its window
+            stray = ((idx == lo) & (lo > 0) & (first_keys[np.maximum(lo - 1, 0)] >= x)) | \
+                    ((idx > hi) & (idx <= last) & (first_keys[np.minimum(idx, last)] < x))
+            if stray.any():
+                idx[stray] = np.searchsorted(first_keys, x[stray], side='left')
+            exact = (idx <= last) & (first_keys[np.minimum(idx, last)] == x)
+            seg = np.maximum(np.where(exact, idx, idx - 1), 0)
+        return self._segment_pred(0, seg, x)
@@ -0,0 +1,175 @@
+"""
+This file includes a RadixSpline learned index (Kipf et al., 2020).
+A greedy spline corridor picks spline points from the sorted keys so that
+linear interpolation between consecutive points is within epsilon of every
+key's position. A radix table over the top bits of the (scaled) keys then
+narrows the search for a key's spline segment to a few spline points.
+Both are built in a single pass, which suits build-once / read-many bulk loads.
+"""
+
+import math
+import numpy as np
+from pgm import EpsilonBoundedIndex
+
+
+def build_spline(x, positions, epsilon):
+    """
+    Greedy spline corridor over sorted unique x (float keys) and their positions.
+    Returns the indices (into x) of the spline points; the first and last key are always included.
+    """
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+    spline = [0]
+    base = 0
+    while base < n - 1:
+        xb = x[base]
+        yb = positions[base]
+        # corridor of slopes from the base point that keeps every key within epsilon
+        dx = x[base + 1] - xb
+        lo = (positions[base + 1] - epsilon - yb) / dx
+        hi = (positions[base + 1] + epsilon - yb) / dx
+        j = base + 2
+        next_base = n - 1
+        # keys are checked in doubling blocks: a key leaves the corridor when its own
+        # slope from the base falls outside the bounds set by the keys before it
+        block = 16
+        while j < n:
+            end = min(n, j + block)
+            dx = x[j:end] - xb
+            slopes = (positions[j:end] - yb) / dx
+            lo_run = np.maximum.accumulate(np.maximum((positions[j:end] - epsilon - yb) / dx, lo))
+            hi_run = np.minimum.accumulate(np.minimum((positions[j:end] + epsilon - yb) / dx, hi))
+            lo_prev = np.concatenate(([lo], lo_run[:-1]))
+            hi_prev = np.concatenate(([hi], hi_run[:-1]))
+            outside = np.flatnonzero((slopes < lo_prev) | (slopes > hi_prev))
+            if len(outside):
+                # the key before the first one outside the corridor becomes a spline point
+                next_base = j + outside[0] - 1
+                break
+            lo = lo_run[-1]
+            hi = hi_run[-1]
+            j = end
+            block *= 2
+        spline.append(next_base)
+        base = next_base
+    return np.asarray(spline, dtype=np.int64)
+
+
+class RadixSpline(EpsilonBoundedIndex):
+    """
+    Single-pass learned index: greedy spline plus radix table.
+    epsilon: maximum distance between a key's predicted and true position.
+    num_radix_bits: size of the radix table (2 ** bits entries), capped so the
+      table is not much larger than the number of spline points.
+    Exposes the same surface as MultiLevelRMI (fit, _predict_pos_and_error,
+    _predict_window, lower_bound, lookup, predict_many, lower_bound_many, lookup_many) so DBTable can use it.
+    """
+    def __init__(self, epsilon=32, num_radix_bits=18):
+        assert epsilon >= 1 and num_radix_bits >= 1
+        self.epsilon = epsilon
+        self.num_radix_bits = num_radix_bits
+        self.trained = False
+
+    def fit(self, keys):
+        """
+        Build the spline and radix table on sorted keys with implicit positions [0..N-1].
+        Duplicate keys are modelled at their first position, which is what a
+        lower bound search returns.
+        """
+        keys = np.asarray(keys)
+        assert keys.ndim == 1
+        self.N = len(keys)
+        self.keys = keys
+        x, first_pos = np.unique(keys.astype(np.float64), return_index=True)
+        positions = first_pos.astype(np.float64)
+        points = build_spline(x, positions, self.epsilon)
+        self.spline_keys = x[points]
+        self.spline_pos = positions[points]
+
+        # radix table: prefix p -> first spline point whose prefix is >= p
+        n_points = len(self.spline_keys)
+        self.radix_bits = int(min(self.num_radix_bits, max(1, np.ceil(np.log2(max(2, n_points))) + 1)))
+        n_prefixes = 1 << self.radix_bits
+        if n_points:
+            self.min_key = self.spline_keys[0]
+            key_range = self.spline_keys[-1] - self.min_key
+        else:
+            self.min_key = 0.0
+            key_range = 0.0
+        self.radix_scale = (n_prefixes - 1) / key_range if key_range > 0 else 0.0
+        prefixes = self._prefix(self.spline_keys)
+        self.radix_table = np.searchsorted(prefixes, np.arange(n_prefixes + 1), side='left')
+        self.trained = True
+
+    def _prefix(self, x):
+        prefix = np.floor((x - self.min_key) * self.radix_scale)
+        return np.clip(prefix, 0, (1 << self.radix_bits) - 1).astype(np.int64)
+
+    def _interpolate(self, seg, x):
+        last = len(self.spline_keys) - 1
+        right = np.minimum(seg + 1, last)
+        x0 = self.spline_keys[seg]
+        dx = self.spline_keys[right] - x0
+        y0 = self.spline_pos[seg]
+        dy = self.spline_pos[right] - y0
+        slope = np.divide(dy, dx, out=np.zeros(np.shape(dx)), where=dx > 0)
+        return y0 + (x - x0) * slope
+
+    def _predict_pos_and_error(self, key, level_route=None):
+        """
+        Predict position through the radix table and spline.
+        Returns predicted_pos, the guaranteed error bound and [spline segment] as route.
+        """
+        if not self.trained:
+            raise RuntimeError("RadixSpline not trained. Call fit(keys) first.")
+        if level_route is None:
+            level_route = []
+        key = float(key)
+        last = len(self.spline_keys) - 1
+        if last < 0:
+            level_route.append(0)
+            return 0, self.epsilon + 1, level_route
+        # same arithmetic as _prefix / _segments / _interpolate, on Python scalars
+        prefix = math.floor((key - self.min_key) * self.radix_scale)
+        prefix = max(0, min((1 << self.radix_bits) - 1, prefix))
+        begin = max(int(self.radix_table[prefix]) - 1, 0)
+        end = max(int(self.radix_table[prefix + 1]), begin + 1)
+        seg = begin + int(np.searchsorted(self.spline_keys[begin:end], key, side='right')) - 1
+        seg = max(0, min(last, seg))
+        level_route.append(seg)
+        right = min(seg + 1, last)
+        x0 = float(self.spline_keys[seg])
+        y0 = float(self.spline_pos[seg])
+        dx = float(self.spline_keys[right]) - x0
+        slope = (float(self.spline_pos[right]) - y0) / dx if dx > 0 else 0.0
+        pred = y0 + (key - x0) * slope
+        return int(round(pred)), self.epsilon + 1, level_route
+
+    def _segments(self, x):
+        # spline segment of every key: last spline point <= key, searched in the radix bucket
+        if len(self.spline_keys) == 0:
+            return np.zeros(len(x), dtype=np.int64)
+        prefix = self._prefix(x)
+        begin = np.maximum(self.radix_table[prefix] - 1, 0)
+        end = self.radix_table[prefix + 1]
+        # binary search in [begin, end) for the first spline key > x, all keys at once
+        lo = begin.copy()
+        hi = np.maximum(end, begin + 1)
+        last = len(self.spline_keys) - 1
+        while True:
+            active = lo < hi
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            go_right = active & (self.spline_keys[np.minimum(mid, last)] <= x)
+            lo = np.where(go_right, mid + 1, lo)
+            hi = np.where(active & ~go_right, mid, hi)
+        return np.clip(lo - 1, 0, last)
+
+    def _predict_many(self, x):
+        if not self.trained:
+            raise RuntimeError("RadixSpline not trained. Call fit(keys) first.")
+        if len(self.spline_keys) == 0:
+            return np.zeros(len(x))
+        return self._interpolate(self._segments(x), x)
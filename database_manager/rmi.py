@@ -11,16 +11,45 @@ AI use rationale:
 """
 
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from key_encoding import as_key_array
+
+# on-disk layout written by MultiLevelRMI.save: a fixed header followed by
+# 8-byte aligned arrays, so load can map every array straight out of the file
+_FILE_MAGIC = b"RMIINDEX"
+_FILE_VERSION = 3
+_HEADER_BYTES = 64
+# per-leaf int64 arrays written after the models, in this order
+_LEAF_ARRAYS = ("err_lo", "err_hi", "leaf_shift", "leaf_count", "leaf_min_pos", "leaf_max_pos", "leaf_inserts",
+                "leaf_kind")
+# leaf model families: leaf_kind holds the code, a row of leaf_params the parameters
+LEAF_LINEAR, LEAF_CUBIC, LEAF_SPLINE = 0, 1, 2
+_LEAF_FAMILIES = {"linear": LEAF_LINEAR, "cubic": LEAF_CUBIC, "spline": LEAF_SPLINE}
+# evaluation cost of a family on top of the linear model, in binary-search steps
+_LEAF_MODEL_COSTS = {"linear": 0.0, "cubic": 0.5, "spline": 1.0}
+_SPLINE_SEGMENTS = 4
+# cubic: center, scale, c0..c3; spline: knot keys then knot positions
+_LEAF_PARAMS = max(6, 2 * (_SPLINE_SEGMENTS + 1))
+# a leaf's delta is merged no sooner than this many pending changes (a merge has a fixed cost too)
+_MERGE_MIN_PENDING = 32
+# fit(workers=...) only goes parallel when every process gets at least this many keys
+_PARALLEL_MIN_KEYS = 1 << 16
 
 class SimpleModel:
     """
     Wrapper around a regression model. Exposes fit/predict.
     By default uses sklearn LinearRegression (fast). You can replace with MLPRegressor, etc.
+    Only used when a model_factory is passed to MultiLevelRMI; the default RMI
+    keeps its linear models as parameter arrays instead.
     """
     def __init__(self, model=None):
-        self.model = model or LinearRegression()
+        if model is None:
+            # sklearn is only needed for this optional model type
+            from sklearn.linear_model import LinearRegression
+            model = LinearRegression()
+        self.model = model
 
     def fit(self, X, y):
         # X: 1D array-like of keys -> reshape to (-1,1)
@@ -39,93 +68,603 @@ class SimpleModel:
             return 0.0
         return float(self.model.predict(x)[0, 0])
 
+    def predict_many(self, X):
+        X = np.asarray(X, dtype=np.float64).reshape(-1, 1)
+        if getattr(self, "empty", False):
+            return np.zeros(len(X))
+        return np.asarray(self.model.predict(X), dtype=np.float64).reshape(-1)
+
+
+def group_moments(groups, x, y, n_groups):
+    """
+    Per-group count, means and centered second moments of the samples (x, y).
+    Sums per group are taken with np.bincount; x and y are centered on the group
+    means before the second moments are summed so large keys do not lose precision.
+    Returns (counts, mean_x, mean_y, sxx, sxy), one float array per field.
+    """
+    counts = np.bincount(groups, minlength=n_groups).astype(np.float64)
+    safe_counts = np.maximum(counts, 1.0)
+    mean_x = np.bincount(groups, weights=x, minlength=n_groups) / safe_counts
+    mean_y = np.bincount(groups, weights=y, minlength=n_groups) / safe_counts
+    dx = x - mean_x[groups]
+    dy = y - mean_y[groups]
+    sxx = np.bincount(groups, weights=dx * dx, minlength=n_groups)
+    sxy = np.bincount(groups, weights=dx * dy, minlength=n_groups)
+    return counts, mean_x, mean_y, sxx, sxy
+
+
+def merge_moments(a, b):
+    """
+    Combine the group_moments of two disjoint sets of samples (pairwise update of
+    Chan et al.), so chunks of keys can be summarized separately.
+    """
+    count_a, mean_xa, mean_ya, sxx_a, sxy_a = a
+    count_b, mean_xb, mean_yb, sxx_b, sxy_b = b
+    counts = count_a + count_b
+    safe_counts = np.maximum(counts, 1.0)
+    delta_x = mean_xb - mean_xa
+    delta_y = mean_yb - mean_ya
+    mean_x = mean_xa + delta_x * count_b / safe_counts
+    mean_y = mean_ya + delta_y * count_b / safe_counts
+    cross = count_a * count_b / safe_counts
+    return (counts, mean_x, mean_y, sxx_a + sxx_b + delta_x * delta_x * cross,
+            sxy_a + sxy_b + delta_x * delta_y * cross)
+
+
+def moments_to_lines(moments):
+    # least squares line of every group; empty groups get (0, 0), single-key groups a flat line
+    _, mean_x, mean_y, sxx, sxy = moments
+    slopes = np.divide(sxy, sxx, out=np.zeros(len(sxx)), where=sxx > 0)
+    return slopes, mean_y - slopes * mean_x
+
+
+def segmented_linear_fit(groups, x, y, n_groups):
+    """
+    Closed-form least squares fit of y ~ slope * x + intercept for every group at once.
+    groups: int array assigning each sample to a group in [0, n_groups).
+    Empty groups get (0, 0) so they predict position 0, single-key groups get a flat line.
+    """
+    return moments_to_lines(group_moments(groups, x, y, n_groups))
+
+
+def fit_cubic_leaves(groups, x, y, n_groups):
+    """
+    Closed-form least squares cubic for every group at once.
+    Keys are centered on the group mean and scaled to [-1, 1] so the 4x4 normal
+    equations stay well conditioned; they are built from bincount power sums and
+    solved as one batch. Returns (params, ok): params rows are
+    (center, scale, c0, c1, c2, c3), ok marks groups with enough keys for a cubic.
+    """
+    counts = np.bincount(groups, minlength=n_groups).astype(np.float64)
+    safe_counts = np.maximum(counts, 1.0)
+    center = np.bincount(groups, weights=x, minlength=n_groups) / safe_counts
+    mean_y = np.bincount(groups, weights=y, minlength=n_groups) / safe_counts
+    dev = x - center[groups]
+    scale = np.zeros(n_groups)
+    np.maximum.at(scale, groups, np.abs(dev))
+    scale[scale == 0] = 1.0
+    t = dev / scale[groups]
+    dy = y - mean_y[groups]
+    powers = [np.ones(len(t))]
+    for _ in range(6):
+        powers.append(powers[-1] * t)
+    sums = np.stack([np.bincount(groups, weights=p, minlength=n_groups) for p in powers], axis=1)
+    rhs = np.stack([np.bincount(groups, weights=p * dy, minlength=n_groups) for p in powers[:4]], axis=1)
+    ok = counts >= 8
+    coef = np.zeros((n_groups, 4))
+    if ok.any():
+        normal = sums[ok][:, np.arange(4)[:, None] + np.arange(4)[None, :]]
+        coef[ok] = (np.linalg.pinv(normal) @ rhs[ok][:, :, None])[:, :, 0]
+    params = np.zeros((n_groups, _LEAF_PARAMS))
+    params[:, 0] = center
+    params[:, 1] = scale
+    params[:, 2] = coef[:, 0] + mean_y
+    params[:, 3:6] = coef[:, 1:]
+    return params, ok
+
+
+def fit_spline_leaves(groups, x, y, n_groups):
+    """
+    Linear spline for every group through _SPLINE_SEGMENTS + 1 of its own keys,
+    taken at evenly spaced ranks (first and last key included).
+    x must be sorted, so a group's keys in array order are in key order.
+    Returns (params, ok): params rows are the knot keys then the knot positions.
+    """
+    counts = np.bincount(groups, minlength=n_groups)
+    order = np.argsort(groups, kind='stable')
+    starts = np.cumsum(counts) - counts
+    fractions = np.linspace(0.0, 1.0, _SPLINE_SEGMENTS + 1)
+    ranks = np.rint(fractions[None, :] * np.maximum(counts - 1, 0)[:, None]).astype(np.int64)
+    knots = order[np.clip(starts[:, None] + ranks, 0, max(0, len(x) - 1))] if len(x) else ranks
+    params = np.zeros((n_groups, _LEAF_PARAMS))
+    ok = counts > _SPLINE_SEGMENTS
+    if len(x):
+        params[:, :_SPLINE_SEGMENTS + 1] = x[knots]
+        params[:, _SPLINE_SEGMENTS + 1:2 * _SPLINE_SEGMENTS + 2] = y[knots]
+    return params, ok
+
+
+def predict_leaves(kind, params, x):
+    """
+    Predictions of non-linear leaves. kind, params: per-key family code and
+    parameter row; x: float keys. Returns NaN for linear rows (predicted elsewhere).
+    """
+    preds = np.full(len(x), np.nan)
+    cubic = kind == LEAF_CUBIC
+    if cubic.any():
+        p = params[cubic]
+        t = (x[cubic] - p[:, 0]) / p[:, 1]
+        preds[cubic] = p[:, 2] + t * (p[:, 3] + t * (p[:, 4] + t * p[:, 5]))
+    spline = kind == LEAF_SPLINE
+    if spline.any():
+        p = params[spline]
+        xs = x[spline]
+        knot_x = p[:, :_SPLINE_SEGMENTS + 1]
+        knot_y = p[:, _SPLINE_SEGMENTS + 1:2 * _SPLINE_SEGMENTS + 2]
+        # segment: interior knots at or below the key; the end segments extrapolate
+        seg = np.sum(xs[:, None] >= knot_x[:, 1:_SPLINE_SEGMENTS], axis=1)
+        rows = np.arange(len(xs))
+        x0, x1 = knot_x[rows, seg], knot_x[rows, seg + 1]
+        y0, y1 = knot_y[rows, seg], knot_y[rows, seg + 1]
+        dx = x1 - x0
+        slope = np.divide(y1 - y0, dx, out=np.zeros(len(xs)), where=dx > 0)
+        preds[spline] = y0 + (xs - x0) * slope
+    return preds
+
+
+def predict_leaf(kind, params, key):
+    # scalar predict_leaves for one key of a non-linear leaf, on Python floats
+    if kind == LEAF_CUBIC:
+        t = (key - params[0]) / params[1]
+        return params[2] + t * (params[3] + t * (params[4] + t * params[5]))
+    knot_x = params[:_SPLINE_SEGMENTS + 1]
+    knot_y = params[_SPLINE_SEGMENTS + 1:2 * _SPLINE_SEGMENTS + 2]
+    seg = 0
+    while seg < _SPLINE_SEGMENTS - 1 and key >= knot_x[seg + 1]:
+        seg += 1
+    dx = knot_x[seg + 1] - knot_x[seg]
+    slope = (knot_y[seg + 1] - knot_y[seg]) / dx if dx > 0 else 0.0
+    return knot_y[seg] + (key - knot_x[seg]) * slope
+
+
+def route_to_child(preds, n_models, route_n):
+    # map the parent's predicted absolute position to a child index between 0..n_models-1
+    # Simple mapping: child_idx = floor(pred / N * n_models), clamped to valid range
+    child_idx = np.floor(preds / max(1, (route_n - 1)) * n_models)
+    return np.clip(child_idx, 0, n_models - 1).astype(np.int64)
+
+
+def _attach_chunk(names, n, start, stop):
+    # views of keys (float64) and model assignments (int64) [start, stop) in shared memory
+    x_shm = shared_memory.SharedMemory(name=names[0])
+    assign_shm = shared_memory.SharedMemory(name=names[1])
+    x = np.ndarray(n, dtype=np.float64, buffer=x_shm.buf)[start:stop]
+    assign = np.ndarray(n, dtype=np.int64, buffer=assign_shm.buf)[start:stop]
+    return x_shm, assign_shm, x, assign
+
+
+def _fit_chunk_level(names, n, start, stop, parent, n_models, route_n):
+    """
+    Worker task of MultiLevelRMI.fit(workers=...): route the keys [start, stop) to
+    the models of one level with the parent level's (slopes, intercepts), store the
+    assignments and return the per-model moments of the chunk.
+    """
+    x_shm, assign_shm, x, assign = _attach_chunk(names, n, start, stop)
+    try:
+        if parent is not None:
+            slopes, intercepts = parent
+            assign[:] = route_to_child(slopes[assign] * x + intercepts[assign], n_models, route_n)
+        return group_moments(assign, x, np.arange(start, stop, dtype=np.float64), n_models)
+    finally:
+        # the views must go before the segments can be closed
+        del x, assign
+        x_shm.close()
+        assign_shm.close()
+
+
+def _fit_chunk_leaves(names, n, start, stop, leaves):
+    """
+    Worker task of MultiLevelRMI.fit(workers=...): per-leaf residual bounds,
+    counts and position spans of the keys [start, stop).
+    """
+    x_shm, assign_shm, x, assign = _attach_chunk(names, n, start, stop)
+    try:
+        slopes, intercepts = leaves
+        n_leaves = len(slopes)
+        positions = np.arange(start, stop, dtype=np.int64)
+        residuals = positions - np.rint(slopes[assign] * x + intercepts[assign]).astype(np.int64)
+        err_lo = np.zeros(n_leaves, dtype=np.int64)
+        err_hi = np.zeros(n_leaves, dtype=np.int64)
+        np.minimum.at(err_lo, assign, residuals)
+        np.maximum.at(err_hi, assign, residuals)
+        counts = np.bincount(assign, minlength=n_leaves).astype(np.int64)
+        min_pos = np.full(n_leaves, n, dtype=np.int64)
+        max_pos = np.full(n_leaves, -1, dtype=np.int64)
+        np.minimum.at(min_pos, assign, positions)
+        np.maximum.at(max_pos, assign, positions)
+        return err_lo, err_hi, counts, min_pos, max_pos
+    finally:
+        # the views must go before the segments can be closed
+        del x, assign
+        x_shm.close()
+        assign_shm.close()
+
+
+def bounded_search(sorted_keys, targets, lo, hi):
+    """
+    Vectorized lower bound of every target inside its own window sorted_keys[lo:hi+1].
+    lo, hi: int arrays (inclusive, already clipped to valid positions).
+    Returns for each target the first position p in [lo, hi + 1] with sorted_keys[p] >= target
+    (hi + 1 when every key of the window is smaller).
+    All targets take their binary-search steps together, so the number of NumPy passes
+    is log2 of the widest window rather than the number of targets.
+    """
+    base = np.asarray(lo, dtype=np.int64)
+    n = np.asarray(hi, dtype=np.int64) - base + 1
+    if len(sorted_keys) == 0 or len(base) == 0:
+        return base
+    # branch-free halving: windows that are already narrowed just keep base in place
+    while n.max() > 1:
+        half = n // 2
+        candidate = base + half
+        base = np.where(sorted_keys[candidate] < targets, candidate, base)
+        n -= half
+    return base + (sorted_keys[base] < targets)
+
+
+def windowed_lower_bound(sorted_keys, targets, lo, hi):
+    """
+    Lower bound of every target in the whole of sorted_keys, searched in its own window
+    [lo, hi] first (see bounded_search). A target absent from sorted_keys can be predicted
+    a window that misses its lower bound; those few fall back to a binary search over all keys.
+    """
+    idx = bounded_search(sorted_keys, targets, lo, hi)
+    n = len(sorted_keys)
+    if n == 0 or len(idx) == 0:
+        return idx
+    before = (idx == lo) & (lo > 0)
+    before[before] = sorted_keys[lo[before] - 1] >= targets[before]
+    after = (idx > hi) & (idx < n)
+    after[after] = sorted_keys[idx[after]] < targets[after]
+    stray = before | after
+    if stray.any():
+        idx[stray] = np.searchsorted(sorted_keys, targets[stray], side='left')
+    return idx
+
+
+def _search(sorted_keys, key, lo, hi):
+    # lower bound of key in sorted_keys[lo:hi]; object arrays (str / tuple keys) use
+    # bisect, since searchsorted would take a tuple key for several keys
+    if sorted_keys.dtype == object:
+        return bisect_left(sorted_keys, key, lo, hi)
+    return lo + int(np.searchsorted(sorted_keys[lo:hi], key, side='left'))
+
+
+def exponential_search(sorted_keys, key, lo, hi):
+    """
+    Lower bound of key in sorted_keys, searching the window [lo, hi] first.
+    When the answer lies outside the window, gallop away from the window edge
+    with doubling steps and finish with a binary search on the bracketed range.
+    """
+    n = len(sorted_keys)
+    i = _search(sorted_keys, key, lo, hi + 1)
+    if i == lo and lo > 0 and sorted_keys[lo - 1] >= key:
+        # key is left of the window
+        right = lo - 1
+        step = 1
+        left = right - step
+        while left > 0 and sorted_keys[left] >= key:
+            right = left
+            step *= 2
+            left = right - step
+        left = max(left, 0)
+        return _search(sorted_keys, key, left, right + 1)
+    if i == hi + 1 and i < n and sorted_keys[i] < key:
+        # key is right of the window
+        left = i
+        step = 1
+        right = left + step
+        while right < n - 1 and sorted_keys[right] < key:
+            left = right
+            step *= 2
+            right = left + step
+        right = min(right, n - 1)
+        return _search(sorted_keys, key, left, right + 1)
+    return i
+
+
+class RMITuning:
+    """
+    Outcome of MultiLevelRMI.tune.
+    levels: the chosen configuration.
+    cost: cost breakdown of the chosen levels (see MultiLevelRMI.tune).
+    candidates: list of (levels, cost) for every configuration that was evaluated.
+    """
+    def __init__(self, levels, cost, candidates):
+        self.levels = levels
+        self.cost = cost
+        self.candidates = candidates
+
+    def __str__(self):
+        lines = ["chosen levels: {} (predicted cost {:.3f})".format(self.levels, self.cost["total"])]
+        for levels, cost in self.candidates:
+            lines.append("  {}: model={:.2f} probe={:.2f} memory={:.2f} bytes={} fits_budget={}".format(
+                levels, cost["model"], cost["probe"], cost["memory"], cost["bytes"], cost["fits_budget"]))
+        return "\n".join(lines)
+
 
 class MultiLevelRMI:
     """
     Multi-level Recursive Model Index (RMI).
     levels: list of ints describing number of models per level, e.g. [1, 32, 256]
       - the first element should be 1 (single root model).
+    model_factory: optional callable returning a model with fit/predict/predict_many
+      (e.g. SimpleModel for sklearn). When None (default) every level is a set of
+      linear models stored as slope/intercept arrays and trained in closed form.
+    retrain_threshold: inserts and deletes wait in a per-leaf delta; a leaf merges them into
+      the keys and is refit on its own keys once they pass this fraction of its keys, or of
+      the average leaf's for smaller leaves (None: only retrain_dirty merges and refits).
+    key_encoder: optional KeyEncoder for non-numeric keys (str, bytes, tuples); it is
+      fit with the index and the models regress on its floats, while searches
+      compare the original keys.
+    leaf_models: model families tried for every leaf ("linear", "cubic", "spline");
+      each leaf keeps the one with the lowest probe cost, log2 of its error window
+      plus leaf_model_costs[family] (default _LEAF_MODEL_COSTS). Only used with
+      the array-backed models (model_factory=None).
     """
-    def __init__(self, levels, model_factory=SimpleModel):
+    def __init__(self, levels, model_factory=None, retrain_threshold=0.25, key_encoder=None,
+                 leaf_models=("linear",), leaf_model_costs=None):
         assert len(levels) >= 1 and levels[0] == 1, "levels must start with [1, ...]"
+        assert "linear" in leaf_models and set(leaf_models) <= set(_LEAF_FAMILIES), \
+            "leaf_models must include linear and only use {}".format(sorted(_LEAF_FAMILIES))
         self.levels = levels
         self.model_factory = model_factory
-        # data structure: models[level][i] = model instance
-        self.models = [[model_factory() for _ in range(n)] for n in levels]
+        self.retrain_threshold = retrain_threshold
+        self.key_encoder = key_encoder
+        self.leaf_models = tuple(leaf_models)
+        self.leaf_model_costs = dict(_LEAF_MODEL_COSTS, **(leaf_model_costs or {}))
+        # per-leaf family code and parameter rows; leaf_params stays None while every leaf is linear
+        self.leaf_kind = np.zeros(levels[-1], dtype=np.int64)
+        self.leaf_params = None
+        if model_factory is None:
+            # slopes[level][i], intercepts[level][i] = linear model i of that level
+            self.models = None
+            self.slopes = [np.zeros(n) for n in levels]
+            self.intercepts = [np.zeros(n) for n in levels]
+        else:
+            # data structure: models[level][i] = model instance
+            self.models = [[model_factory() for _ in range(n)] for n in levels]
+        # leaf -> (sorted inserts, sorted deletes) waiting to be merged into keys
+        self.delta = {}
         self.trained = False
 
+    def _encode(self, key):
+        # the float the models see for one key
+        if self.key_encoder is None:
+            return float(key)
+        return self.key_encoder.encode(key)
+
+    def _encode_many(self, keys):
+        if self.key_encoder is None:
+            return np.asarray(keys, dtype=np.float64).reshape(-1)
+        return self.key_encoder.encode_many(keys)
+
     def _pos_to_target(self, pos, n):
         # normalize position into [0, n) so that parent prediction can be used to
         # route to next model by rounding.
         # We'll keep targets as absolute positions for regression, but use relative mapping to choose model index.
         return pos
 
-    def fit(self, keys):
+    def _predict_level(self, l, model_idx, x):
+        """
+        Predict positions for the keys x (float array) with the models of level l.
+        model_idx: array with the model index at level l chosen for every key.
+        """
+        if self.models is None:
+            preds = self.slopes[l][model_idx] * x + self.intercepts[l][model_idx]
+            if self.leaf_params is not None and l == len(self.levels) - 1:
+                kind = self.leaf_kind[model_idx]
+                other = kind != LEAF_LINEAR
+                if other.any():
+                    preds[other] = predict_leaves(kind[other], self.leaf_params[model_idx[other]], x[other])
+            return preds
+        preds = np.zeros(len(x), dtype=np.float64)
+        for m in np.unique(model_idx):
+            mask = (model_idx == m)
+            preds[mask] = self.models[l][m].predict_many(x[mask])
+        return preds
+
+    def _route(self, preds, n_models):
+        return route_to_child(preds, n_models, self.route_n)
+
+    def _fit_level(self, l, model_idx, x, positions):
+        n_models = self.levels[l]
+        if self.models is None:
+            self.slopes[l], self.intercepts[l] = segmented_linear_fit(model_idx, x, positions, n_models)
+            return
+        for m in range(n_models):
+            mask = (model_idx == m)
+            self.models[l][m].fit(x[mask], positions[mask])
+
+    def fit(self, keys, workers=None):
         """
         Fit RMI on sorted unique keys and implicit positions [0..N-1].
         keys: 1D sorted list/array of keys (must be sorted ascending).
+        Each level is trained in one batched pass: every key is routed with array
+        arithmetic using the level above, then all models of the level are fit at once.
+        workers: number of processes to split every level's pass over (closed-form
+          models only). Each process takes a contiguous chunk of the keys, i.e. a
+          contiguous range of models, and reads the keys from shared memory.
         """
-        keys = np.asarray(keys)
+        keys = as_key_array(keys)
         assert keys.ndim == 1
         N = len(keys)
-        positions = np.arange(N)
+        if self.key_encoder is not None:
+            self.key_encoder.fit(keys)
+        x = self._encode_many(keys)
 
-        # top-level fit
-        # fit model[0][0] => map key -> position (absolute)
         self.N = N
+        # routing constant: stays fixed after fit so inserts never re-route existing keys
+        self.route_n = N
         self.keys = keys  # keep copy for final local verification/search
-        self.models[0][0].fit(keys, positions)
-
-        # building children assignments for subsequent levels
-        # For l from 1..L-1:
-        # - For each key find which parent model routed it to
-        # - For each child model, fit with keys assigned to it
-        prev_assignments = np.zeros(N, dtype=int)  # start: everything assigned to model 0 at level 0
-        for l in range(1, len(self.levels)):
-            n_models = self.levels[l]
-            child_models = self.models[l]
-            # compute estimated position from parent-level model to route to one of n_models
-            # use parent-level predictions to compute which child model index to route to.
-            parent_models = self.models[l - 1]
-            # For each key, get parent's prediction (as approx position)
-            parent_preds = np.zeros(N, dtype=float)
-            # If parent level has multiple models, use prev_assignments to choose the right parent model for each key
-            for pm_i, pm in enumerate(parent_models):
-                mask = (prev_assignments == pm_i)
-                if mask.any():
-                    parent_preds[mask] = np.array([pm.predict(k) for k in keys[mask]])
-            # We map the parent's predicted absolute position to a child index between 0..n_models-1
-            # Simple mapping: child_idx = floor(pred / N * n_models)
-            # clamp to valid range
-            child_idx = np.floor(parent_preds / max(1, (self.N - 1)) * n_models).astype(int)
-            child_idx = np.clip(child_idx, 0, n_models - 1)
-
-            # Now fit each child model on its assigned keys
-            new_assignments = child_idx.copy()
-            for cid in range(n_models):
-                mask = (new_assignments == cid)
-                assigned_keys = keys[mask]
-                assigned_pos = positions[mask]
-                child_models[cid].fit(assigned_keys, assigned_pos)
-            prev_assignments = new_assignments
+        self.delta = {}
+        self.leaf_kind = np.zeros(self.levels[-1], dtype=np.int64)
+        self.leaf_params = None
+        if workers is not None and workers > 1 and self.models is None and N >= workers * _PARALLEL_MIN_KEYS:
+            assignments = self._fit_parallel(x, workers)
+            if len(self.leaf_models) > 1:
+                self._fit_leaf_models(assignments, x, np.arange(N, dtype=np.float64))
+            self.trained = True
+            return
+        positions = np.arange(N, dtype=np.float64)
+        # start: everything assigned to model 0 at level 0
+        assignments = np.zeros(N, dtype=np.int64)
+        for l in range(len(self.levels)):
+            if l > 0:
+                parent_preds = self._predict_level(l - 1, assignments, x)
+                assignments = self._route(parent_preds, self.levels[l])
+            self._fit_level(l, assignments, x, positions)
 
+        # per-leaf error bounds: min/max of (true position - predicted position)
+        # over the keys routed to each leaf, so lookups search exactly that window
+        if self.models is None and len(self.leaf_models) > 1:
+            self._fit_leaf_models(assignments, x, positions)
+        else:
+            leaf_preds = np.rint(self._predict_level(len(self.levels) - 1, assignments, x))
+            self._fit_error_bounds(assignments, positions - leaf_preds)
+        self._fit_leaf_spans(assignments)
         self.trained = True
 
+    def _choose_leaf_models(self, leaf_idx, x, positions, n_leaves, slopes, intercepts):
+        """
+        Fit every family of leaf_models on the keys of each leaf (leaf_idx in
+        [0, n_leaves), linear models given) and keep the cheapest per leaf.
+        Returns (kind, params, err_lo, err_hi) per leaf.
+        """
+        families = [("linear", None, np.ones(n_leaves, dtype=bool), slopes[leaf_idx] * x + intercepts[leaf_idx])]
+        for name, fit in (("cubic", fit_cubic_leaves), ("spline", fit_spline_leaves)):
+            if name in self.leaf_models:
+                params, ok = fit(leaf_idx, x, positions, n_leaves)
+                preds = predict_leaves(np.full(len(x), _LEAF_FAMILIES[name]), params[leaf_idx], x)
+                families.append((name, params, ok, preds))
+        best_cost = np.full(n_leaves, np.inf)
+        kind = np.zeros(n_leaves, dtype=np.int64)
+        params = np.zeros((n_leaves, _LEAF_PARAMS))
+        err_lo = np.zeros(n_leaves, dtype=np.int64)
+        err_hi = np.zeros(n_leaves, dtype=np.int64)
+        for name, family_params, ok, preds in families:
+            residuals = (positions - np.rint(preds)).astype(np.int64)
+            lo = np.zeros(n_leaves, dtype=np.int64)
+            hi = np.zeros(n_leaves, dtype=np.int64)
+            np.minimum.at(lo, leaf_idx, residuals)
+            np.maximum.at(hi, leaf_idx, residuals)
+            cost = np.log2(hi - lo + 2.0) + self.leaf_model_costs[name]
+            better = ok & (cost < best_cost)
+            best_cost[better] = cost[better]
+            kind[better] = _LEAF_FAMILIES[name]
+            if family_params is not None:
+                params[better] = family_params[better]
+            err_lo[better] = lo[better]
+            err_hi[better] = hi[better]
+        return kind, params, err_lo, err_hi
+
+    def _fit_leaf_models(self, leaf_idx, x, positions):
+        # per-leaf family choice over the whole key array (after the levels are fit)
+        kind, params, self.err_lo, self.err_hi = self._choose_leaf_models(
+            leaf_idx, x, positions, self.levels[-1], self.slopes[-1], self.intercepts[-1])
+        self.leaf_kind = kind
+        self.leaf_params = params if (kind != LEAF_LINEAR).any() else None
+
+    def _fit_parallel(self, x, workers):
+        # same passes as fit, with every pass split over key chunks in a process pool:
+        # workers return per-model moments of their chunk, merged here in chunk order.
+        # Returns the leaf of every key.
+        N = len(x)
+        bounds = np.linspace(0, N, workers + 1).astype(np.int64)
+        chunks = list(zip(bounds[:-1], bounds[1:]))
+        x_shm = shared_memory.SharedMemory(create=True, size=max(1, x.nbytes))
+        assign_shm = shared_memory.SharedMemory(create=True, size=max(1, N * 8))
+        try:
+            np.ndarray(N, dtype=np.float64, buffer=x_shm.buf)[:] = x
+            np.ndarray(N, dtype=np.int64, buffer=assign_shm.buf)[:] = 0
+            names = (x_shm.name, assign_shm.name)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for l in range(len(self.levels)):
+                    parent = None if l == 0 else (self.slopes[l - 1], self.intercepts[l - 1])
+                    parts = pool.map(_fit_chunk_level, *zip(*[
+                        (names, N, start, stop, parent, self.levels[l], self.route_n) for start, stop in chunks]))
+                    moments = None
+                    for part in parts:
+                        moments = part if moments is None else merge_moments(moments, part)
+                    self.slopes[l], self.intercepts[l] = moments_to_lines(moments)
+                leaves = (self.slopes[-1], self.intercepts[-1])
+                parts = list(pool.map(_fit_chunk_leaves, *zip(*[
+                    (names, N, start, stop, leaves) for start, stop in chunks])))
+            assignments = np.ndarray(N, dtype=np.int64, buffer=assign_shm.buf).copy()
+        finally:
+            x_shm.close()
+            x_shm.unlink()
+            assign_shm.close()
+            assign_shm.unlink()
+        err_lo, err_hi, counts, min_pos, max_pos = zip(*parts)
+        self.err_lo = np.minimum.reduce(err_lo)
+        self.err_hi = np.maximum.reduce(err_hi)
+        self.leaf_shift = np.zeros(self.levels[-1], dtype=np.int64)
+        self.leaf_count = np.sum(counts, axis=0)
+        self.leaf_min_pos = np.minimum.reduce(min_pos)
+        self.leaf_max_pos = np.maximum.reduce(max_pos)
+        self.leaf_inserts = np.zeros(self.levels[-1], dtype=np.int64)
+        return assignments
+
+    def _fit_error_bounds(self, leaf_idx, residuals):
+        n_leaves = self.levels[-1]
+        residuals = residuals.astype(np.int64)
+        err_lo = np.zeros(n_leaves, dtype=np.int64)
+        err_hi = np.zeros(n_leaves, dtype=np.int64)
+        np.minimum.at(err_lo, leaf_idx, residuals)
+        np.maximum.at(err_hi, leaf_idx, residuals)
+        self.err_lo = err_lo
+        self.err_hi = err_hi
+
+    def _fit_leaf_spans(self, leaf_idx):
+        # per-leaf bookkeeping for inserts:
+        #   leaf_shift: positions added to the leaf's (rounded) prediction since it was fit
+        #   leaf_count / leaf_min_pos / leaf_max_pos: how many keys the leaf has and where they are
+        #   leaf_inserts: inserts and deletes waiting in the leaf's delta
+        n_leaves = self.levels[-1]
+        self.leaf_shift = np.zeros(n_leaves, dtype=np.int64)
+        self.leaf_count = np.bincount(leaf_idx, minlength=n_leaves).astype(np.int64)
+        self.leaf_min_pos = np.full(n_leaves, self.N, dtype=np.int64)
+        self.leaf_max_pos = np.full(n_leaves, -1, dtype=np.int64)
+        positions = np.arange(len(leaf_idx), dtype=np.int64)
+        np.minimum.at(self.leaf_min_pos, leaf_idx, positions)
+        np.maximum.at(self.leaf_max_pos, leaf_idx, positions)
+        self.leaf_inserts = np.zeros(n_leaves, dtype=np.int64)
+
+    def _predict_model(self, l, idx, key):
+        if self.models is None:
+            if self.leaf_params is not None and l == len(self.levels) - 1 and self.leaf_kind[idx] != LEAF_LINEAR:
+                return float(predict_leaf(self.leaf_kind[idx], self.leaf_params[idx].tolist(), key))
+            return float(self.slopes[l][idx] * key + self.intercepts[l][idx])
+        return self.models[l][idx].predict(key)
+
     def _predict_pos_and_error(self, key, level_route=None):
         """
         Predict position by walking the models down the hierarchy.
-        Returns predicted_pos, and rough error bound (we'll use a small multiple of sqrt(N) if unknown).
+        Returns predicted_pos, and the error bound of the leaf that made the prediction
+        (largest distance between a training key and its prediction in that leaf).
         level_route (optional) collects model indices chosen at each level.
         """
         if not self.trained:
             raise RuntimeError("RMI not trained. Call fit(keys) first.")
-        N = self.N
+        N = self.route_n
         pred = None
         assign = 0
         if level_route is None:
             level_route = []
         # level 0:
-        pred = self.models[0][0].predict(key)
+        key = self._encode(key)
+        pred = self._predict_model(0, 0, key)
         level_route.append(0)
         # for levels >=1, route using mapping used in fit
         for l in range(1, len(self.levels)):
@@ -134,33 +673,501 @@ class MultiLevelRMI:
             idx = int(np.floor(pred / max(1, (N - 1)) * n_models))
             idx = max(0, min(n_models - 1, idx))
             level_route.append(idx)
-            pred = self.models[l][idx].predict(key)
-        # conservative error bound: you can also compute residuals from training to get tighter bound
-        # we'll use sqrt(N) heuristic and also clip to N
-        err = max(1, int(np.sqrt(max(1, N))))
-        return int(round(pred)), err, level_route
+            pred = self._predict_model(l, idx, key)
+        leaf = level_route[-1]
+        err = int(max(-self.err_lo[leaf], self.err_hi[leaf]))
+        return int(round(pred)) + int(self.leaf_shift[leaf]), err, level_route
+
+    def _predict_window(self, key):
+        """
+        Predict position and the exact search window learned for the key's leaf.
+        Returns (pos, lo, hi): every training key routed to that leaf lies in
+        [lo, hi], which always contains pos and is clipped to [0, N-1].
+        """
+        pos, _, route = self._predict_pos_and_error(key)
+        leaf = route[-1]
+        last = max(0, self.N - 1)
+        pos = max(0, min(last, pos))
+        lo = max(0, min(pos, pos + int(self.err_lo[leaf])))
+        hi = min(last, max(pos, pos + int(self.err_hi[leaf])))
+        return pos, lo, hi
+
+    def lower_bound(self, key):
+        """
+        Position of the first key >= key (N when every key is smaller).
+        Searches the leaf's learned error window, galloping outside it when the
+        key is not a training key and its lower bound lies beyond the window.
+        """
+        if self.N == 0:
+            return 0
+        _, lo, hi = self._predict_window(key)
+        return exponential_search(self.keys, key, lo, hi)
 
     def lookup(self, key):
         """
-        Lookup a key: predict position then search locally around predicted position.
+        Lookup a key: predict position then search the leaf's learned error window.
         Returns index if found, else -1.
         """
-        pred_pos, err, route = self._predict_pos_and_error(key)
-        # define window:
-        lo = max(0, pred_pos - err)
-        hi = min(self.N - 1, pred_pos + err)
-        # use bisect on the stored keys to find exact location but limited to window:
-        # Python bisect works on entire array; we'll narrow by slicing indices to window
-        # find leftmost index in [lo, hi] with key >= target
-        # use numpy searchsorted for speed
-        i = np.searchsorted(self.keys[lo:hi+1], key, side='left')
-        if i < 0 or i > (hi - lo):
-            return -1
-        found_index = lo + i
-        if found_index <= hi and found_index < self.N and self.keys[found_index] == key:
+        found_index = self.lower_bound(key)
+        if found_index < self.N and self.keys[found_index] == key:
             return found_index
         return -1
 
+    def _predict_many(self, x):
+        """
+        Walk a whole float array of keys down the hierarchy.
+        Returns raw (float) predictions and the model index chosen at the last level.
+        """
+        if not self.trained:
+            raise RuntimeError("RMI not trained. Call fit(keys) first.")
+        model_idx = np.zeros(len(x), dtype=np.int64)
+        preds = self._predict_level(0, model_idx, x)
+        for l in range(1, len(self.levels)):
+            model_idx = self._route(preds, self.levels[l])
+            preds = self._predict_level(l, model_idx, x)
+        return preds, model_idx
+
+    def predict_many(self, keys):
+        """
+        Batch version of _predict_pos_and_error.
+        keys: 1D array-like of keys.
+        Returns predicted positions and error bounds as int arrays.
+        """
+        x = self._encode_many(keys)
+        preds, leaf = self._predict_many(x)
+        positions = np.rint(preds).astype(np.int64) + self.leaf_shift[leaf]
+        return positions, np.maximum(-self.err_lo[leaf], self.err_hi[leaf])
+
+    def _predict_windows(self, keys):
+        # batch version of _predict_window
+        x = self._encode_many(keys)
+        preds, leaf = self._predict_many(x)
+        last = max(0, self.N - 1)
+        pos = np.clip(np.rint(preds).astype(np.int64) + self.leaf_shift[leaf], 0, last)
+        lo = np.clip(np.minimum(pos, pos + self.err_lo[leaf]), 0, last)
+        hi = np.clip(np.maximum(pos, pos + self.err_hi[leaf]), 0, last)
+        return pos, lo, hi
+
+    def lower_bound_many(self, keys):
+        """
+        Batch version of lower_bound: each key is searched in its leaf's learned window.
+        """
+        keys = as_key_array(keys).reshape(-1)
+        if self.N == 0:
+            return np.zeros(len(keys), dtype=np.int64)
+        _, lo, hi = self._predict_windows(keys)
+        return windowed_lower_bound(self.keys, keys, lo, hi)
+
+    def lookup_many(self, keys):
+        """
+        Batch version of lookup: each key is searched in its leaf's learned window.
+        Returns (positions, found) where positions[i] is the index of keys[i]
+        (-1 when missing) and found is the boolean mask of hits.
+        """
+        keys = as_key_array(keys).reshape(-1)
+        if self.N == 0:
+            return np.full(len(keys), -1, dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        idx = self.lower_bound_many(keys)
+        in_range = idx < self.N
+        found = np.zeros(len(keys), dtype=bool)
+        found[in_range] = self.keys[idx[in_range]] == keys[in_range]
+        return np.where(found, idx, -1), found
+
+    def _make_writable(self):
+        # arrays mapped from a saved file are read-only; copy them before the first update
+        for name in _LEAF_ARRAYS:
+            array = getattr(self, name)
+            if not array.flags.writeable:
+                setattr(self, name, np.array(array))
+        if self.leaf_params is not None and not self.leaf_params.flags.writeable:
+            self.leaf_params = np.array(self.leaf_params)
+        if self.models is None and not self.slopes[-1].flags.writeable:
+            self.slopes[-1] = np.array(self.slopes[-1])
+            self.intercepts[-1] = np.array(self.intercepts[-1])
+
+    def _leaf_of(self, key):
+        return self._predict_pos_and_error(key)[2][-1]
+
+    def _pend(self, leaf, key, insert):
+        # record a pending insert (or delete) of key in the leaf's delta, an insert cancelling a
+        # pending delete of the same key and the other way round; False for a delete of a key
+        # the index does not hold
+        inserts, deletes = self.delta.setdefault(leaf, ([], []))
+        opposite, same = (deletes, inserts) if insert else (inserts, deletes)
+        i = bisect_left(opposite, key)
+        if i < len(opposite) and opposite[i] == key:
+            del opposite[i]
+        elif insert or self._count(key) > bisect_right(deletes, key) - bisect_left(deletes, key):
+            insort(same, key)
+        else:
+            if not inserts and not deletes:
+                del self.delta[leaf]
+            return False
+        self.leaf_inserts[leaf] = len(inserts) + len(deletes)
+        if not self.leaf_inserts[leaf]:
+            del self.delta[leaf]
+        return True
+
+    def _count(self, key):
+        # occurrences of key in keys
+        start = end = self.lower_bound(key)
+        while end < self.N and self.keys[end] == key:
+            end += 1
+        return end - start
+
+    def _merge_due(self, leaf):
+        # small leaves wait for as many changes as an average leaf, so a merge (one copy of keys)
+        # comes at most every retrain_threshold * N / n_leaves writes into the leaf
+        pending = self.leaf_inserts[leaf]
+        return self.retrain_threshold is not None and pending >= _MERGE_MIN_PENDING and \
+            pending > self.retrain_threshold * max(self.leaf_count[leaf], self.N / self.levels[-1])
+
+    def insert(self, key):
+        """
+        Insert key. It waits in its leaf's delta, a short sorted list, and only enters keys / N
+        (and so lower_bound, lookup and lookup_many) when the leaf is merged and refit
+        (see retrain_leaf): once its pending inserts and deletes pass retrain_threshold of its
+        keys, or on retrain_dirty. An insert costs the routing of one key and a few list
+        operations; the merge copies the key array once for all of the leaf's pending changes.
+        Inserting a key whose delete is pending cancels the delete.
+        Returns the merge (see retrain_leaf) when the insert set one off, else None.
+        """
+        if not self.trained:
+            raise RuntimeError("RMI not trained. Call fit(keys) first.")
+        self._make_writable()
+        leaf = self._leaf_of(key)
+        self._pend(leaf, key, insert=True)
+        return self.retrain_leaf(leaf) if self._merge_due(leaf) else None
+
+    def insert_many(self, keys, merge=False):
+        """
+        insert for an array of keys, routed in one pass. The leaves whose pending changes
+        pass retrain_threshold (with merge=True, every leaf that took a key) are merged together.
+        Returns the merge, or None when no leaf was merged.
+        """
+        if not self.trained:
+            raise RuntimeError("RMI not trained. Call fit(keys) first.")
+        keys = as_key_array(keys).reshape(-1)
+        if not len(keys):
+            return None
+        self._make_writable()
+        _, leaves = self._predict_many(self._encode_many(keys))
+        for key, leaf in zip(keys.tolist() if keys.dtype == object else keys, leaves.tolist()):
+            self._pend(leaf, key, insert=True)
+        touched = np.unique(leaves).tolist()
+        due = [leaf for leaf in touched if leaf in self.delta and (merge or self._merge_due(leaf))]
+        return self._retrain(due) if due else None
+
+    def delete(self, key):
+        """
+        Remove one occurrence of key, the inverse of insert: a pending insert of key is dropped,
+        otherwise the delete waits in the leaf's delta and key leaves keys / N when the leaf is
+        merged. Deletes count towards retrain_threshold like inserts. A key the index does not
+        hold is ignored.
+        Returns the merge (see retrain_leaf) when the delete set one off, else None.
+        """
+        if not self.trained:
+            raise RuntimeError("RMI not trained. Call fit(keys) first.")
+        self._make_writable()
+        leaf = self._leaf_of(key)
+        if not self._pend(leaf, key, insert=False):
+            return None
+        return self.retrain_leaf(leaf) if self._merge_due(leaf) else None
+
+    @property
+    def pending(self):
+        """Inserts and deletes waiting in the leaves' deltas."""
+        return int(self.leaf_inserts.sum())
+
+    def _merge(self, leaves):
+        """
+        Move the deltas of leaves into keys with one copy of the array. Every other leaf
+        keeps a valid window: its shift follows its first key, and it widens err_hi / err_lo
+        by the keys inserted / removed inside its span. The merged leaves are left for
+        _refit_leaf, with leaf_min_pos / leaf_max_pos bounding where their keys now lie.
+        """
+        inserts, deletes, insert_leaves = [], [], []
+        for leaf in leaves:
+            leaf_inserts, leaf_deletes = self.delta.pop(leaf, ((), ()))
+            inserts += leaf_inserts
+            deletes += leaf_deletes
+            insert_leaves += [leaf] * len(leaf_inserts)
+        none = np.zeros(0, dtype=np.int64)
+        if not inserts and not deletes:
+            return none, none
+        old = self.keys
+        removed = none
+        if deletes:
+            # every pending delete of a key takes the next occurrence of it
+            deletes = as_key_array(sorted(deletes))
+            starts = np.flatnonzero(np.concatenate(([True], deletes[1:] != deletes[:-1])))
+            run = np.arange(len(deletes)) - np.repeat(starts, np.diff(np.append(starts, len(deletes))))
+            removed = np.searchsorted(old, deletes, side='left') + run
+        kept = old
+        if len(removed):
+            kept = np.delete(old, removed)
+        at, added = none, none
+        if inserts:
+            inserts = as_key_array(inserts)
+            order = np.argsort(inserts, kind='stable')
+            inserts = inserts[order]
+            insert_leaves = np.asarray(insert_leaves, dtype=np.int64)[order]
+            if kept.dtype != inserts.dtype and object not in (kept.dtype, inserts.dtype):
+                kept = kept.astype(np.result_type(kept.dtype, inserts.dtype))
+            at = np.searchsorted(kept, inserts, side='left')
+            added = at + np.arange(len(inserts))
+            kept = np.insert(kept, at, inserts)
+
+        def moved(positions, side):
+            # new position of the keys at old positions (side='left': before the keys inserted there)
+            in_kept = positions - np.searchsorted(removed, positions, side='left')
+            return in_kept + np.searchsorted(at, in_kept, side=side)
+
+        merged = np.zeros(len(self.leaf_count), dtype=bool)
+        merged[list(leaves)] = True
+        others = (self.leaf_count > 0) & ~merged
+        lo, hi = self.leaf_min_pos[others], self.leaf_max_pos[others]
+        new_lo, new_hi = moved(lo, 'right'), moved(hi, 'right')
+        removed_inside = np.searchsorted(removed, hi, side='left') - np.searchsorted(removed, lo, side='right')
+        self.leaf_shift[others] += new_lo - lo
+        self.err_hi[others] += (new_hi - new_lo) - (hi - lo) + removed_inside
+        self.err_lo[others] -= removed_inside
+        self.leaf_min_pos[others] = new_lo
+        self.leaf_max_pos[others] = new_hi
+
+        self.keys = kept
+        self.N = len(kept)
+        for leaf in leaves:
+            mine = added[insert_leaves == leaf] if len(added) else none
+            start, end = (mine[0], mine[-1]) if len(mine) else (self.N, -1)
+            if self.leaf_count[leaf] > 0:
+                bounds = np.array([self.leaf_min_pos[leaf], self.leaf_max_pos[leaf]])
+                start = min(start, int(moved(bounds[:1], 'left')[0]))
+                end = max(end, min(self.N - 1, int(moved(bounds[1:], 'right')[0])))
+            self.leaf_min_pos[leaf] = start
+            self.leaf_max_pos[leaf] = end
+        return removed, added
+
+    def _retrain(self, leaves):
+        merge = self._merge(leaves)
+        for leaf in leaves:
+            self._refit_leaf(leaf)
+        return merge
+
+    def retrain_leaf(self, leaf):
+        """
+        Merge the leaf's pending inserts and deletes into keys, then refit the leaf on its
+        current keys and re-derive its error bounds. Only the leaf's span of the key array
+        is routed, so apart from the one copy of keys the cost is proportional to the keys
+        in [leaf_min_pos, leaf_max_pos], not to N.
+        Returns the merge, (removed, added): the sorted positions in the old keys of the keys
+        deleted, and the sorted positions in the new keys of the keys inserted.
+        """
+        self._make_writable()
+        return self._retrain([leaf])
+
+    def _refit_leaf(self, leaf):
+        start, end = int(self.leaf_min_pos[leaf]), int(self.leaf_max_pos[leaf])
+        x = self._encode_many(self.keys[start:end + 1]) if end >= start else np.zeros(0)
+        _, span_leaf = self._predict_many(x)
+        mine = np.flatnonzero(span_leaf == leaf)
+        self.leaf_inserts[leaf] = 0
+        if not len(mine):
+            self.leaf_count[leaf] = 0
+            self.leaf_min_pos[leaf] = self.N
+            self.leaf_max_pos[leaf] = -1
+            return
+        x = x[mine]
+        positions = (start + mine).astype(np.float64)
+        if self.models is None:
+            single = np.zeros(len(x), dtype=np.int64)
+            slope, intercept = segmented_linear_fit(single, x, positions, 1)
+            self.slopes[-1][leaf] = slope[0]
+            self.intercepts[-1][leaf] = intercept[0]
+            self.leaf_kind[leaf] = LEAF_LINEAR
+            if len(self.leaf_models) > 1:
+                kind, params, _, _ = self._choose_leaf_models(single, x, positions, 1, slope, intercept)
+                self.leaf_kind[leaf] = kind[0]
+                if kind[0] != LEAF_LINEAR:
+                    if self.leaf_params is None:
+                        self.leaf_params = np.zeros((self.levels[-1], _LEAF_PARAMS))
+                    self.leaf_params[leaf] = params[0]
+        else:
+            self.models[-1][leaf].fit(x, positions)
+        self.leaf_shift[leaf] = 0
+        preds = self._predict_level(len(self.levels) - 1, np.full(len(x), leaf, dtype=np.int64), x)
+        residuals = (positions - np.rint(preds)).astype(np.int64)
+        self.err_lo[leaf] = min(0, residuals.min())
+        self.err_hi[leaf] = max(0, residuals.max())
+        self.leaf_count[leaf] = len(x)
+        self.leaf_min_pos[leaf] = start + mine[0]
+        self.leaf_max_pos[leaf] = start + mine[-1]
+
+    def retrain_dirty(self):
+        """
+        Merge every leaf with pending inserts or deletes (one copy of keys for all of them)
+        and refit it. Returns the merge (see retrain_leaf).
+        """
+        self._make_writable()
+        return self._retrain(np.flatnonzero(self.leaf_inserts > 0).tolist())
+
+    @staticmethod
+    def candidate_levels(N):
+        """
+        Default configurations searched by tune: two- and three-level RMIs whose
+        leaf count grows in powers of 4 up to about N/2 leaves.
+        """
+        candidates = [[1]]
+        leaves = 4
+        while leaves <= max(2, N // 2):
+            candidates.append([1, leaves])
+            for branch in (4, 16, 64):
+                if branch < leaves:
+                    candidates.append([1, branch, leaves])
+            leaves *= 4
+        return candidates
+
+    @classmethod
+    def tune(cls, keys, candidates=None, memory_budget=None, sample_size=100_000,
+             model_cost=1.0, probe_cost=1.0, memory_cost=1e-6, key_encoder=None):
+        """
+        Pick the levels configuration for keys with a cost model.
+        Every candidate is fit on an evenly strided sample of the sorted keys and scored as
+          model:  model_cost per level evaluated on the way down
+          probe:  probe_cost per binary-search step in the expected leaf window
+                  (sample residuals scaled back to full positions)
+          memory: memory_cost per byte of model parameters
+        memory_budget: optional cap in bytes on model parameters; candidates above it are
+          only chosen when nothing fits (then the smallest one is used).
+        When N > sample_size the default candidates keep at least 16 sampled keys per
+        leaf; raise sample_size to let the tuner consider more leaves.
+        key_encoder: as in MultiLevelRMI, for non-numeric keys.
+        Returns an RMITuning with the decision and every candidate's predicted cost.
+        """
+        keys = as_key_array(keys)
+        N = len(keys)
+        stride = max(1, int(np.ceil(N / max(1, sample_size))))
+        sample = keys[::stride]
+        if candidates is None:
+            candidates = cls.candidate_levels(N)
+            if stride > 1:
+                # leaves that see only a handful of sampled keys overfit the sample and
+                # report windows far tighter than they will be on the full data
+                candidates = [c for c in candidates if c[-1] <= len(sample) // 16]
+        scored = []
+        for levels in candidates:
+            rmi = cls(levels, key_encoder=key_encoder)
+            rmi.fit(sample)
+            _, leaf = rmi._predict_many(rmi._encode_many(sample))
+            widths = (rmi.err_hi - rmi.err_lo)[leaf] * stride + 1
+            nbytes = rmi.nbytes()
+            cost = {
+                "model": model_cost * len(levels),
+                "probe": probe_cost * float(np.mean(np.log2(widths + 1))) if len(widths) else 0.0,
+                "memory": memory_cost * nbytes,
+                "bytes": nbytes,
+                "fits_budget": memory_budget is None or nbytes <= memory_budget,
+            }
+            cost["total"] = cost["model"] + cost["probe"] + cost["memory"]
+            scored.append((list(levels), cost))
+        within = [c for c in scored if c[1]["fits_budget"]]
+        if within:
+            best = min(within, key=lambda c: (c[1]["total"], c[1]["bytes"]))
+        else:
+            best = min(scored, key=lambda c: c[1]["bytes"])
+        return RMITuning(best[0], best[1], scored)
+
+    def nbytes(self):
+        """
+        Memory held by the trained models (parameters and error bounds), excluding the keys.
+        """
+        if self.models is not None:
+            raise ValueError("nbytes is only defined for the array-backed RMI (model_factory=None)")
+        params = sum(a.nbytes for a in self.slopes) + sum(a.nbytes for a in self.intercepts)
+        if self.leaf_params is not None:
+            params += self.leaf_params.nbytes + self.leaf_kind.nbytes
+        return params + self.err_lo.nbytes + self.err_hi.nbytes
+
+    def save(self, path):
+        """
+        Write the trained RMI (levels, slope/intercept arrays, per-leaf error bounds,
+        insert bookkeeping and model families, non-linear leaf parameters, and keys)
+        to a single binary file that MultiLevelRMI.load can memory-map.
+        """
+        if not self.trained:
+            raise RuntimeError("RMI not trained. Call fit(keys) first.")
+        if self.models is not None:
+            raise ValueError("Only the array-backed RMI (model_factory=None) can be saved")
+        if self.delta:
+            raise ValueError("The RMI has pending inserts or deletes. Call retrain_dirty() first")
+        keys = np.ascontiguousarray(self.keys)
+        if keys.dtype.itemsize != 8 or keys.dtype.kind not in "iuf":
+            raise ValueError("save supports 8-byte numeric keys, got {}".format(keys.dtype))
+        header = np.zeros(_HEADER_BYTES, dtype=np.uint8)
+        header[0:8] = np.frombuffer(_FILE_MAGIC, dtype=np.uint8)
+        header[8:16].view(np.int64)[0] = _FILE_VERSION
+        header[16:24].view(np.int64)[0] = len(self.levels)
+        header[24:32].view(np.int64)[0] = self.N
+        header[32:40].view(np.int64)[0] = self.route_n
+        dtype_code = keys.dtype.newbyteorder("<").str.encode("ascii")
+        header[40:40 + len(dtype_code)] = np.frombuffer(dtype_code, dtype=np.uint8)
+        header[56:64].view(np.int64)[0] = 0 if self.leaf_params is None else _LEAF_PARAMS
+        with open(path, "wb") as f:
+            f.write(header.tobytes())
+            f.write(np.asarray(self.levels, dtype="<i8").tobytes())
+            for l in range(len(self.levels)):
+                f.write(np.asarray(self.slopes[l], dtype="<f8").tobytes())
+                f.write(np.asarray(self.intercepts[l], dtype="<f8").tobytes())
+            for name in _LEAF_ARRAYS:
+                f.write(np.asarray(getattr(self, name), dtype="<i8").tobytes())
+            if self.leaf_params is not None:
+                f.write(np.asarray(self.leaf_params, dtype="<f8").tobytes())
+            f.write(keys.astype(keys.dtype.newbyteorder("<")).tobytes())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load an RMI written by save. With mmap=True (default) every array is a
+        read-only view into the memory-mapped file, so nothing is parsed or refit.
+        """
+        if mmap:
+            buf = np.memmap(path, dtype=np.uint8, mode="r")
+        else:
+            buf = np.fromfile(path, dtype=np.uint8)
+        if bytes(buf[0:8]) != _FILE_MAGIC:
+            raise ValueError("{} is not a saved MultiLevelRMI".format(path))
+        version = int(buf[8:16].view("<i8")[0])
+        if version != _FILE_VERSION:
+            raise ValueError("Unsupported RMI file version {}".format(version))
+        n_levels = int(buf[16:24].view("<i8")[0])
+        N = int(buf[24:32].view("<i8")[0])
+        route_n = int(buf[32:40].view("<i8")[0])
+        key_dtype = np.dtype(bytes(buf[40:56]).rstrip(b"\x00").decode("ascii"))
+        n_leaf_params = int(buf[56:64].view("<i8")[0])
+
+        offset = _HEADER_BYTES
+        def take(count, dtype):
+            nonlocal offset
+            dtype = np.dtype(dtype)
+            view = buf[offset:offset + count * dtype.itemsize].view(dtype)
+            offset += count * dtype.itemsize
+            return view
+
+        levels = [int(n) for n in take(n_levels, "<i8")]
+        rmi = cls(levels)
+        for l, n in enumerate(levels):
+            rmi.slopes[l] = take(n, "<f8")
+            rmi.intercepts[l] = take(n, "<f8")
+        for name in _LEAF_ARRAYS:
+            setattr(rmi, name, take(levels[-1], "<i8"))
+        if n_leaf_params:
+            rmi.leaf_params = take(levels[-1] * n_leaf_params, "<f8").reshape(levels[-1], n_leaf_params)
+        rmi.keys = take(N, key_dtype)
+        rmi.N = N
+        rmi.route_n = route_n
+        rmi.trained = True
+        return rmi
+
 # Example / quick test:
 if __name__ == "__main__":
     # generate an example skewed dataset
@@ -1,25 +1,135 @@
 from hasher import ExtensibleHash
+from gapped import GappedNode
+import numpy as np
 import pandas as pd
+import threading
+from contextlib import contextmanager
 from rmi import MultiLevelRMI
+from key_encoding import KeyEncoder, needs_encoding, as_key_array
+from hashing import BloomFilter, hash_key, hash_many
+
+#a batch adds its new slot keys through the index's insert_many (one merge, refitting only the leaves
+#they land in) while they are at most one per INSERT_SLOT_RATIO slots of the table; more refit the index
+INSERT_SLOT_RATIO = 256
+#a node merges a batch in one rebuild when the batch has at least 1 / MERGE_RATIO of its rows
+MERGE_RATIO = 8
+
+
+class SlotList(list):
+    '''
+    The slots of a hash-layout table. A slot loaded from a frame stays an int, the position
+    of its row in columns (the frame's typed column arrays, in key order), until it is first
+    written: only then does it get its ExtensibleHash (see DBTable._written). So a load costs
+    the sort and a copy of the columns, not a hash, bucket and directory per row.
+    '''
+    def __init__(self, slots=(), columns=(), row_dtype=object, key_index=0):
+        super().__init__(slots)
+        self.columns = list(columns)
+        self.row_dtype = row_dtype
+        self.key_index = key_index
+    
+    @property
+    def keys(self):
+        return self.columns[self.key_index]
+    
+    def rows(self, positions):
+        #the loaded rows at positions as a 2D array, as the frame's to_numpy() gives them
+        rows = np.empty((len(positions), len(self.columns)), dtype=self.row_dtype)
+        for i, column in enumerate(self.columns):
+            rows[:, i] = column[positions]
+        return rows
+    
+    def row(self, position):
+        return self.rows([position])[0]
 
 
 class DBTable:
-    def __init__(self, file_name:str|None, sort_key: str, index_levels=[1, 4, 16], hash_size=10, init_depth = 0, from_data=None, depth_limit = 5, log_modeling=False):
+    def __init__(self, file_name:str|None, sort_key: str, index_levels=[1, 4, 16], hash_size=10, init_depth = 0, from_data=None, depth_limit = 5, log_modeling=False, index_memory_budget=None, index_factory=None, rebuild_threshold=None, hash_fn="splitmix64", layout="hash", node_size=1024, slot_per_key=True, node_costs=None):
+        '''
+        :param index_levels: RMI levels, or "auto" to let MultiLevelRMI.tune choose them from the keys
+        :param index_memory_budget: bytes of model parameters allowed to the tuned index (only with "auto")
+        :param index_factory: optional callable returning an unfitted index (e.g. lambda: PGMIndex(epsilon=32))
+            used instead of MultiLevelRMI. The index needs fit, lower_bound, N and keys.
+            Without a factory, non-numeric sort keys (str, bytes, tuples) are supported through a KeyEncoder.
+        :param rebuild_threshold: start a background rebuild once the rows inserted since the last
+            build pass this fraction of the rows it was built on (None never rebuilds on its own)
+        :param hash_fn: hash function of the slots' ExtensibleHash (see hashing.HASH_FUNCTIONS)
+        :param layout: "hash" for a slot per row (given an ExtensibleHash when first written, see SlotList,
+            and flattened into a nested gapped table past depth_limit), or "gapped" for GappedNodes of about node_size rows each, which expand,
+            retrain or split in two as their cost model decides (split at twice node_size at the latest)
+        :param node_costs: cost model weights of the GappedNodes, e.g. dict(search_cost=3.3, shift_cost=0.006)
+            measured on the machine at hand (None keeps the defaults of gapped.py)
+        :param slot_per_key: hash layout with an index that has insert (MultiLevelRMI). An inserted key the
+            index does not hold goes into the index, which keeps it in its leaf's delta: its rows wait in
+            the slot whose range covers it, and move to a slot of their own when the leaf merges (see
+            _realign). With False new keys stay in their covering slot, which flattens past depth_limit.
+        '''
+        assert layout in ("hash", "gapped")
         self.file_name = file_name
         self.index_levels = index_levels
+        self.index_memory_budget = index_memory_budget
+        self.index_factory = index_factory
         self.log_modeling = log_modeling
         self.sort_key = sort_key
         self.hash_size = hash_size
         self.init_depth = init_depth
         self.depth_limit = depth_limit
-        self.schema, self.data, keys = self.load_data(file_name, from_data)
-        self.li = MultiLevelRMI(levels=index_levels)
+        self.rebuild_threshold = rebuild_threshold
+        self.hash_fn = hash_fn
+        self.layout = layout
+        self.node_size = node_size
+        self.slot_per_key = slot_per_key
+        self.node_costs = node_costs or {}
+        #writers (insert, delete, the end of a rebuild) hold the lock. Readers first run without it
+        #and keep their result if no write overlapped them (see _version), otherwise they run
+        #again holding the lock (see _read)
+        self._write_lock = threading.Lock()
+        #odd while a write changes the layout in place
+        self._version = 0
+        #(apply, row or key, rows inserted) of the inserts and deletes made while a rebuild runs,
+        #replayed into the new layout before the swap
+        self._rebuild_delta = None
+        self._rebuild_thread = None
+        self.schema, data, slot_keys, keys = self.load_data(file_name, from_data)
+        self.index_tuning = None
+        #(index, slots) are swapped together so a reader always sees a matching pair
+        self._layout = (self.build_index(slot_keys), data)
+        self._built_rows = len(keys)
+        self._inserted_rows = 0
+        self.n_rows = len(keys)
+        #fences: smallest and largest key inserted, kept through deletes
+        self.min_key = keys[0] if len(keys) else None
+        self.max_key = keys[-1] if len(keys) else None
+        #Bloom filter over the keys, built for nested tables by flatten_entity
+        self.bloom = None
+    
+    @property
+    def li(self):
+        return self._layout[0]
+    
+    @property
+    def data(self):
+        return self._layout[1]
+    
+    def build_index(self, keys):
+        #returns a fitted index over the sorted keys
+        #non-numeric keys (str, bytes, tuples) are learned through an order-preserving float encoding
+        key_encoder = KeyEncoder() if needs_encoding(keys) else None
+        if self.index_factory is not None:
+            li = self.index_factory()
+        elif self.index_levels == "auto":
+            self.index_tuning = MultiLevelRMI.tune(keys, memory_budget=self.index_memory_budget, key_encoder=key_encoder)
+            if self.log_modeling:
+                print(self.index_tuning)
+            li = MultiLevelRMI(levels=self.index_tuning.levels, key_encoder=key_encoder)
+        else:
+            li = MultiLevelRMI(levels=self.index_levels, key_encoder=key_encoder)
         if self.log_modeling:
             print('Fitting Model')
-        self.li.fit(keys)
+        li.fit(keys)
         if self.log_modeling:
             print('Finished fitting model')
-        
+        return li
     
     def load_data(self, file_name, from_data):
         #returns data
@@ -29,73 +139,257 @@ class DBTable:
             df = from_data
         else:
             df = pd.read_csv(self.file_name)
-        n = len(df)
-        data = [None] * n
-        keys = [None] * n
         schema = df.columns.tolist()
         df = df.sort_values(self.sort_key)
         
-        sort_key_index = schema.index(self.sort_key)        
-        def get_key_val(tuple, i=sort_key_index):
-            return tuple[i]
+        self.sort_key_index = schema.index(self.sort_key)
         
-        for i in range(n):
-            row_val = df.iloc[i].values #just a list of values
-            entity = ExtensibleHash(get_key_val=get_key_val, init_size=self.hash_size, init_depth= self.init_depth)
-            entity.insert_item(row_val)
-            data[i] = entity
-            keys[i] = get_key_val(row_val)
-        return schema, data, keys
-    
-    def flatten_entity(self, i):
-        #convert ith position to another table
-        hash_ds = self.data[i]
+        #one sort, then the hash layout keeps the frame as typed columns and a slot per row
+        #that only gets its ExtensibleHash when first written (see SlotList); gapped nodes
+        #store whole rows, as df.to_numpy() gives them
+        keys = df[self.sort_key].to_numpy()
+        if self.layout == "hash":
+            data = self.loaded_slots(df)
+            return schema, data, keys, keys
+        data, slot_keys = self.new_slots(df.to_numpy(), keys)
+        return schema, data, slot_keys, keys
+    
+    def get_key_val(self, tuple):
+        return tuple[self.sort_key_index]
+    
+    def coerce_key(self, value):
+        #key values typed into the REPL arrive as strings; numeric sort keys compare as ints
+        if needs_encoding(self.li.keys):
+            return value
+        return int(value)
+    
+    def new_entity(self, row_val):
+        #a slot holding a single row
+        entity = ExtensibleHash(get_key_val=self.get_key_val, init_size=self.hash_size, init_depth= self.init_depth, hash_fn=self.hash_fn)
+        entity.insert_item(row_val)
+        return entity
+    
+    def loaded_slots(self, df):
+        #a slot per row of the frame df, sorted by key, none of them written yet
+        columns = [df[column].to_numpy() for column in df.columns]
+        return SlotList(range(len(df)), columns, df.iloc[:0].to_numpy().dtype, self.sort_key_index)
+    
+    def new_slots(self, rows, keys):
+        '''
+        Slots for the sorted 2D array rows (keys: their sort keys) and the key each slot
+        starts at: a slot per row, or for the gapped layout a node per run of about
+        node_size rows, never cutting through rows with equal keys.
+        '''
+        if self.layout == "hash":
+            return ExtensibleHash.singletons(list(rows), rows[:, self.sort_key_index], get_key_val=self.get_key_val, init_size=self.hash_size, init_depth=self.init_depth, hash_fn=self.hash_fn), keys
+        keys = as_key_array(keys.tolist() if keys.dtype == object else keys)
+        changes = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = [0]
+        while starts[-1] + self.node_size < len(keys):
+            i = np.searchsorted(changes, starts[-1] + self.node_size)
+            if i == len(changes):
+                break
+            starts.append(int(changes[i]))
+        bounds = starts + [len(keys)]
+        data = [GappedNode(self.get_key_val, keys[a:b], list(rows[a:b]), **self.node_costs) for a, b in zip(bounds, bounds[1:])]
+        return data, keys[starts] if len(keys) else keys
+    
+    def get_data(self):
+        #every row of the table, slot by slot, as a DataFrame; the rows of unwritten loaded
+        #slots are taken from the loaded columns in one go and put in their place by index
+        data = self.data
+        rows, at, loaded, loaded_at = [], [], [], []
+        for data_container in data:
+            if type(data_container) is int:
+                loaded_at.append(len(at) + len(loaded_at))
+                loaded.append(data_container)
+                continue
+            if isinstance(data_container, DBTable):
+                slot_rows = data_container.get_data().values.tolist()
+            else:
+                slot_rows = data_container.get_data().tolist()
+            start = len(at) + len(loaded_at)
+            at += range(start, start + len(slot_rows))
+            rows += slot_rows
+        frame = pd.DataFrame(rows, columns=self.schema, index=at)
+        if loaded:
+            loaded = pd.DataFrame({name: column[loaded] for name, column in zip(self.schema, data.columns)}, index=loaded_at)
+            frame = pd.concat([loaded, frame]).sort_index() if rows else loaded
+        return frame.reset_index(drop=True).infer_objects()
+    
+    def flatten_entity(self, i, data=None):
+        #convert ith position to another table, laid out in gapped nodes: those split sideways
+        #under the inner index instead of nesting again, so tables are at most two levels deep.
+        #Only hash slots flatten, so self.layout is always "hash" here, and an inner table of
+        #that layout would flatten its own slots past depth_limit and nest without bound
+        if data is None:
+            data = self.data
+        hash_ds = data[i]
         hash_ds_data = hash_ds.get_data()
         inner_data = {}
         for col_i, col_name in enumerate(self.schema):
             inner_data[col_name] = hash_ds_data[:, col_i]
         df = pd.DataFrame(inner_data)
         
-        inner_table = DBTable(from_data=df, file_name=None, sort_key=self.sort_key, index_levels=self.index_levels, hash_size=self.hash_size, init_depth=self.init_depth)
-        self.data[i] = inner_table
+        inner_table = DBTable(from_data=df, file_name=None, sort_key=self.sort_key, index_levels=self.index_levels, hash_size=self.hash_size, init_depth=self.init_depth, index_memory_budget=self.index_memory_budget, index_factory=self.index_factory, hash_fn=self.hash_fn, layout="gapped", node_size=self.node_size, node_costs=self.node_costs)
+        inner_table.build_filter()
+        data[i] = inner_table
+    
+    def slot_of(self, li, key_val):
+        '''
+        Slot responsible for key_val: slots are range partitioned, slot i holds the keys
+        in [li.keys[i], li.keys[i + 1]) and slot 0 also everything below li.keys[0].
+        '''
+        pos = li.lower_bound(key_val)
+        if pos < li.N and li.keys[pos] == key_val:
+            return pos
+        return max(0, pos - 1)
+    
+    @contextmanager
+    def _writing(self):
+        #holds the lock and marks the layout as changing for the readers of _read
+        with self._write_lock:
+            self._version += 1
+            try:
+                yield
+            finally:
+                self._version += 1
+    
+    def _read(self, fn, *args):
+        '''
+        Runs the read fn(*args) without the lock when no write overlaps it. Inserts shift index keys
+        and slots, split nodes and reorganise hash buckets in place, so a read during one can land in
+        the wrong slot or see a container half rebuilt: such a read (or its exception) is discarded
+        and run again holding the lock, which also keeps a stream of writes from starving it.
+        '''
+        version = self._version
+        if not version & 1:
+            try:
+                result = fn(*args)
+            except Exception:
+                if self._version == version:
+                    raise
+            else:
+                if self._version == version:
+                    return result
+        with self._write_lock:
+            return fn(*args)
     
     def select(self, key_val):
-        pos, error, _ = self.li._predict_pos_and_error(key_val)
-        #todo: look around error
-        #force pos to be either 
-        pos = min(len(self.data), pos)
-        pos = max(0, pos)
-        search_lim = error // 2
-        i = 0
-        while i <= search_lim:
-            pos_left = pos - i
-            pos_right = pos + i
-            #search on left
-            if pos_left >= 0 and pos_left < len(self.data):
-                data_container = self.data[pos_left]
-                if isinstance(data_container, DBTable):
-                    results = data_container.select(key_val)
-                    if results is not None:
-                        return results
-                else:
-                    results = data_container.get(key_val)
-                    if results is not None:
-                        return results
-            #search on right
-            if pos_right >= 0 and pos_right < len(self.data):
-                data_container = self.data[pos_right]
-                if isinstance(data_container, DBTable):
-                    results = data_container.select(key_val)
-                    if results is not None:
-                        return results
-                else:
-                    results = data_container.get(key_val)
-                    if results is not None:
-                        return results
-            i+= 1           
-            
-        return None
+        return self._read(self._select, key_val)
+    
+    def _select(self, key_val):
+        #one read of the layout: a concurrent rebuild can swap it without affecting this search
+        li, data = self._layout
+        if not data:
+            return None
+        data_container = data[self.slot_of(li, key_val)]
+        if type(data_container) is int:
+            #a loaded row that no write has touched
+            return data.row(data_container) if data.keys[data_container] == key_val else None
+        #a nested table is only searched when its fences and filter allow the key
+        #(a hash checks its own in get)
+        if isinstance(data_container, DBTable):
+            if not data_container.might_contain(key_val):
+                return None
+            return data_container._select(key_val)
+        return data_container.get(key_val)
     
+    def select_many(self, keys):
+        '''
+        Looks up every key of keys at once.
+        Returns (rows, found): a DataFrame with one row per key, in the order of keys
+        (missing keys get a row of NaN), and the boolean array of the keys that were found.
+        The slots of all keys come from one batch search of the index (see slots_of) and every
+        slot is probed once with all of its keys (see ExtensibleHash.get_many); nested tables
+        get their keys as a single batch.
+        '''
+        keys = as_key_array(keys)
+        found_rows = self._read(self._select_many, keys)
+        found = np.array([row is not None for row in found_rows], dtype=bool)
+        at = np.flatnonzero(found)
+        values = np.vstack([found_rows[i] for i in at.tolist()]) if len(at) else None
+        rows = pd.DataFrame(values, columns=self.schema, index=at)
+        return rows.reindex(range(len(keys))).infer_objects(), found
+
+    def _select_many(self, keys):
+        #list of the rows found for keys (None where absent), aligned with keys
+        li, data = self._layout
+        out = [None] * len(keys)
+        if not len(keys) or not len(data):
+            return out
+        slots, _ = self.slots_of(li, keys)
+        rest = np.arange(len(keys))
+        if isinstance(data, SlotList):
+            #keys whose slot is an unwritten loaded row are compared with its key column all at once
+            containers = [data[slot] for slot in slots.tolist()]
+            loaded = np.fromiter((type(slot) is int for slot in containers), dtype=bool, count=len(keys))
+            if loaded.any():
+                at = np.flatnonzero(loaded)
+                positions = np.array([containers[i] for i in at.tolist()], dtype=np.int64)
+                hit = data.keys[positions] == keys[at]
+                for i, row in zip(at[hit].tolist(), data.rows(positions[hit])):
+                    out[i] = row
+                rest = np.flatnonzero(~loaded)
+                keys, slots = keys[rest], slots[rest]
+                if not len(keys):
+                    return out
+        #keys sorted by slot (then every slot's keys are a slice), hashed in one call for the hash slots
+        order = np.argsort(slots, kind='stable')
+        keys, slots = keys[order], slots[order]
+        hashes = hash_many(keys) if self.layout == "hash" and self.hash_fn == "splitmix64" else None
+        starts = np.flatnonzero(np.concatenate(([True], slots[1:] != slots[:-1])))
+        ends = np.append(starts[1:], len(keys))
+        for start, end, slot in zip(starts.tolist(), ends.tolist(), slots[starts].tolist()):
+            data_container = data[slot]
+            group = order[start:end]
+            if isinstance(data_container, DBTable):
+                group_keys = keys[start:end]
+                inside = np.array([data_container.might_contain(key) for key in group_keys.tolist()], dtype=bool)
+                group = group[inside]
+                rows = data_container._select_many(group_keys[inside]) if len(group) else []
+            else:
+                rows = data_container.get_many(keys[start:end], None if hashes is None else hashes[start:end])
+            for i, row in zip(rest[group].tolist(), rows):
+                out[i] = row
+        return out
+
+    def select_range(self, lo, hi):
+        '''
+        Yields the rows with lo <= key <= hi in key order, one slot at a time, so only
+        a single slot's rows are held in memory. Nested tables are streamed recursively.
+        The scan runs over the layout current when it started and, unlike select, is not
+        retried: rows inserted or moved while it runs may be missed.
+        '''
+        li, data = self._layout
+        keys = li.keys
+        #the slot before the lower bound may hold inserted keys >= lo
+        i = max(0, li.lower_bound(lo) - 1)
+        while i < len(data):
+            #slot 0 can hold keys below its own, every later slot starts at its key
+            if i > 0 and keys[i] > hi:
+                return
+            data_container = data[i]
+            if type(data_container) is int:
+                if lo <= data.keys[data_container] <= hi:
+                    yield data.row(data_container)
+                i += 1
+                continue
+            nested = isinstance(data_container, DBTable)
+            low, high = (data_container.min_key, data_container.max_key) if nested else (data_container.min, data_container.max)
+            #slots whose key fences miss [lo, hi] are skipped without reading their rows
+            if low is None or high < lo or low > hi:
+                pass
+            elif nested:
+                yield from data_container.select_range(lo, hi)
+            else:
+                rows = data_container.get_data()
+                if len(rows):
+                    row_keys = rows[:, self.sort_key_index]
+                    for j in np.argsort(row_keys, kind='stable'):
+                        if lo <= row_keys[j] <= hi:
+                            yield rows[j]
+            i += 1
     
     def insert(self, row):
         '''
@@ -103,26 +397,484 @@ class DBTable:
         :param self: Description
         :param row: {"att1": val, "attr2": val2} of row being added to table
         '''
+        with self._writing():
+            li, data = self._layout
+            self._insert_into(li, data, row)
+            if self._rebuild_delta is not None:
+                self._rebuild_delta.append((self._insert_into, row, 1))
+            self._inserted_rows += 1
+            self.n_rows += 1
+            self._add_key(row[self.sort_key])
+            start_rebuild = self._rebuild_due()
+        if start_rebuild:
+            self._start_rebuild()
+    
+    def insert_many(self, df):
+        '''
+        Inserts every row of the DataFrame df (the table's columns, in any order) as one batch:
+        the rows are sorted once and their slots found with one search over the index keys,
+        then every slot takes its rows in a single update. Flattening and node splits are
+        decided once per slot after the batch, and the index is refit once when many slots are added.
+        '''
+        self._insert_rows(df[self.schema].to_numpy())
+    
+    def _insert_rows(self, rows):
+        #insert_many for a 2D array of rows in schema order
+        keys = as_key_array(rows[:, self.sort_key_index].tolist())
+        order = np.argsort(keys, kind='stable')
+        rows, keys = rows[order], keys[order]
+        with self._writing():
+            li, data = self._layout
+            self._insert_rows_into(li, data, rows)
+            if self._rebuild_delta is not None:
+                self._rebuild_delta.append((self._insert_rows_into, rows, len(rows)))
+            self._inserted_rows += len(rows)
+            self.n_rows += len(rows)
+            self._add_keys(keys)
+            start_rebuild = self._rebuild_due()
+        if start_rebuild:
+            self._start_rebuild()
+    
+    def _rebuild_due(self):
+        #called holding the lock: whether the inserts since the last build call for a rebuild
+        return self._rebuild_delta is None and self.rebuild_threshold is not None and \
+            self._inserted_rows > self.rebuild_threshold * max(1, self._built_rows)
+    
+    def _start_rebuild(self):
+        try:
+            self.rebuild(background=True)
+        except RuntimeError:
+            #another writer started it first
+            pass
+    
+    def _add_key(self, key_val):
+        if self.min_key is None:
+            self.min_key = self.max_key = key_val
+        elif key_val < self.min_key:
+            self.min_key = key_val
+        elif key_val > self.max_key:
+            self.max_key = key_val
+        if self.bloom is not None:
+            self.bloom.add(hash_key(key_val))
+            if self.bloom.full():
+                self.build_filter()
+    
+    def _add_keys(self, keys):
+        #_add_key for a sorted key array, with the filter rebuilt once if the keys overfill it
+        if not len(keys):
+            return
+        if self.min_key is None or keys[0] < self.min_key:
+            self.min_key = keys[0]
+        if self.max_key is None or keys[-1] > self.max_key:
+            self.max_key = keys[-1]
+        if self.bloom is not None:
+            if self.bloom.count + len(keys) > self.bloom.capacity:
+                self.build_filter()
+                return
+            for hash_val in hash_many(keys).tolist():
+                self.bloom.add(hash_val)
+    
+    def build_filter(self):
+        #Bloom filter over every key, sized for twice as many
+        keys = as_key_array(self.get_data()[self.sort_key].tolist())
+        self.bloom = BloomFilter.from_hashes(hash_many(keys))
+    
+    def might_contain(self, key_val):
+        '''
+        False when no row can have key_val: it is outside the [min_key, max_key] fences
+        or the Bloom filter (when built) rules it out.
+        '''
+        try:
+            if self.min_key is None or key_val < self.min_key or key_val > self.max_key:
+                return False
+        except TypeError:
+            return False
+        return self.bloom is None or self.bloom.might_contain(hash_key(key_val))
+    
+    def _insert_into(self, li, data, row):
         key_val = row[self.sort_key]
-        pos, error, _ = self.li._predict_pos_and_error(key_val)
-        #TODO: ideally look within error bound to find the best match,
-        # i.e a bucket really close to pos, but that also allows the data to be 'sorted'
-        pos = min(len(self.data) - 1, pos)
-        pos = max(0, pos)
-        data_container = self.data[pos]
+        if not data:
+            self._first_slots(li, data, row.to_numpy().reshape(1, -1))
+            return
+        if self.layout == "gapped":
+            self._insert_into_node(li, data, row)
+            return
+        #the slot whose key range covers key_val, which keeps the slots sorted
+        pos = self.slot_of(li, key_val)
+        data_container = data[pos]
+        #a key the index does not hold yet (and without rows waiting here) goes into the index too
+        new_key = self.slot_per_key and hasattr(li, "insert") and li.lookup(key_val) == -1 and \
+            not self._holds(data, data_container, key_val)
+        data_container = self._written(data, pos)
         if isinstance(data_container, DBTable):
             data_container.insert(row)
         else:
             data_container.insert_item(row.values)
             #triggers regrowth
             if self.depth_limit is not None and data_container.global_depth > self.depth_limit:
-                self.flatten_entity(pos)
+                self.flatten_entity(pos, data)
+        if new_key:
+            old_keys = li.keys
+            self._realign(li, data, old_keys, li.insert(key_val))
+    
+    def _written(self, data, pos):
+        #the slot at pos, about to be written: an unwritten loaded row gets its ExtensibleHash now
+        data_container = data[pos]
+        if type(data_container) is int:
+            data[pos] = data_container = self.new_entity(data.row(data_container))
+        return data_container
+    
+    def _holds(self, data, data_container, key_val):
+        #whether a slot has rows with key_val
+        if type(data_container) is int:
+            return data.keys[data_container] == key_val
+        if isinstance(data_container, DBTable):
+            return data_container._select(key_val) is not None
+        return data_container.get(key_val) is not None
+    
+    def empty_slot(self):
+        if self.layout == "gapped":
+            return GappedNode(self.get_key_val, **self.node_costs)
+        return ExtensibleHash(get_key_val=self.get_key_val, init_size=self.hash_size, init_depth=self.init_depth, hash_fn=self.hash_fn)
+    
+    def _realign(self, li, data, old_keys, merge, made=None):
+        '''
+        Lays the slots out again after the index merged the keys it had pending (see
+        MultiLevelRMI.retrain_leaf). merge is (removed, added): the positions in old_keys of
+        the slot keys that left and the positions in li.keys of those that came, or None.
+        The slots of removed keys go, added keys get the slot made gives for them (slot key ->
+        slot) or an empty one, then the rows of every slot whose range changed move to the
+        slot that covers them now. Besides the splice of the slot list, which copies references
+        only, the work is proportional to the rows of those slots.
+        '''
+        if merge is None or not (len(merge[0]) or len(merge[1])):
+            return
+        removed, added = merge
+        keys = li.keys
+        #slots that go, and the slots whose range an added slot cuts
+        covering = np.maximum(np.searchsorted(old_keys, keys[added], side='right') - 1, 0) if len(old_keys) else added[:0]
+        sources = np.union1d(removed, covering).astype(np.int64)
+        source_slots = [data[i] for i in sources.tolist()]
+        slots, start = [], 0
+        for i in removed.tolist():
+            slots += data[start:i]
+            start = i + 1
+        slots += data[start:]
+        spliced, start = [], 0
+        for j, p in enumerate(added.tolist()):
+            spliced += slots[start:p - j]
+            slot = made.get(keys[p]) if made else None
+            spliced.append(self.empty_slot() if slot is None else slot)
+            start = p - j
+        spliced += slots[start:]
+        data[:] = spliced
+        #where the sources are now (-1 once gone)
+        in_kept = sources - np.searchsorted(removed, sources, side='left')
+        now = in_kept + np.searchsorted(added - np.arange(len(added)), in_kept, side='right')
+        now[np.isin(sources, removed)] = -1
+        stray = []
+        for source, pos, own_key in zip(source_slots, now.tolist(), old_keys[sources].tolist() if len(sources) else ()):
+            if type(source) is int:
+                #an unwritten loaded slot holds just the row with its own key, which moves only if the slot went
+                if pos == -1:
+                    stray.append(data.rows([source]))
+                continue
+            nested = isinstance(source, DBTable)
+            rows = source.get_data().to_numpy() if nested else source.get_data()
+            if not len(rows):
+                continue
+            row_keys = as_key_array(rows[:, self.sort_key_index].tolist())
+            dest = np.maximum(np.searchsorted(keys, row_keys, side='right') - 1, 0) if len(keys) else np.full(len(rows), -1)
+            #rows stay where they are covered, and rows with the slot's own key stay in it
+            moving = dest != pos
+            if pos != -1:
+                moving &= row_keys != own_key
+            if not moving.any():
+                continue
+            for key in np.unique(row_keys[moving]).tolist():
+                source.delete(key)
+            if nested and pos != -1:
+                collapsed = self.collapse_entity(source)
+                if collapsed is not None:
+                    data[pos] = collapsed
+            stray.append(rows[moving])
+        if not stray:
+            return
+        rows = np.concatenate(stray)
+        if not data:
+            #every slot went: the rows start the table again
+            self._first_slots(li, data, rows[np.argsort(as_key_array(rows[:, self.sort_key_index].tolist()), kind='stable')])
+            return
+        row_keys = as_key_array(rows[:, self.sort_key_index].tolist())
+        dest = np.maximum(np.searchsorted(keys, row_keys, side='right') - 1, 0)
+        order = np.argsort(dest, kind='stable')
+        rows, dest = rows[order], dest[order]
+        starts = np.flatnonzero(np.concatenate(([True], dest[1:] != dest[:-1])))
+        for start, end, pos in zip(starts.tolist(), np.append(starts[1:], len(dest)).tolist(), dest[starts].tolist()):
+            group = rows[start:end]
+            data_container = self._written(data, pos)
+            if isinstance(data_container, DBTable):
+                data_container._insert_rows(group)
+                continue
+            for row in group:
+                data_container.insert_item(row)
+            if self.layout == "hash" and self.depth_limit is not None and data_container.global_depth > self.depth_limit:
+                self.flatten_entity(pos, data)
+    
+    def _first_slots(self, li, data, rows):
+        #an empty table takes its first rows (sorted) like a load: new slots, and the index fit on their keys
+        slots, slot_keys = self.new_slots(rows, rows[:, self.sort_key_index])
+        slot_keys = as_key_array(slot_keys.tolist())
+        #an RMI built over no keys did not know yet whether they need encoding (see build_index)
+        if getattr(li, "key_encoder", False) is None and needs_encoding(slot_keys):
+            li.key_encoder = KeyEncoder()
+        li.fit(slot_keys)
+        data[:] = slots
+    
+    def _insert_into_node(self, li, data, row):
+        #the node whose key range covers key_val takes the row, after the adjustment its cost
+        #model asks for (see GappedNode.adjustment); nodes split at twice node_size at the latest
+        key_val = row[self.sort_key]
+        pos = self.slot_of(li, key_val)
+        node = data[pos]
+        action = node.adjustment(2 * self.node_size)
+        if action == "split":
+            halves = node.split()
+            if halves is not None:
+                self._split_node(li, data, pos, halves)
+                node = halves[1] if key_val >= halves[1].min else halves[0]
+        elif action == "expand":
+            node.expand()
+        elif action == "retrain":
+            node.retrain()
+        node.insert_item(row.values)
+    
+    def _split_node(self, li, data, pos, halves):
+        #the halves become siblings under the index, the upper one starting at its first key
+        if hasattr(li, "insert_many"):
+            data[pos] = halves[0]
+            old_keys = li.keys
+            self._realign(li, data, old_keys, li.insert_many([halves[1].min], merge=True), {halves[1].min: halves[1]})
+        else:
+            data[pos:pos + 1] = halves
+            keys = li.keys.tolist()
+            keys.insert(pos + 1, halves[1].min)
+            li.fit(as_key_array(keys))
+    
+    def slots_of(self, li, keys):
+        #slot_of for an array of keys: the index finds their lower bounds in one batch,
+        #each key searched in its predicted window (see lower_bound_many)
+        pos = li.lower_bound_many(keys)
+        hit = pos < len(li.keys)
+        hit[hit] = li.keys[pos[hit]] == keys[hit]
+        return np.where(hit, pos, np.maximum(pos - 1, 0)), hit
+    
+    def _insert_rows_into(self, li, data, rows):
+        #_insert_into for a 2D array of rows sorted by key
+        if not data:
+            self._first_slots(li, data, rows)
+            return
+        keys = as_key_array(rows[:, self.sort_key_index].tolist())
+        slots, hit = self.slots_of(li, keys)
+        if self.layout == "gapped":
+            self._insert_rows_into_nodes(li, data, rows, keys, slots)
+            return
+        #as in _insert_into, with slot_per_key the keys the index does not hold yet (and without rows
+        #waiting in their slot) go into the index, with one insert_many once the rows are in
+        new_keys = []
+        if self.slot_per_key and hasattr(li, "insert"):
+            fresh = np.flatnonzero(~hit)
+            if len(fresh):
+                fresh = fresh[np.concatenate(([True], keys[fresh[1:]] != keys[fresh[:-1]]))]
+            new_keys = [keys[j] for j in fresh.tolist() if not self._holds(data, data[slots[j]], keys[j])]
+        bounds = np.flatnonzero(np.diff(slots)) + 1
+        for group in np.split(np.arange(len(keys)), bounds) if len(keys) else ():
+            pos = slots[group[0]]
+            data_container = self._written(data, pos)
+            if isinstance(data_container, DBTable):
+                data_container._insert_rows(rows[group])
+                continue
+            for j in group.tolist():
+                data_container.insert_item(rows[j])
+            if self.depth_limit is not None and data_container.global_depth > self.depth_limit:
+                self.flatten_entity(pos, data)
+        if new_keys:
+            old_keys = li.keys
+            self._realign(li, data, old_keys, li.insert_many(new_keys))
+    
+    def _add_slots(self, li, data, slot_keys, new_slots):
+        '''
+        Adds new_slots, starting at slot_keys (sorted, none of them an index key yet), and
+        updates the index: through its insert_many for a few slots (see INSERT_SLOT_RATIO),
+        otherwise with a single refit over the merged keys.
+        '''
+        if hasattr(li, "insert_many"):
+            old_keys = li.keys
+            if len(new_slots) <= len(data) // INSERT_SLOT_RATIO:
+                self._realign(li, data, old_keys, li.insert_many(slot_keys, merge=True), dict(zip(slot_keys, new_slots)))
+                return
+            #the refit drops what the index has pending, so that goes in first
+            self._realign(li, data, old_keys, li.retrain_dirty())
+        positions = np.searchsorted(li.keys, as_key_array(list(slot_keys)), side='left')
+        #the slot list is spliced from slices of the old one, so only the refit is done per key
+        li.fit(np.insert(li.keys, positions, as_key_array(list(slot_keys))))
+        slots, start = [], 0
+        for pos, slot in zip(positions.tolist(), new_slots):
+            slots += data[start:pos]
+            slots.append(slot)
+            start = pos
+        slots += data[start:]
+        data[:] = slots
+    
+    def _insert_rows_into_nodes(self, li, data, rows, keys, slots):
+        #every node takes its rows one at a time, or merged in one rebuild when they are many;
+        #nodes past twice node_size are then cut into nodes of about node_size
+        bounds = np.flatnonzero(np.diff(slots)) + 1
+        slot_keys, new_nodes = [], []
+        for group in np.split(np.arange(len(keys)), bounds) if len(keys) else ():
+            pos = int(slots[group[0]])
+            node = data[pos]
+            if len(group) * MERGE_RATIO < node.n_items:
+                for j in group.tolist():
+                    node.insert_item(rows[j])
+            else:
+                node.merge(keys[group], list(rows[group]))
+            if node.n_items <= 2 * self.node_size:
+                continue
+            node_keys, node_rows = node.items()
+            pieces, piece_keys = self.new_slots(node_rows, node_keys)
+            if len(pieces) == 1:
+                continue
+            data[pos] = pieces[0]
+            slot_keys += list(piece_keys[1:])
+            new_nodes += pieces[1:]
+        if new_nodes:
+            self._add_slots(li, data, slot_keys, new_nodes)
+    
+    def delete(self, key_val):
+        '''
+        Deletes every row whose sort key is key_val and returns how many there were.
+        Slots left empty are dropped together with their index key when the index
+        supports delete, and nested tables that shrink collapse back into a hash.
+        '''
+        with self._writing():
+            li, data = self._layout
+            removed = self._delete_from(li, data, key_val)
+            if self._rebuild_delta is not None:
+                self._rebuild_delta.append((self._delete_from, key_val, 0))
+            self.n_rows -= removed
+        return removed
+    
+    def _delete_from(self, li, data, key_val):
+        removed = 0
+        i = self.slot_of(li, key_val)
+        first = True
+        emptied = []
+        #rows loaded with the same key have a slot each, all starting at that key
+        while i < len(data) and (first or li.keys[i] == key_val):
+            first = False
+            data_container = data[i]
+            if type(data_container) is int:
+                #an unwritten loaded slot holds one row; deleting it writes the slot, which is left empty
+                if data.keys[data_container] != key_val:
+                    i += 1
+                    continue
+                data[i] = data_container = self.empty_slot()
+                count = 1
+            else:
+                count = data_container.delete(key_val)
+            removed += count
+            if count and isinstance(data_container, DBTable):
+                collapsed = self.collapse_entity(data_container)
+                if collapsed is not None:
+                    data[i] = data_container = collapsed
+            empty = data_container.n_rows == 0 if isinstance(data_container, DBTable) else data_container.n_items == 0
+            if count and empty and hasattr(li, "delete"):
+                emptied.append(li.keys[i])
+            i += 1
+        if not hasattr(li, "delete"):
+            return removed
+        #the inverse of an insert with its own slot: the index lets go of the keys of emptied slots,
+        #which leave with their slots when the leaf merges, and of a key whose rows were only waiting
+        if removed and li.lookup(key_val) == -1:
+            emptied.append(key_val)
+        for key in emptied:
+            old_keys = li.keys
+            self._realign(li, data, old_keys, li.delete(key))
+        return removed
+    
+    def collapse_entity(self, inner_table):
+        #a nested table back into a single hash once it holds at most a quarter of what
+        #flattening needs, and its rows fit within depth_limit again; None otherwise
+        capacity = self.hash_size << max(0, (self.depth_limit or 0) - 2)
+        if inner_table.n_rows > capacity:
+            return None
+        rows = list(inner_table.get_data().values)
+        hash_ds = ExtensibleHash.from_items(rows, get_key_val=self.get_key_val, init_size=self.hash_size, init_depth=self.init_depth, hash_fn=self.hash_fn)
+        if self.depth_limit is not None and hash_ds.global_depth > self.depth_limit:
+            return None
+        return hash_ds
+    
+    def rebuild(self, background=True):
+        '''
+        Refits the index and lays out the slots again (see new_slots) from a snapshot of the table.
+        select, insert and delete keep using the old layout meanwhile; writes are also
+        logged and replayed into the new layout right before it is swapped in.
+        :param background: build in a worker thread and return it (join it to wait),
+            otherwise build before returning None
+        '''
+        snapshot = self._begin_rebuild()
+        if not background:
+            self._run_rebuild(snapshot)
+            return None
+        self._rebuild_thread = threading.Thread(target=self._run_rebuild, args=(snapshot,), daemon=True)
+        self._rebuild_thread.start()
+        return self._rebuild_thread
+    
+    def _begin_rebuild(self):
+        #snapshot the rows and start logging inserts
+        with self._write_lock:
+            if self._rebuild_delta is not None:
+                raise RuntimeError("A rebuild of this table is already running")
+            self._rebuild_delta = []
+            return self.get_data()
+    
+    def _run_rebuild(self, snapshot):
+        try:
+            self._finish_rebuild(self._build_layout(snapshot))
+        except BaseException:
+            with self._write_lock:
+                self._rebuild_delta = None
+            raise
+    
+    def _build_layout(self, snapshot):
+        #same layout as load_data: the hash layout only copies the snapshot's columns
+        #(see SlotList), so neither layout holds the GIL long enough to need batching
+        snapshot = snapshot.sort_values(self.sort_key)
+        keys = snapshot[self.sort_key].to_numpy()
+        if self.layout == "hash":
+            return self.build_index(keys), self.loaded_slots(snapshot), len(snapshot)
+        data, slot_keys = self.new_slots(snapshot.to_numpy(), keys)
+        return self.build_index(slot_keys), data, len(snapshot)
+    
+    def _finish_rebuild(self, layout):
+        li, data, built_rows = layout
+        with self._write_lock:
+            inserted_rows = 0
+            for apply, change, rows in self._rebuild_delta:
+                apply(li, data, change)
+                inserted_rows += rows
+            self._layout = (li, data)
+            self._built_rows = built_rows
+            self._inserted_rows = inserted_rows
+            self._rebuild_delta = None
     
     def __str__(self,):
         #prints tree representation of itself:
         representation = ""
-        for data_container in self.data:
-            representation += "\n\t" + str(data_container)
+        data = self.data
+        for data_container in data:
+            representation += "\n\t" + str(data.row(data_container) if type(data_container) is int else data_container)
         return representation
         
             
@@ -1,7 +1,12 @@
 import pandas as pd
-from hasher import ExtensibleHash
+from hasher import ExtensibleHash, Bucket, fingerprint
+from hashing import hash_key, hash_many, BloomFilter
+from gapped import GappedNode
 import numpy as np
 import table
+from rmi import MultiLevelRMI, SimpleModel
+from pgm import PGMIndex
+from radix_spline import RadixSpline
 
 def test_hasher_with_tuples(log=False):
     df = pd.DataFrame(
@@ -40,6 +45,815 @@ def test_hasher_with_tuples_extraction(log=False):
         assert result is not None
         assert result[0].item() == i
  
+def test_rmi_vectorized_fit(log=False):
+    rng = np.random.default_rng(0)
+    keys = np.unique((rng.exponential(1.0, size=5000) * 1e6).astype(np.int64))
+    rmi = MultiLevelRMI(levels=[1, 4, 16])
+    rmi.fit(keys)
+    sk_rmi = MultiLevelRMI(levels=[1, 4, 16], model_factory=SimpleModel)
+    sk_rmi.fit(keys)
+    #closed form leaves should match the sklearn leaves
+    for k in keys[::97]:
+        pos, _, route = rmi._predict_pos_and_error(k)
+        sk_pos, _, sk_route = sk_rmi._predict_pos_and_error(k)
+        if log:
+            print(k, pos, sk_pos)
+        assert route == sk_route
+        assert abs(pos - sk_pos) <= 1
+    print("PASSED TEST RMI VECTORIZED FIT")
+
+def test_rmi_lookup_many(log=False):
+    rng = np.random.default_rng(1)
+    keys = np.unique(rng.integers(0, 10**9, size=20000))
+    rmi = MultiLevelRMI(levels=[1, 8, 64])
+    rmi.fit(keys)
+    queries = np.concatenate([keys[::7], keys[::7] + 1, [-1, 10**10]])
+    positions, found = rmi.lookup_many(queries)
+    expected = np.array([rmi.lookup(q) for q in queries])
+    if log:
+        print(positions[:10], expected[:10])
+    assert (positions == expected).all()
+    assert (found == (expected != -1)).all()
+    #absent keys get their lower bound too, even when it lies outside the predicted window
+    assert (rmi.lower_bound_many(queries) == np.searchsorted(keys, queries)).all()
+    print("PASSED TEST RMI LOOKUP MANY")
+
+def test_rmi_error_bounds(log=False):
+    rng = np.random.default_rng(2)
+    keys = np.unique((rng.exponential(1.0, size=20000) * 1e6).astype(np.int64))
+    rmi = MultiLevelRMI(levels=[1, 4, 16])
+    rmi.fit(keys)
+    #every training key must be inside its leaf's window
+    for i in range(0, len(keys), 13):
+        pos, lo, hi = rmi._predict_window(keys[i])
+        assert lo <= i <= hi
+    positions, found = rmi.lookup_many(keys)
+    assert found.all() and (positions == np.arange(len(keys))).all()
+    #keys outside their window are still found through the exponential search
+    from rmi import exponential_search
+    assert exponential_search(keys, keys[10], len(keys) - 5, len(keys) - 1) == 10
+    assert exponential_search(keys, keys[-10], 0, 3) == len(keys) - 10
+    assert exponential_search(keys, keys[-1] + 1, 0, 3) == len(keys)
+    if log:
+        print('widest window: ', (rmi.err_hi - rmi.err_lo).max())
+    df = pd.DataFrame({"uid": keys})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", index_levels=[1, 4, 16])
+    assert accuracy(db_table, keys[::11]) == 1.0
+    print("PASSED TEST RMI ERROR BOUNDS")
+
+def test_rmi_save_load(log=False):
+    import os
+    import tempfile
+    rng = np.random.default_rng(3)
+    keys = np.unique(rng.integers(0, 10**12, size=20000))
+    rmi = MultiLevelRMI(levels=[1, 8, 64])
+    rmi.fit(keys)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.rmi")
+        rmi.save(path)
+        loaded = MultiLevelRMI.load(path)
+        if log:
+            print('file size: ', os.path.getsize(path), 'model bytes: ', loaded.nbytes())
+        assert loaded.nbytes() == rmi.nbytes()
+        positions, found = loaded.lookup_many(keys)
+        assert found.all() and (positions == np.arange(len(keys))).all()
+        assert loaded._predict_window(keys[123]) == rmi._predict_window(keys[123])
+        del loaded, positions, found
+    print("PASSED TEST RMI SAVE LOAD")
+
+def test_rmi_tuning(log=False):
+    rng = np.random.default_rng(4)
+    keys = np.unique((rng.exponential(1.0, size=50000) * 1e9).astype(np.int64))
+    tuning = MultiLevelRMI.tune(keys, sample_size=10000)
+    if log:
+        print(tuning)
+    assert tuning.levels in [levels for levels, _ in tuning.candidates]
+    assert tuning.cost["total"] == min(cost["total"] for _, cost in tuning.candidates)
+    budget = 1000
+    small = MultiLevelRMI.tune(keys, memory_budget=budget, sample_size=10000)
+    assert small.cost["bytes"] <= budget
+    df = pd.DataFrame({"uid": keys[:5000]})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", index_levels="auto")
+    assert db_table.li.levels == db_table.index_tuning.levels
+    assert accuracy(db_table, keys[:5000:7]) == 1.0
+    print("PASSED TEST RMI TUNING")
+
+def test_pgm_index(log=False):
+    rng = np.random.default_rng(5)
+    keys = np.unique((rng.exponential(1.0, size=30000) * 1e9).astype(np.int64))
+    for epsilon in [1, 16, 64]:
+        pgm = PGMIndex(epsilon=epsilon)
+        pgm.fit(keys)
+        if log:
+            print('epsilon: ', epsilon, 'segments per level: ', [len(f) for f in pgm.first_keys])
+        predicted, err = pgm.predict_many(keys)
+        assert (np.abs(predicted - np.arange(len(keys))) <= err).all()
+        positions, found = pgm.lookup_many(keys[::5])
+        assert found.all() and (keys[positions] == keys[::5]).all()
+        assert pgm.lookup(keys[1234]) == 1234
+        assert pgm.lookup(keys[-1] + 1) == -1
+        queries = np.concatenate([keys[::5] - 1, [-1, keys[-1] + 1]])
+        assert (pgm.lower_bound_many(queries) == np.searchsorted(keys, queries)).all()
+    df = pd.DataFrame({"uid": keys[:3000], "val": np.arange(3000)})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", index_factory=lambda: PGMIndex(epsilon=8), hash_size=2)
+    assert isinstance(db_table.li, PGMIndex)
+    new_rows = pd.DataFrame({"uid": keys[3000:3300], "val": np.arange(300)})
+    for i in range(len(new_rows)):
+        db_table.insert(new_rows.iloc[i])
+    assert accuracy(db_table, keys[:3300]) == 1.0
+    print("PASSED TEST PGM INDEX")
+
+def test_radix_spline(log=False):
+    rng = np.random.default_rng(6)
+    keys = np.unique((rng.pareto(1.5, size=30000) * 1e6).astype(np.int64))
+    for epsilon in [2, 32]:
+        rs = RadixSpline(epsilon=epsilon, num_radix_bits=10)
+        rs.fit(keys)
+        if log:
+            print('epsilon: ', epsilon, 'spline points: ', len(rs.spline_keys), 'radix bits: ', rs.radix_bits)
+        predicted, err = rs.predict_many(keys)
+        assert (np.abs(predicted - np.arange(len(keys))) <= err).all()
+        for i in range(0, len(keys), 101):
+            assert rs._predict_pos_and_error(keys[i])[0] == predicted[i]
+            assert rs.lookup(keys[i]) == i
+        positions, found = rs.lookup_many(np.concatenate([keys, [keys[-1] + 1]]))
+        assert found[:-1].all() and not found[-1]
+    df = pd.DataFrame({"uid": keys[:2000]})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", index_factory=lambda: RadixSpline(epsilon=4))
+    assert accuracy(db_table, keys[:2000]) == 1.0
+    print("PASSED TEST RADIX SPLINE")
+
+def test_rmi_incremental_retrain(log=False):
+    rng = np.random.default_rng(6)
+    all_keys = np.unique(rng.integers(0, 10**9, size=40000))
+    rng.shuffle(all_keys)
+    base = np.sort(all_keys[:30000])
+    rmi = MultiLevelRMI(levels=[1, 8, 64], retrain_threshold=None)
+    rmi.fit(base)
+    for key in all_keys[30000:]:
+        assert rmi.insert(key) is None
+    #the inserts wait in their leaves' deltas until a merge
+    assert rmi.pending == len(all_keys) - 30000 and (rmi.keys == base).all()
+    keys = np.sort(all_keys)
+    #inserted and shifted keys must stay inside their leaf's window
+    def check_windows(keys):
+        for i in range(0, len(keys), 7):
+            pos, lo, hi = rmi._predict_window(keys[i])
+            assert lo <= i <= hi
+        positions, found = rmi.lookup_many(keys)
+        assert found.all() and (positions == np.arange(len(keys))).all()
+    #merging one leaf moves the keys of the others, which keep valid windows without a refit
+    leaf = max(rmi.delta, key=lambda leaf: len(rmi.delta[leaf][0]))
+    mine = np.asarray(rmi.delta[leaf][0])
+    removed, added = rmi.retrain_leaf(leaf)
+    assert not len(removed) and (rmi.keys[added] == np.sort(mine)).all()
+    check_windows(np.sort(np.concatenate([base, mine])))
+    removed, added = rmi.retrain_dirty()
+    assert len(added) == len(all_keys) - 30000 - len(mine) and rmi.pending == 0 and not len(rmi.retrain_dirty()[1])
+    assert (rmi.keys == keys).all()
+    check_windows(keys)
+    #deletes wait the same way, and an insert cancels a pending delete of its key
+    rmi.delete(keys[5]), rmi.delete(keys[9]), rmi.insert(keys[9])
+    assert rmi.pending == 1 and rmi.N == len(keys)
+    removed, added = rmi.retrain_dirty()
+    assert removed.tolist() == [5] and not len(added) and rmi.lookup(keys[5]) == -1
+    check_windows(np.delete(keys, 5))
+    #with a threshold leaves merge on their own
+    rmi = MultiLevelRMI(levels=[1, 8, 64])
+    rmi.fit(base)
+    merges = sum(rmi.insert(key) is not None for key in all_keys[30000:])
+    assert merges > 0 and rmi.N + rmi.pending == len(keys)
+    check_windows(np.sort(rmi.keys))
+    rmi.retrain_dirty()
+    assert (rmi.keys == keys).all()
+    check_windows(keys)
+    #new keys get their own slot in the table once their leaf merges (by default), or join
+    #the covering slot with slot_per_key=False
+    df = pd.DataFrame({"uid": base[:2000]})
+    new_keys = np.setdiff1d(all_keys[30000:32000], base[:2000])
+    for slot_per_key in (True, False):
+        db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", index_levels=[1, 4], slot_per_key=slot_per_key)
+        for key in new_keys:
+            db_table.insert(pd.Series({"uid": key}))
+        li = db_table.li
+        if slot_per_key:
+            assert li.N > 2000 and li.N + li.pending == 2000 + len(new_keys)
+            db_table._realign(li, db_table.data, li.keys, li.retrain_dirty())
+            assert li.N == 2000 + len(new_keys) and (li.keys == np.sort(np.concatenate([base[:2000], new_keys]))).all()
+        assert len(db_table.data) == li.N == (2000 + len(new_keys) if slot_per_key else 2000)
+        assert accuracy(db_table, np.concatenate([base[:2000], new_keys])) == 1.0
+    print("PASSED TEST RMI INCREMENTAL RETRAIN")
+
+def test_rmi_parallel_fit(log=False):
+    rng = np.random.default_rng(8)
+    keys = np.unique((rng.lognormal(0, 2, size=300000) * 1e6).astype(np.int64))
+    serial = MultiLevelRMI(levels=[1, 16, 512])
+    serial.fit(keys)
+    parallel = MultiLevelRMI(levels=[1, 16, 512])
+    parallel.fit(keys, workers=2)
+    #merged chunk moments give the same models as one pass over all keys
+    for l in range(3):
+        assert np.allclose(serial.slopes[l], parallel.slopes[l], rtol=1e-9, atol=1e-12)
+        assert np.allclose(serial.intercepts[l], parallel.intercepts[l], rtol=1e-9, atol=1e-6)
+    assert (serial.leaf_count == parallel.leaf_count).all()
+    assert (serial.leaf_min_pos == parallel.leaf_min_pos).all()
+    assert (serial.leaf_max_pos == parallel.leaf_max_pos).all()
+    positions, found = parallel.lookup_many(keys)
+    assert found.all() and (positions == np.arange(len(keys))).all()
+    print("PASSED TEST RMI PARALLEL FIT")
+
+def test_select_range(log=False):
+    rng = np.random.default_rng(9)
+    keys = np.unique(rng.integers(0, 10**6, size=4000))
+    rng.shuffle(keys)
+    base, late = np.sort(keys[:1000]), keys[1000:]
+    for factory in (None, lambda: PGMIndex(epsilon=4)):
+        db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"uid": base, "val": base * 2}), sort_key="uid",
+                                 index_levels=[1, 4], index_factory=factory, hash_size=2, depth_limit=2)
+        for key in late:
+            db_table.insert(pd.Series({"uid": key, "val": key * 2}))
+        assert db_table.li.lower_bound(-1) == 0 and db_table.li.lower_bound(10**6 + 1) == db_table.li.N
+        assert db_table.li.lower_bound(base[3] + 1) == np.searchsorted(db_table.li.keys, base[3] + 1)
+        all_keys = np.sort(keys)
+        for lo, hi in [(-5, 10**7), (all_keys[10], all_keys[900]), (all_keys[5] + 1, all_keys[5] + 1), (10**7, 10**8)]:
+            rows = list(db_table.select_range(lo, hi))
+            expected = all_keys[(all_keys >= lo) & (all_keys <= hi)]
+            assert [row[0] for row in rows] == expected.tolist()
+            assert all(row[1] == row[0] * 2 for row in rows)
+        #streams: taking the first rows does not scan the rest
+        first = next(db_table.select_range(all_keys[100], all_keys[-1]))
+        assert first[0] == all_keys[100]
+        assert accuracy(db_table, keys) == 1.0
+        if log:
+            print('nested tables: ', sum(isinstance(d, table.DBTable) for d in db_table.data))
+    print("PASSED TEST SELECT RANGE")
+
+def test_empty_table(log=False):
+    #a table loaded from no rows answers reads with nothing and takes its first slots on insert
+    empty = pd.DataFrame({"uid": np.array([], dtype=np.int64), "val": np.array([], dtype=np.int64)})
+    for options in (dict(), dict(slot_per_key=True), dict(index_factory=lambda: PGMIndex(epsilon=4)), dict(layout="gapped")):
+        db_table = table.DBTable(file_name=None, from_data=empty, sort_key="uid", **options)
+        assert db_table.select(5) is None and not db_table.select_many([5])[1].any()
+        assert list(db_table.select_range(0, 10)) == [] and db_table.delete(5) == 0
+        db_table.insert(pd.Series({"uid": 5, "val": 50}))
+        assert db_table.select(5)[1] == 50 and db_table.select(4) is None
+        db_table.insert_many(pd.DataFrame({"uid": [9, 1], "val": [90, 10]}))
+        assert accuracy(db_table, [1, 5, 9]) == 1.0 and db_table.n_rows == 3
+        db_table = table.DBTable(file_name=None, from_data=empty, sort_key="uid", **options)
+        db_table.insert_many(pd.DataFrame({"uid": [9, 1], "val": [90, 10]}))
+        assert accuracy(db_table, [1, 9]) == 1.0
+    #the index learns from the first keys whether they need encoding
+    db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"uid": np.array([], dtype=object)}), sort_key="uid")
+    for key in ("b", "a", "c"):
+        db_table.insert(pd.Series({"uid": key}))
+    assert accuracy(db_table, ["a", "b", "c"]) == 1.0 and db_table.select("d") is None
+    print("PASSED TEST EMPTY TABLE")
+
+def test_non_numeric_keys(log=False):
+    from key_encoding import KeyEncoder
+    rng = np.random.default_rng(10)
+    letters = np.array(list("abcdefghij"))
+    names = sorted({"user_" + "".join(rng.choice(letters, size=rng.integers(2, 9))) for _ in range(6000)})
+    #the encoding keeps the key order, ties only share a float
+    encoded = KeyEncoder().fit(names).encode_many(names)
+    assert (np.diff(encoded) >= 0).all()
+    base, late = names[::2], names[1::2]
+    db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"name": base, "n": np.arange(len(base))}),
+                             sort_key="name", index_levels=[1, 16])
+    for name in late:
+        db_table.insert(pd.Series({"name": name, "n": -1}))
+    assert accuracy(db_table, names) == 1.0
+    assert db_table.select("user_") is None
+    rows = list(db_table.select_range("user_b", "user_d"))
+    assert [row[0] for row in rows] == [n for n in names if "user_b" <= n <= "user_d"]
+    #composite keys are ordered lexicographically
+    pairs = sorted({(int(rng.integers(0, 20)), name) for name in names[:3000]})
+    df = pd.DataFrame({"uid": np.arange(len(pairs))})
+    df.insert(0, "pair", pairs)
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="pair", index_levels="auto")
+    positions, found = db_table.li.lookup_many(pairs)
+    assert found.all() and (positions == np.arange(len(pairs))).all()
+    assert accuracy(db_table, pairs[::7]) == 1.0
+    if log:
+        print('tuple key windows: ', np.mean(db_table.li.err_hi - db_table.li.err_lo))
+    print("PASSED TEST NON NUMERIC KEYS")
+
+def test_rmi_leaf_models(log=False):
+    import os
+    import tempfile
+    rng = np.random.default_rng(11)
+    keys = np.unique((rng.pareto(1.2, size=100000) * 1e6).astype(np.int64))
+    linear = MultiLevelRMI(levels=[1, 8, 256])
+    linear.fit(keys)
+    mixed = MultiLevelRMI(levels=[1, 8, 256], leaf_models=("linear", "cubic", "spline"))
+    mixed.fit(keys)
+    assert (mixed.leaf_kind != 0).any()
+    def mean_steps(rmi):
+        _, leaf = rmi._predict_many(keys.astype(np.float64))
+        return np.mean(np.log2((rmi.err_hi - rmi.err_lo)[leaf] + 1))
+    if log:
+        print('leaf kinds: ', np.bincount(mixed.leaf_kind, minlength=3), 'steps: ', mean_steps(linear), mean_steps(mixed))
+    assert mean_steps(mixed) < mean_steps(linear)
+    positions, found = mixed.lookup_many(keys)
+    assert found.all() and (positions == np.arange(len(keys))).all()
+    predicted, _ = mixed.predict_many(keys[::97])
+    for i, key in enumerate(keys[::97]):
+        assert mixed._predict_pos_and_error(key)[0] == predicted[i]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mixed.rmi")
+        mixed.save(path)
+        loaded = MultiLevelRMI.load(path)
+        assert (loaded.leaf_kind == mixed.leaf_kind).all()
+        assert (loaded.predict_many(keys)[0] == mixed.predict_many(keys)[0]).all()
+        del loaded
+    #inserts and leaf retraining keep the family choice and valid windows
+    new_keys = np.setdiff1d(rng.integers(keys[0], keys[-1], size=3000), keys)
+    for key in new_keys:
+        mixed.insert(key)
+    mixed.retrain_dirty()
+    all_keys = np.sort(np.concatenate([keys, new_keys]))
+    positions, found = mixed.lookup_many(all_keys)
+    assert found.all() and (positions == np.arange(len(all_keys))).all()
+    print("PASSED TEST RMI LEAF MODELS")
+
+def test_hash_functions(log=False):
+    from hashing import hash_key, hash_many
+    rng = np.random.default_rng(12)
+    ints = rng.integers(-10**15, 10**15, size=20000)
+    floats = np.concatenate([rng.random(2000) * 1e6, np.arange(-3.0, 3.0), [2.0 ** 70]])
+    words = np.array(["k" + str(i) for i in range(500)])
+    #the vectorized variant gives exactly the scalar hashes
+    assert (hash_many(ints) == np.array([hash_key(int(v)) for v in ints], dtype=np.uint64)).all()
+    assert (hash_many(floats) == np.array([hash_key(float(v)) for v in floats], dtype=np.uint64)).all()
+    assert (hash_many(words) == np.array([hash_key(str(w)) for w in words], dtype=np.uint64)).all()
+    #keys that compare equal hash equally
+    assert hash_key(7) == hash_key(7.0) == hash_key(np.int64(7)) == hash_key(np.float32(7))
+    #the directory uses the low bits, they must be balanced
+    low = hash_many(np.arange(100000)) & np.uint64(0xFF)
+    assert np.bincount(low.astype(np.int64), minlength=256).min() > 300
+    for hash_fn in ("splitmix64", "sha256"):
+        hash_ds = ExtensibleHash(lambda row: row[0], init_size=4, hash_fn=hash_fn)
+        for key in ints[:3000]:
+            hash_ds.insert_item((key, key * 2))
+        assert all(hash_ds.get(key) == (key, key * 2) for key in ints[:3000])
+        assert hash_ds.get(-1) is None
+    df = pd.DataFrame({"uid": np.sort(ints[:2000])})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", hash_fn="sha256")
+    assert accuracy(db_table, ints[:2000:7]) == 1.0
+    print("PASSED TEST HASH FUNCTIONS")
+
+def test_hash_directory(log=False):
+    rng = np.random.default_rng(13)
+    keys = rng.integers(0, 10**12, size=20000)
+    hash_ds = ExtensibleHash(lambda row: row[0], init_size=3, init_depth=2)
+    for key in keys:
+        hash_ds.insert_item((key, -key))
+    assert len(hash_ds.directory) == 2 ** hash_ds.global_depth
+    #every slot points straight at the bucket holding the keys with its low bits
+    for slot, bucket_id in enumerate(hash_ds.directory):
+        bucket = hash_ds.memory[bucket_id]
+        mask = (1 << bucket.local_depth) - 1
+        for item in bucket.memory[:bucket.next_index]:
+            assert hash_ds.hash(item[0]) & mask == slot & mask
+    #each bucket is referenced by 2 ** (global_depth - local_depth) slots
+    counts = np.bincount(hash_ds.directory, minlength=len(hash_ds.memory))
+    depths = np.array([b.local_depth for b in hash_ds.memory])
+    assert (counts == 2 ** (hash_ds.global_depth - depths)).all()
+    assert all(hash_ds.get(key) == (key, -key) for key in keys)
+    assert len(hash_ds.get_data()) == len(keys)
+    if log:
+        print('global depth: ', hash_ds.global_depth, 'buckets: ', len(hash_ds.memory))
+    print("PASSED TEST HASH DIRECTORY")
+
+def test_bucket_fingerprints(log=False):
+    bucket = Bucket(4, 0)
+    assert not hasattr(bucket, "__dict__")
+    for key in (5, 9, 13):
+        bucket.insert((key, "row"), key, fingerprint(hash_key(key)))
+    assert bucket.keys.typecode == 'q' and bucket.retrieve_item(9, fingerprint(hash_key(9))) == (9, "row")
+    assert bucket.retrieve_item(9.0, fingerprint(hash_key(9.0))) == (9, "row")
+    assert bucket.retrieve_item(10, fingerprint(hash_key(10))) is None
+    #a key the typed array can not hold moves the keys to a list
+    bucket.insert(("x", "row"), "x", fingerprint(hash_key("x")))
+    assert isinstance(bucket.keys, list) and bucket.retrieve_item("x", fingerprint(hash_key("x"))) == ("x", "row")
+    assert bucket.is_full() and not bucket.insert((1, "row"), 1, 0)
+    assert bucket.memory[:bucket.next_index] == [(5, "row"), (9, "row"), (13, "row"), ("x", "row")]
+    #rows sharing a fingerprint are told apart by their keys, and only matching rows are read
+    bucket = Bucket(3, 0)
+    for key in ("a", "b", "c"):
+        bucket.insert((key,), key, 7)
+    assert bucket.retrieve_item("c", 7) == ("c",) and bucket.retrieve_item("c", 8) is None
+    for keys in (np.arange(0, 4000, 3), np.linspace(0.5, 99.5, 1500), ["k%d" % i for i in range(1500)]):
+        hash_ds = ExtensibleHash(lambda row: row[0], init_size=4)
+        for key in keys:
+            hash_ds.insert_item((key, 1))
+        assert all(hash_ds.get(key) == (key, 1) for key in keys)
+        assert len(hash_ds.get_data()) == len(keys)
+    print("PASSED TEST BUCKET FINGERPRINTS")
+
+def test_hash_from_items(log=False):
+    rng = np.random.default_rng(17)
+    for keys, init_size, init_depth, hash_fn in ((rng.integers(0, 10**12, size=5000), 4, 0, "splitmix64"),
+                                                 (np.unique(rng.integers(0, 10**6, size=3000)), 3, 3, "sha256"),
+                                                 (["k%d" % i for i in range(2000)], 5, 1, "splitmix64")):
+        rows = [(key, i) for i, key in enumerate(keys)]
+        built = ExtensibleHash.from_items(rows, lambda row: row[0], init_size=init_size, init_depth=init_depth, hash_fn=hash_fn)
+        inserted = ExtensibleHash(lambda row: row[0], init_size=init_size, init_depth=init_depth, hash_fn=hash_fn)
+        for row in rows:
+            inserted.insert_item(row)
+        #the same buckets (by the rows they hold) at every directory slot
+        assert built.global_depth == inserted.global_depth
+        assert len(built.memory) == len(inserted.memory)
+        for slot in range(len(built.directory)):
+            a, b = built.memory[built.directory[slot]], inserted.memory[inserted.directory[slot]]
+            assert a.local_depth == b.local_depth
+            assert sorted(a.memory[:a.next_index]) == sorted(b.memory[:b.next_index])
+        assert all(built.get(key) == row for key, row in zip(keys[::7], rows[::7]))
+        for key in keys[:50]:
+            built.insert_item((key, -1))
+        assert len(built.get_data()) == len(keys) + 50
+    small = ExtensibleHash.from_items([(1, 2)], lambda row: row[0])
+    assert small.get(1) == (1, 2) and len(ExtensibleHash.from_items([], lambda row: row[0]).get_data()) == 0
+    print("PASSED TEST HASH FROM ITEMS")
+
+def test_hash_overflow_pages(log=False):
+    #more duplicates than a bucket holds used to double the directory until recursion ran out
+    hash_ds = ExtensibleHash(lambda row: row[0], init_size=4)
+    for i in range(500):
+        hash_ds.insert_item((7, i))
+    assert hash_ds.global_depth == 0 and len(hash_ds.memory) == 1
+    for key in range(1, 200):
+        hash_ds.insert_item((key * 1000, key))
+    assert hash_ds.get(7) == (7, 0) and all(hash_ds.get(key * 1000) == (key * 1000, key) for key in range(1, 200))
+    assert len(hash_ds.get_data()) == 699 and hash_ds.global_depth < 10
+    bulk = ExtensibleHash.from_items(hash_ds.get_data().tolist(), lambda row: row[0], init_size=4)
+    assert bulk.get(7)[0] == 7 and len(bulk.get_data()) == 699
+    assert sum(len(b.all_rows()) for b in bulk.memory if b.chain_hash is not None) >= 500
+    #keys whose hashes only differ past max_depth share a chain instead of growing the directory
+    hash_ds = ExtensibleHash(lambda row: row[0], init_size=2, hash_fn=lambda key: key << 12, max_depth=8)
+    for key in range(300):
+        hash_ds.insert_item((key,))
+    assert hash_ds.global_depth == 0 and all(hash_ds.get(key) == (key,) for key in range(300))
+    hash_ds = ExtensibleHash(lambda row: row[0], init_size=2, hash_fn=lambda key: key << 4, max_depth=8)
+    for key in range(300):
+        hash_ds.insert_item((key,))
+    assert hash_ds.global_depth == 8 and all(hash_ds.get(key) == (key,) for key in range(300))
+    #a table slot with many rows under one key
+    df = pd.DataFrame({"uid": np.arange(50), "val": np.arange(50)})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", index_factory=lambda: PGMIndex(epsilon=8), hash_size=4, depth_limit=3)
+    for i in range(100):
+        db_table.insert(pd.Series({"uid": 20, "val": -i}))
+    assert len(db_table.get_data()) == 150 and db_table.select(20) is not None
+    print("PASSED TEST HASH OVERFLOW PAGES")
+
+def test_delete(log=False):
+    rng = np.random.default_rng(19)
+    keys = rng.permutation(20000)
+    hash_ds = ExtensibleHash(lambda row: row[0], init_size=4, init_depth=1)
+    for key in keys:
+        hash_ds.insert_item((key,))
+    grown = len(hash_ds.memory)
+    assert all(hash_ds.delete(key) == 1 for key in keys[:19900])
+    assert hash_ds.delete(keys[0]) == 0 and hash_ds.n_items == 100
+    assert all(hash_ds.get(key) == (key,) for key in keys[19900:]) and hash_ds.get(keys[0]) is None
+    #buddies merged back and the directory halved
+    assert len(hash_ds.memory) < grown // 20 and hash_ds.global_depth < 12
+    counts = np.bincount(hash_ds.directory, minlength=len(hash_ds.memory))
+    depths = np.array([b.local_depth for b in hash_ds.memory])
+    assert (counts == 2 ** (hash_ds.global_depth - depths)).all()
+    for key in keys[19900:]:
+        hash_ds.delete(key)
+    assert hash_ds.global_depth == 1 and len(hash_ds.memory) == 1
+    #duplicates are chained and deleted together
+    for i in range(30):
+        hash_ds.insert_item((5, i))
+    assert hash_ds.delete(5) == 30 and len(hash_ds.get_data()) == 0
+    #the index drops the key when its leaf merges, and ignores keys it does not hold
+    index = MultiLevelRMI([1, 16])
+    index.fit(np.arange(0, 3000, 3))
+    assert index.delete(300) is None and index.delete(301) is None and index.N == 1000 and index.pending == 1
+    removed, added = index.retrain_dirty()
+    assert removed.tolist() == [100] and not len(added) and index.N == 999
+    assert all(index.lookup(key) == i for i, key in enumerate(index.keys))
+    #tables drop emptied slots and collapse nested tables that shrink
+    df = pd.DataFrame({"uid": np.arange(0, 2000, 2), "val": np.arange(1000)})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", hash_size=2, depth_limit=2,
+                             index_factory=lambda: MultiLevelRMI([1, 8], retrain_threshold=None), slot_per_key=True)
+    for key in range(1001, 1101, 2):
+        #odd keys also get slots of their own
+        db_table.insert(pd.Series({"uid": key, "val": -key}))
+    assert db_table.delete(500) == 1 and db_table.select(500) is None and db_table.delete(500) == 0
+    li = db_table.li
+    db_table._realign(li, db_table.data, li.keys, li.retrain_dirty())
+    assert db_table.n_rows == 1049 and len(db_table.data) == 1049 and li.N == 1049
+    #an inserted key deleted before its leaf merged leaves nothing in the index
+    db_table.insert(pd.Series({"uid": 1501, "val": 0}))
+    assert li.pending == 1 and db_table.delete(1501) == 1 and li.pending == 0
+    static = table.DBTable(file_name=None, from_data=df * 50, sort_key="uid", hash_size=2, depth_limit=2,
+                           index_factory=lambda: PGMIndex(epsilon=8))
+    for key in range(1001, 1100):
+        static.insert(pd.Series({"uid": key, "val": -key}))
+    slot = static.slot_of(static.li, 1001)
+    assert isinstance(static.data[slot], table.DBTable)
+    for key in range(1001, 1100):
+        assert static.delete(key) == 1
+    assert isinstance(static.data[slot], ExtensibleHash)
+    assert static.n_rows == 1000 and accuracy(static, np.arange(0, 100000, 100)) == 1.0
+    #deletes made during a rebuild are replayed into the new layout
+    snapshot = static._begin_rebuild()
+    static.delete(100)
+    static._finish_rebuild(static._build_layout(snapshot))
+    assert static.select(100) is None and len(static.get_data()) == 999
+    print("PASSED TEST DELETE")
+
+def test_slot_filters(log=False):
+    rng = np.random.default_rng(23)
+    keys = rng.choice(10**9, size=5000, replace=False)
+    hash_ds = ExtensibleHash(lambda row: row[0], init_size=4)
+    assert not hash_ds.might_contain(5)
+    for key in keys:
+        hash_ds.insert_item((key,))
+    assert hash_ds.min == keys.min() and hash_ds.max == keys.max()
+    assert all(hash_ds.might_contain(key) for key in keys)
+    assert not hash_ds.might_contain(-1) and not hash_ds.might_contain("text") and hash_ds.get("text") is None
+    bulk = ExtensibleHash.from_items([(key,) for key in keys], lambda row: row[0], init_size=4)
+    assert (bulk.min, bulk.max) == (hash_ds.min, hash_ds.max)
+    #the table filter: no false negatives, few false positives
+    bloom = BloomFilter.from_hashes(hash_many(keys))
+    assert all(bloom.might_contain(hash_key(key)) for key in keys)
+    absent = np.setdiff1d(rng.integers(0, 10**9, size=5000), keys)
+    assert np.mean([bloom.might_contain(hash_key(key)) for key in absent]) < 0.05
+    #nested tables are only searched when their fences and filter allow the key
+    df = pd.DataFrame({"uid": np.arange(0, 100000, 100)})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", hash_size=2, depth_limit=2,
+                             index_factory=lambda: PGMIndex(epsilon=8))
+    for key in range(1001, 1060):
+        db_table.insert(pd.Series({"uid": key}))
+    inner = db_table.data[db_table.slot_of(db_table.li, 1001)]
+    assert isinstance(inner, table.DBTable) and inner.bloom is not None
+    assert (inner.min_key, inner.max_key) == (1000, 1059)
+    calls = []
+    inner._select = lambda key: calls.append(key)
+    assert db_table.select(1080) is None and db_table.select(1061.5) is None and calls == []
+    db_table.select(1030)
+    assert calls == [1030]
+    del inner._select
+    assert accuracy(db_table, range(1001, 1060)) == 1.0
+    #range scans skip slots whose fences miss the range
+    assert [row[0] for row in db_table.select_range(1050, 1100)] == list(range(1050, 1060)) + [1100]
+    print("PASSED TEST SLOT FILTERS")
+
+def test_bulk_load(log=False):
+    rng = np.random.default_rng(29)
+    n = 3000
+    df = pd.DataFrame({"uid": rng.permutation(n) * 3, "score": rng.random(n), "name": ["n%d" % i for i in range(n)]})
+    db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid")
+    #one slot per row, in key order, the index fit on a typed key column
+    assert len(db_table.data) == n and db_table.li.keys.dtype == np.int64
+    assert (np.diff(db_table.li.keys) > 0).all()
+    for i in rng.integers(0, n, size=200):
+        row = db_table.select(df["uid"][i])
+        assert list(row) == [df["uid"][i], df["score"][i], df["name"][i]]
+    #a slot stays a position in the loaded columns until its first write gives it its hash
+    assert all(type(slot) is int for slot in db_table.data) and db_table.data.keys.dtype == np.int64
+    key = db_table.li.keys[17]
+    db_table.insert(pd.Series({"uid": key, "score": 0.5, "name": "again"}))
+    slot = db_table.data[17]
+    assert isinstance(slot, ExtensibleHash) and slot.n_items == 2 and slot.min == slot.max == key
+    assert db_table.delete(key) == 2 and db_table.select(key) is None and type(db_table.data[18]) is int
+    single = ExtensibleHash.singletons([(5, "a"), ("k", "b"), (2.5, "c")], [5, "k", 2.5], lambda row: row[0], init_size=2, init_depth=1)
+    assert [s.get(k) for s, k in zip(single, [5, "k", 2.5])] == [(5, "a"), ("k", "b"), (2.5, "c")]
+    assert all(len(s.directory) == 2 and s.get("absent") is None for s in single)
+    expected = df[df["uid"] != key].sort_values("uid").reset_index(drop=True)
+    assert db_table.get_data().equals(expected)
+    print("PASSED TEST BULK LOAD")
+
+def test_gapped_layout(log=False):
+    rng = np.random.default_rng(31)
+    #a node keeps its keys sorted with gaps between them, for numeric and tuple keys alike
+    for make in (int, lambda v: ("k", int(v))):
+        base = [make(v) for v in np.sort(rng.choice(10**6, 400, replace=False))]
+        node = GappedNode(lambda row: row[0], base, [(k, i) for i, k in enumerate(base)])
+        assert node.capacity > node.n_items == 400
+        live = list(base)
+        for v in rng.choice(10**6, 400, replace=False):
+            node.insert_item((make(v), -1))
+            live.append(make(v))
+        for k in live[:100]:
+            assert node.delete(k) >= 1
+        live = sorted(live[100:])
+        assert list(node.items()[0]) == live and node.min == live[0] and node.max == live[-1]
+        assert all(node.get(k)[0] == k for k in live[::7]) and node.get(make(-1)) is None
+    #a table of nodes: inserts fill gaps, full nodes split, equal keys stay in one node
+    keys = np.repeat(np.sort(rng.choice(10**6, 1500, replace=False)), 2)
+    df = pd.DataFrame({"uid": keys, "v": np.arange(len(keys))})
+    for factory in (None, lambda: PGMIndex(epsilon=4)):
+        db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", layout="gapped", node_size=50, index_factory=factory)
+        assert all(isinstance(node, GappedNode) for node in db_table.data) and db_table.n_rows == len(keys)
+        assert all(node.max < later.min for node, later in zip(db_table.data, db_table.data[1:]))
+        n_nodes = len(db_table.data)
+        extra = rng.choice(10**6, 4000)
+        for key in extra:
+            db_table.insert(pd.Series({"uid": key, "v": -1}))
+        assert len(db_table.data) > n_nodes and all(node.n_items <= 100 for node in db_table.data)
+        assert accuracy(db_table, np.concatenate([keys, extra])) == 1.0
+        everything = np.sort(np.concatenate([keys, extra]))
+        lo, hi = everything[100], everything[900]
+        assert [row[0] for row in db_table.select_range(lo, hi)] == [k for k in everything if lo <= k <= hi]
+        assert db_table.delete(keys[0]) == 2 + int((extra == keys[0]).sum()) and db_table.select(keys[0]) is None
+        db_table.rebuild(background=False)
+        assert len(db_table.get_data()) == db_table.n_rows == len(everything) - 2 - int((extra == keys[0]).sum())
+    print("PASSED TEST GAPPED LAYOUT")
+
+def test_node_adjustment(log=False):
+    keys = np.arange(0, 3000, 10.0)
+    node = GappedNode(lambda row: row, keys, list(keys))
+    #a fresh node fits its model exactly and has nothing to adjust
+    assert node.adjustment() is None and node.expected_cost() == node.cost()
+    assert node.adjustment(max_items=len(keys)) == "split"
+    #keys piling up in one spot cost more than the build promised: retrain, then expand
+    #until the node is full and still too slow, then split
+    actions = []
+    for key in np.linspace(1500, 1501, 400):
+        action = node.adjustment(max_items=10**6)
+        if action == "split":
+            break
+        if action is not None:
+            actions.append(action)
+            getattr(node, action)()
+        node.insert_item(key)
+    assert action == "split" and "retrain" in actions and node.cost() > node.expected_cost()
+    assert node.lookups > 0 and node.inserts > 0 and node.shifts > 0
+    left, right = node.split()
+    assert left.n_items + right.n_items == node.n_items and left.max < right.min
+    #the cost weights are the node's own and carry over to its halves
+    costs = dict(search_cost=1.0, search_step_cost=2.0, shift_cost=0.0)
+    node = GappedNode(lambda row: row, keys, list(keys), **costs)
+    for key in np.linspace(1500, 1501, 100):
+        node.insert_item(key)
+    assert node.shifts > 0 and node.cost() == 1.0 + 2.0 * node.search_steps / node.lookups
+    left, right = node.split()
+    assert all(getattr(half, name) == value for half in (left, right) for name, value in costs.items())
+    #a standalone node only ever expands
+    node = GappedNode(lambda row: row, keys, list(keys))
+    for key in np.linspace(1500, 1501, 400):
+        assert node.adjustment() in (None, "expand", "retrain")
+        node.insert_item(key)
+    #hash slots past depth_limit become gapped tables, which never nest again
+    rng = np.random.default_rng(37)
+    db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"uid": np.arange(0, 10**5, 500)}), sort_key="uid",
+                             index_factory=lambda: PGMIndex(epsilon=4), hash_size=2, depth_limit=1, node_size=16, node_costs=costs)
+    extra = rng.integers(0, 5000, 3000)
+    for key in extra:
+        db_table.insert(pd.Series({"uid": key}))
+    nested = [d for d in db_table.data if isinstance(d, table.DBTable)]
+    assert nested and all(inner.layout == "gapped" for inner in nested)
+    assert not any(isinstance(d, table.DBTable) for inner in nested for d in inner.data)
+    assert any(len(inner.data) > 1 for inner in nested)
+    assert all(node.shift_cost == 0.0 for inner in nested for node in inner.data)
+    assert accuracy(db_table, extra) == 1.0
+    print("PASSED TEST NODE ADJUSTMENT")
+
+def test_insert_many(log=False):
+    rng = np.random.default_rng(41)
+    keys = np.sort(rng.choice(10**6, 2000, replace=False))
+    df = pd.DataFrame({"uid": keys, "v": np.arange(len(keys)), "name": ["n%d" % k for k in keys]})
+    for layout, factory in (("hash", None), ("hash", lambda: PGMIndex(epsilon=4)), ("gapped", None), ("gapped", lambda: PGMIndex(epsilon=4))):
+        db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", layout=layout, node_size=32,
+                                 hash_size=2, depth_limit=2, index_factory=factory)
+        #new keys, keys already loaded and repeats within the batch, columns in another order
+        batch = pd.DataFrame({"name": "new", "v": -1, "uid": np.concatenate([rng.integers(0, 10**6, 3000), rng.choice(keys, 500), [7, 7, 7]])})
+        db_table.insert_many(batch.iloc[:100])
+        #rows inserted during a rebuild are replayed into the new layout as a batch
+        snapshot = db_table._begin_rebuild()
+        db_table.insert_many(batch.iloc[100:])
+        db_table._finish_rebuild(db_table._build_layout(snapshot))
+        everything = np.sort(np.concatenate([keys, batch["uid"]]))
+        assert sorted(db_table.get_data()["uid"].tolist()) == everything.tolist()
+        assert db_table.n_rows == len(everything) and (db_table.min_key, db_table.max_key) == (everything[0], everything[-1])
+        assert accuracy(db_table, batch["uid"]) == 1.0 and accuracy(db_table, keys) == 1.0
+        assert list(db_table.select(7)) == [7, -1, "new"]
+    #the same slots as inserting the rows one at a time
+    one_by_one = table.DBTable(file_name=None, from_data=df, sort_key="uid")
+    batched = table.DBTable(file_name=None, from_data=df, sort_key="uid")
+    batch = pd.DataFrame({"uid": rng.integers(0, 10**6, 300), "v": 0, "name": "x"})
+    for i in range(len(batch)):
+        one_by_one.insert(batch.iloc[i])
+    batched.insert_many(batch)
+    assert (one_by_one.li.keys == batched.li.keys).all() and len(one_by_one.data) == len(batched.data)
+    print("PASSED TEST INSERT MANY")
+
+def test_select_many(log=False):
+    rng = np.random.default_rng(43)
+    keys = np.sort(rng.choice(10**6, 2000, replace=False))
+    df = pd.DataFrame({"uid": keys, "score": keys / 2, "name": ["n%d" % k for k in keys]})
+    for layout, factory in (("hash", None), ("hash", lambda: PGMIndex(epsilon=4)), ("gapped", None)):
+        db_table = table.DBTable(file_name=None, from_data=df, sort_key="uid", layout=layout, node_size=32,
+                                 hash_size=2, depth_limit=2, index_factory=factory)
+        extra = rng.integers(0, 10**6, 2000)
+        db_table.insert_many(pd.DataFrame({"uid": extra, "score": -1.0, "name": "new"}))
+        #hits, misses and keys outside the table, unsorted and repeated
+        query = np.concatenate([rng.choice(keys, 300), rng.choice(extra, 100), rng.integers(0, 10**6, 100), [-1, 10**7, keys[0], keys[0]]])
+        rows, found = db_table.select_many(query)
+        assert len(rows) == len(found) == len(query) and list(rows.columns) == ["uid", "score", "name"]
+        for i, key in enumerate(query):
+            row = db_table.select(key)
+            assert found[i] == (row is not None)
+            if row is not None:
+                assert list(rows.iloc[i]) == list(row)
+            else:
+                assert rows.iloc[i].isna().all()
+        if factory is not None:
+            assert any(isinstance(d, table.DBTable) for d in db_table.data)
+    #a hash probed with a large batch routes it with NumPy, with either hash function
+    for hash_fn in ("splitmix64", "sha256"):
+        hash_ds = ExtensibleHash.from_items([(int(k), i) for i, k in enumerate(keys)], lambda row: row[0], init_size=4, hash_fn=hash_fn)
+        query = np.concatenate([rng.choice(keys, 200), rng.integers(-10, 10**6 + 10, 200)])
+        assert hash_ds.get_many(query) == [hash_ds.get(key) for key in query.tolist()]
+    assert ExtensibleHash.from_items([("a",)], lambda row: row[0]).get_many(query) == [None] * len(query)
+    #non-numeric keys and an empty query
+    db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"name": ["b", "d", "f"], "v": [1, 2, 3]}), sort_key="name")
+    rows, found = db_table.select_many(["f", "a", "b", "c"])
+    assert found.tolist() == [True, False, True, False] and rows["v"].tolist()[::2] == [3, 1]
+    rows, found = db_table.select_many([])
+    assert len(rows) == 0 and len(found) == 0
+    print("PASSED TEST SELECT MANY")
+
+def test_table_rebuild(log=False):
+    rng = np.random.default_rng(7)
+    keys = np.unique(rng.integers(0, 10**9, size=6000))
+    rng.shuffle(keys)
+    base, late, during = keys[:3000], keys[3000:4500], keys[4500:]
+    db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"uid": base}), sort_key="uid",
+                             index_factory=lambda: PGMIndex(epsilon=8), hash_size=4, depth_limit=2)
+    for key in late:
+        db_table.insert(pd.Series({"uid": key}))
+    #rows inserted between the snapshot and the swap go through the delta
+    snapshot = db_table._begin_rebuild()
+    for key in during:
+        db_table.insert(pd.Series({"uid": key}))
+    assert accuracy(db_table, during) == 1.0
+    layout = db_table._build_layout(snapshot)
+    db_table._finish_rebuild(layout)
+    assert db_table._rebuild_delta is None
+    assert accuracy(db_table, keys) == 1.0
+    #one slot per row of the snapshot, the delta was inserted on top
+    assert len(db_table.data) == 4500 and len(db_table.get_data()) == 6000
+    #background rebuild while reading
+    worker = db_table.rebuild(background=True)
+    assert accuracy(db_table, keys[::5]) == 1.0
+    worker.join()
+    assert len(db_table.data) == 6000 and accuracy(db_table, keys) == 1.0
+    #rebuilds start on their own past rebuild_threshold
+    db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"uid": base}), sort_key="uid", rebuild_threshold=0.1)
+    for key in late[:400]:
+        db_table.insert(pd.Series({"uid": key}))
+    db_table._rebuild_thread.join()
+    assert accuracy(db_table, np.concatenate([base, late[:400]])) == 1.0
+    #the rows logged during a rebuild count towards the next one, batches by their size and deletes not at all
+    db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"uid": base}), sort_key="uid")
+    snapshot = db_table._begin_rebuild()
+    db_table.insert_many(pd.DataFrame({"uid": late[:300]}))
+    db_table.insert(pd.Series({"uid": late[300]}))
+    db_table.delete(base[0])
+    db_table._finish_rebuild(db_table._build_layout(snapshot))
+    assert db_table._inserted_rows == 301 and db_table._built_rows == 3000
+    assert accuracy(db_table, late[:301]) == 1.0 and db_table.select(base[0]) is None
+    print("PASSED TEST TABLE REBUILD")
+
+def test_concurrent_reads(log=False):
+    #selects running while inserts shift slots, split nodes and overflow buckets must never miss a loaded key
+    import threading
+    rng = np.random.default_rng(11)
+    keys = np.sort(rng.choice(10**8, 5000, replace=False))
+    new_keys = rng.integers(0, 10**8, size=1500)
+    for options in (dict(slot_per_key=True), dict(layout="gapped", node_size=64), dict(depth_limit=1, hash_size=2)):
+        db_table = table.DBTable(file_name=None, from_data=pd.DataFrame({"uid": keys}), sort_key="uid", **options)
+        done = threading.Event()
+        misses, reads = [], []
+        def reader(seed):
+            queries = np.random.default_rng(seed).choice(keys, 500)
+            n = 0
+            while not done.is_set():
+                misses.extend(key for key in queries[n % 50::50].tolist() if db_table.select(key) is None)
+                rows, found = db_table.select_many(queries)
+                misses.extend(queries[~found].tolist())
+                n += 1
+            reads.append(n)
+        readers = [threading.Thread(target=reader, args=(seed,)) for seed in (1, 2)]
+        for thread in readers:
+            thread.start()
+        for key in new_keys:
+            db_table.insert(pd.Series({"uid": key}))
+        done.set()
+        for thread in readers:
+            thread.join()
+        if log:
+            print(options, "reads", reads, "misses", len(misses))
+        assert not misses and min(reads) > 0
+        assert accuracy(db_table, np.concatenate([keys, new_keys])) == 1.0
+    print("PASSED TEST CONCURRENT READS")
+
 def accuracy(tb: table.DBTable, sequence=list):
     accuracy = 0
     n = len(sequence)
@@ -54,6 +868,33 @@ def accuracy(tb: table.DBTable, sequence=list):
         
 if __name__ == "__main__":
     print('IN TESTS')
+    test_rmi_vectorized_fit()
+    test_rmi_lookup_many()
+    test_rmi_error_bounds()
+    test_rmi_save_load()
+    test_rmi_tuning()
+    test_pgm_index()
+    test_radix_spline()
+    test_rmi_incremental_retrain()
+    test_rmi_parallel_fit()
+    test_rmi_leaf_models()
+    test_table_rebuild()
+    test_select_range()
+    test_empty_table()
+    test_non_numeric_keys()
+    test_hash_functions()
+    test_hash_directory()
+    test_bucket_fingerprints()
+    test_hash_from_items()
+    test_hash_overflow_pages()
+    test_delete()
+    test_slot_filters()
+    test_bulk_load()
+    test_gapped_layout()
+    test_node_adjustment()
+    test_insert_many()
+    test_select_many()
+    test_concurrent_reads()
     # test_hasher_with_tuples()
     # test_hasher_with_tuples_extraction()
     table.test_table_growth(accuracy_test=accuracy, log=False)
\ No newline at end of file